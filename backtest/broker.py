@@ -0,0 +1,90 @@
+import itertools
+from brokers.base_broker import BaseBroker
+from utils.logger import logger
+from utils.utils import contract_multiplier
+
+
+class SimulatedBroker(BaseBroker):
+    '''A broker account that fills every order at once at the historical price.
+
+    Orders go through BaseBroker like a live broker's, so trades, cash
+    balances and positions are written exactly as in production, at the
+    simulated fill price. The account's own cash and holdings are kept in
+    memory for get_positions and account info. now() follows the clock, so
+    market hours checks and timestamps follow the bars being replayed.
+    '''
+    def __init__(self, engine, history, clock, cash, broker_name='backtest', slippage_bps=0.0):
+        super().__init__(None, None, broker_name, engine)
+        self.history = history
+        self.clock = clock
+        self.cash = cash
+        self.slippage_bps = slippage_bps
+        self.holdings = {}
+        self.order_ids = itertools.count(1)
+        self.fills = {}
+
+    def connect(self):
+        pass
+
+    def now(self, tz=None):
+        # Naive UTC like the bar timestamps the trades are stamped with
+        now = self.clock()
+        return now.astimezone(tz) if tz is not None else now.replace(tzinfo=None)
+
+    def price(self, symbol):
+        return self.history.price(symbol, self.clock())
+
+    def get_current_price(self, symbol):
+        return self.price(symbol)
+
+    def get_positions(self):
+        return {symbol: {'quantity': quantity} for symbol, quantity in self.holdings.items() if quantity}
+
+    def account_value(self):
+        return self.cash + sum(quantity * (self.price(symbol) or 0) * contract_multiplier(symbol)
+                               for symbol, quantity in self.holdings.items())
+
+    def _get_account_info(self):
+        value = self.account_value()
+        return {'value': value, 'cash_available': self.cash, 'buying_power': self.cash}
+
+    def _fill(self, symbol, quantity, side):
+        market_price = self.price(symbol)
+        if market_price is None:
+            raise ValueError(f"No price for {symbol} at {self.clock()}")
+        slippage = market_price * self.slippage_bps / 10000
+        filled_price = market_price + slippage if side == 'buy' else market_price - slippage
+        signed = quantity if side == 'buy' else -quantity
+        self.holdings[symbol] = self.holdings.get(symbol, 0) + signed
+        self.cash -= signed * filled_price * contract_multiplier(symbol)
+        order_id = next(self.order_ids)
+        self.fills[order_id] = {'status': 'filled', 'filled_price': filled_price}
+        logger.debug('Simulated fill', extra={'symbol': symbol, 'quantity': quantity, 'side': side, 'filled_price': filled_price})
+        return {'order_id': order_id, 'filled_price': filled_price}
+
+    async def _place_order_generic(self, symbol, quantity, side, strategy, price, multiplier, broker_order_func,
+                                   order_type='limit', execution_style=''):
+        # Without a price the trade and cash balance take the fill price, slippage included
+        return await super()._place_order_generic(symbol, quantity, side, strategy, None, multiplier, broker_order_func,
+                                                  order_type, execution_style)
+
+    def _place_order(self, symbol, quantity, side, price=None, order_type='limit', execution_style=''):
+        return self._fill(symbol, quantity, side)
+
+    def _place_option_order(self, symbol, quantity, side, price=None, order_type='limit'):
+        return self._fill(symbol, quantity, side)
+
+    def _place_future_option_order(self, symbol, quantity, side, price=None, order_type='limit'):
+        return self._fill(symbol, quantity, side)
+
+    def _is_order_filled(self, order_id):
+        return order_id in self.fills
+
+    def _get_order_status(self, order_id):
+        return self.fills.get(order_id, {'status': 'rejected'})
+
+    def _cancel_order(self, order_id):
+        return {'status': 'filled'} if order_id in self.fills else None
+
+    def _get_options_chain(self, symbol, expiration_date):
+        return [row for row in self.history.option_chain(symbol, self.clock()) if str(row['expiration']) == str(expiration_date)]
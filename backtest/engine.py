@@ -0,0 +1,154 @@
+'''Replays local market history through unmodified strategies.
+
+Strategies are built from a regular strategies config and trade through a
+SimulatedBroker against an in-memory SQLite database. Time is virtual: the
+broker's clock is moved to each bar in turn, and strategies read the time
+and prices from their broker, so market hours checks, trade timestamps and
+rebalance intervals follow the history instead of the wall clock.
+'''
+import csv
+import logging
+import numpy as np
+from sqlalchemy import select, update
+from backtest.broker import SimulatedBroker
+from backtest.sqlite import create_inline_engine
+from database.models import Trade, init_db
+from strategies.context import StrategyContext
+from strategies.executor import StrategyExecutor
+from utils.config import initialize_strategy
+from utils.logger import logger
+from utils.stats import value_at_risk, max_drawdown, sharpe_ratio, equity_max_drawdown
+from utils.utils import contract_multiplier
+
+BACKTEST_BROKER = 'backtest'
+
+
+class BacktestResult:
+    def __init__(self, timestamps, equity, trades, errors):
+        self.timestamps = timestamps
+        # Equity curve of each strategy, one value per timestamp
+        self.equity = equity
+        # Filled trades of each strategy in order
+        self.trades = trades
+        self.errors = errors
+
+    def stats(self):
+        stats = {}
+        for name, curve in self.equity.items():
+            profit_losses = [trade.profit_loss for trade in self.trades[name]]
+            stats[name] = {
+                'trades': len(self.trades[name]),
+                'errors': self.errors[name],
+                'final_equity': float(curve[-1]),
+                'total_return': float(curve[-1] / curve[0] - 1) if curve[0] else 0.0,
+                'sharpe_ratio': float(sharpe_ratio(profit_losses)),
+                'max_drawdown': float(max_drawdown(profit_losses)),
+                'var': float(value_at_risk(profit_losses)),
+                'equity_max_drawdown': equity_max_drawdown(curve),
+            }
+        return stats
+
+    def to_csv(self, path):
+        names = list(self.equity)
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['timestamp'] + names)
+            for step, timestamp in enumerate(self.timestamps):
+                writer.writerow([timestamp.isoformat()] + [float(self.equity[name][step]) for name in names])
+
+
+class Backtester:
+    '''Runs strategies over MarketHistory bar by bar.
+
+    On every bar the strategies whose rebalance interval has passed are
+    rebalanced, their orders are filled at the bar's close and the
+    positions updated as the order manager would, and each strategy's
+    equity (cash plus its positions at the bar's prices) is recorded.
+    '''
+    def __init__(self, strategies_config, history, start=None, end=None, cash=None, slippage_bps=0.0,
+                 log_level='WARNING'):
+        self.strategies_config = strategies_config
+        self.history = history
+        self.start = start
+        self.end = end
+        self.cash = cash if cash is not None else sum(config['starting_capital'] for config in strategies_config.values())
+        self.slippage_bps = slippage_bps
+        self.log_level = log_level
+        self.now = None
+
+    def clock(self):
+        return self.now
+
+    async def run(self):
+        timeline = self.history.timeline(self.start, self.end)
+        if not timeline:
+            raise ValueError(f"No bars between {self.start} and {self.end}")
+        engine = create_inline_engine()
+        level = logger.level
+        # Per-order logging would dominate the run time
+        logger.setLevel(logging.getLevelName(self.log_level) if isinstance(self.log_level, str) else self.log_level)
+        self.now = timeline[0]
+        try:
+            await init_db(engine)
+            broker = SimulatedBroker(engine, self.history, self.clock, self.cash, broker_name=BACKTEST_BROKER,
+                                     slippage_bps=self.slippage_bps)
+            strategies = {}
+            for name, config in self.strategies_config.items():
+                strategies[name] = await initialize_strategy(name, config['type'], broker, config)
+            executor = StrategyExecutor(strategies)
+            contexts = {name: await self._load_context(broker, name) for name in strategies}
+            equity = {name: np.empty(len(timeline)) for name in strategies}
+            errors = {name: 0 for name in strategies}
+
+            orders = 0
+            for step, timestamp in enumerate(timeline):
+                self.now = timestamp
+                now = broker.now()
+                # Most bars only need marking to market
+                due = executor.due(now)
+                if due:
+                    for name, status in (await executor.run(due, now)).items():
+                        errors[name] += status != 'ok'
+                # Cash and positions only change when orders were placed
+                if len(broker.fills) != orders:
+                    orders = len(broker.fills)
+                    for name in await self._fill_open_trades(broker):
+                        contexts[name] = await self._load_context(broker, name)
+                for name, context in contexts.items():
+                    equity[name][step] = self._equity(broker, context)
+
+            trades = await self._trades(broker, strategies)
+            return BacktestResult(timeline, equity, trades, errors)
+        finally:
+            logger.setLevel(level)
+            await engine.dispose()
+
+    async def _load_context(self, broker, name):
+        async with broker.Session() as session:
+            return await StrategyContext.load(session, name, broker.broker_name)
+
+    async def _fill_open_trades(self, broker):
+        '''Fill every open trade as the order manager would; returns the strategies that traded'''
+        async with broker.Session() as session:
+            result = await session.execute(
+                select(Trade.id, Trade.strategy).filter_by(broker=broker.broker_name, status='open').order_by(Trade.id)
+            )
+            trades = result.all()
+            await session.execute(update(Trade).where(Trade.id.in_([trade_id for trade_id, _ in trades])).values(status='filled'))
+            await session.commit()
+            for trade_id, _ in trades:
+                await broker.update_positions(trade_id, session)
+        return {strategy for _, strategy in trades}
+
+    def _equity(self, broker, context):
+        # Positions at the bar's prices, per contract as the broker charges cash for them
+        return context.cash + sum(position.quantity * (broker.price(symbol) or 0) * contract_multiplier(symbol)
+                                  for symbol, position in context.positions.items())
+
+    async def _trades(self, broker, strategies):
+        async with broker.Session() as session:
+            result = await session.execute(
+                select(Trade).filter_by(broker=broker.broker_name, status='filled').order_by(Trade.id)
+            )
+            trades = result.scalars().all()
+        return {name: [trade for trade in trades if trade.strategy == name] for name in strategies}
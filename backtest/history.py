@@ -0,0 +1,117 @@
+'''Historical bars and option chains read from local files.
+
+    <path>/bars/<SYMBOL>.csv|.parquet             timestamp, open, high, low, close[, volume]
+    <path>/options/<SYMBOL>/<YYYY-MM-DD>.csv|.parquet   one chain snapshot per day:
+        contractSymbol, expiration, type (call/put), strike, bid, ask, lastPrice
+
+Timestamps are UTC. Bars are kept as NumPy arrays per symbol, so the price
+as of a virtual time is a binary search.
+'''
+import os
+import bisect
+from datetime import datetime, date, time, timezone
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from utils.utils import is_option
+
+FILE_TYPES = ('.csv', '.parquet')
+
+
+def _read_table(path):
+    if path.endswith('.parquet'):
+        return pq.read_table(path)
+    return pa_csv.read_csv(path)
+
+
+def _epoch_ns(column):
+    # Naive timestamps are taken as UTC
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        column = column.cast(pa.timestamp('ns'))
+    return column.cast(pa.timestamp('ns', tz=column.type.tz)).cast(pa.int64()).to_numpy()
+
+
+def _to_ns(ts):
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    elif not isinstance(ts, datetime):
+        ts = datetime.combine(ts, time())
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1_000_000) * 1000
+
+
+def _listing(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path) if name.endswith(FILE_TYPES))
+
+
+class MarketHistory:
+    def __init__(self, path):
+        self.path = path
+        self.times = {}
+        self.closes = {}
+        for name in _listing(os.path.join(path, 'bars')):
+            symbol = os.path.splitext(name)[0]
+            table = _read_table(os.path.join(path, 'bars', name))
+            times = _epoch_ns(table.column('timestamp'))
+            order = np.argsort(times, kind='stable')
+            self.times[symbol] = times[order]
+            self.closes[symbol] = table.column('close').to_numpy().astype(float)[order]
+        # Chain snapshots are read the first time they are asked for
+        self.chain_days = {}
+        self.chain_files = {}
+        self.chains = {}
+        options_path = os.path.join(path, 'options')
+        for symbol in sorted(os.listdir(options_path)) if os.path.isdir(options_path) else []:
+            files = _listing(os.path.join(options_path, symbol))
+            self.chain_days[symbol] = [date.fromisoformat(os.path.splitext(name)[0]) for name in files]
+            self.chain_files[symbol] = [os.path.join(options_path, symbol, name) for name in files]
+
+    @property
+    def symbols(self):
+        return sorted(self.times)
+
+    def timeline(self, start=None, end=None, symbols=None):
+        '''Sorted UTC timestamps of every bar of symbols between start and end'''
+        arrays = [self.times[symbol] for symbol in (symbols or self.symbols) if symbol in self.times]
+        if not arrays:
+            return []
+        times = np.unique(np.concatenate(arrays))
+        if start is not None:
+            times = times[times >= _to_ns(start)]
+        if end is not None:
+            times = times[times <= _to_ns(end)]
+        return [datetime.fromtimestamp(ns / 1e9, tz=timezone.utc) for ns in times.tolist()]
+
+    def price(self, symbol, ts):
+        '''Close of the last bar at or before ts, or the last traded price of an option contract'''
+        if is_option(symbol):
+            option = self.option_quote(symbol, ts)
+            return option['lastPrice'] if option else None
+        times = self.times.get(symbol)
+        if times is None:
+            return None
+        index = np.searchsorted(times, _to_ns(ts), side='right') - 1
+        return float(self.closes[symbol][index]) if index >= 0 else None
+
+    def option_chain(self, symbol, ts):
+        '''Rows of the latest chain snapshot of symbol taken on or before ts'''
+        days = self.chain_days.get(symbol, [])
+        index = bisect.bisect_right(days, ts.date()) - 1
+        if index < 0:
+            return []
+        key = (symbol, days[index])
+        if key not in self.chains:
+            self.chains[key] = _read_table(self.chain_files[symbol][index]).to_pylist()
+        return self.chains[key]
+
+    def option_quote(self, contract_symbol, ts):
+        underlying = contract_symbol[:-15]
+        for row in self.option_chain(underlying, ts):
+            if row['contractSymbol'] == contract_symbol:
+                return row
+        return None
+
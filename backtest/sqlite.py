@@ -0,0 +1,84 @@
+'''An in-memory SQLite engine for backtests that runs statements inline.
+
+aiosqlite runs every statement on a worker thread and hands the result back
+to the event loop, which costs several loop iterations per statement. A
+backtest is one coroutine chain over a private in-memory database, so the
+hop buys nothing: InlineConnection offers the part of aiosqlite's
+interface SQLAlchemy's aiosqlite dialect uses and runs each call directly
+on the sqlite3 connection.
+'''
+import sqlite3
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+class InlineCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    async def execute(self, operation, parameters=()):
+        self._cursor.execute(operation, parameters)
+        return self
+
+    async def executemany(self, operation, seq_of_parameters):
+        self._cursor.executemany(operation, seq_of_parameters)
+        return self
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    async def close(self):
+        self._cursor.close()
+
+
+class InlineConnection:
+    def __init__(self, connection):
+        self._conn = connection
+
+    @property
+    def isolation_level(self):
+        return self._conn.isolation_level
+
+    async def cursor(self):
+        return InlineCursor(self._conn.cursor())
+
+    async def execute(self, *args, **kwargs):
+        return InlineCursor(self._conn.execute(*args, **kwargs))
+
+    async def create_function(self, *args, **kwargs):
+        self._conn.create_function(*args, **kwargs)
+
+    async def commit(self):
+        self._conn.commit()
+
+    async def rollback(self):
+        self._conn.rollback()
+
+    async def close(self):
+        self._conn.close()
+
+
+async def _connect():
+    return InlineConnection(sqlite3.connect(':memory:', check_same_thread=False))
+
+
+def create_inline_engine():
+    '''AsyncEngine over a single private in-memory SQLite database'''
+    return create_async_engine('sqlite+aiosqlite:///:memory:', async_creator=_connect)
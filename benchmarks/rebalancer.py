@@ -0,0 +1,74 @@
+'''CPU time of sizing one rebalance, per-symbol loop vs vectorized.
+
+    python -m benchmarks.rebalancer --symbols 500
+
+The loop is the shape ConstantPercentageStrategy.rebalance used to have: for
+every allocated symbol it scans the strategy's positions for the current
+quantity, then compares it with the target. The vectorized run sizes the
+same orders with strategies.rebalancer.rebalance_orders. Prices are given,
+so only the sizing is timed, not the price fetches.
+'''
+import argparse
+import time
+import numpy as np
+from strategies.rebalancer import rebalance_orders
+
+
+class Position:
+    def __init__(self, symbol, quantity):
+        self.symbol = symbol
+        self.quantity = quantity
+
+
+def loop_orders(allocations, prices, positions, investable, buffer):
+    orders = []
+    for symbol, allocation in allocations.items():
+        current = 0
+        for position in positions:
+            if position.symbol == symbol:
+                current = position.quantity
+        target = investable * allocation // prices[symbol]
+        if current < target * (1 - buffer):
+            orders.append((symbol, target - current, 'buy', prices[symbol]))
+        elif current > target * (1 + buffer):
+            orders.append((symbol, current - target, 'sell', prices[symbol]))
+    return orders
+
+
+def best_of(repeat, func, *args, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark target-weight rebalancing')
+    parser.add_argument('--symbols', type=int, default=500, help='Number of allocated symbols')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per implementation; the best is reported')
+    parser.add_argument('--buffer', type=float, default=0.1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    symbols = [f'SYM{i}' for i in range(args.symbols)]
+    weights = rng.dirichlet(np.ones(args.symbols))
+    prices = rng.uniform(5, 500, args.symbols)
+    quantities = rng.integers(0, 200, args.symbols)
+    investable = 10_000_000
+
+    allocations = dict(zip(symbols, weights))
+    price_map = dict(zip(symbols, prices))
+    positions = [Position(symbol, int(quantity)) for symbol, quantity in zip(symbols, quantities)]
+
+    loop_ms = best_of(args.repeat, loop_orders, allocations, price_map, positions, investable, args.buffer)
+    vector_ms = best_of(args.repeat, rebalance_orders, symbols, weights, prices, quantities, investable, buffer=args.buffer)
+    print(f"{'implementation':<16}{'ms':>10}")
+    print(f"{'loop':<16}{loop_ms:>10.3f}")
+    print(f"{'vectorized':<16}{vector_ms:>10.3f}")
+    print(f'speedup {loop_ms / max(vector_ms, 1e-6):.0f}x')
+
+
+if __name__ == '__main__':
+    main()
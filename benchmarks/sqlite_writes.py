@@ -0,0 +1,119 @@
+'''Concurrent order-write throughput on SQLite, default vs tuned engine.
+
+    python -m benchmarks.sqlite_writes --processes 4 --writers 8 --orders 100
+
+Starts --processes processes, like the trade, sync and manager deployments
+sharing one SQLite file, each running --writers concurrent asyncio writers,
+plus --readers processes that keep aggregating the balance history the way
+the dashboard does. Every order reads the strategy's latest cash balance and
+then writes a trade and a balance in one transaction, the same shape as
+BaseBroker._place_order_generic. The run is repeated with plain engines and
+with the tuned engines from database.engines, and reports committed orders
+per second and "database is locked" failures.
+'''
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from database.models import Base, Trade, Balance, BalanceLatest
+from database.engines import get_async_engine, get_engine
+
+PROFILES = ('default', 'tuned')
+
+
+async def place_orders(Session, strategy, orders):
+    committed = locked = 0
+    for _ in range(orders):
+        try:
+            async with Session() as session:
+                latest = (await session.execute(
+                    select(BalanceLatest).filter_by(broker='tradier', strategy=strategy, type='cash')
+                )).scalar()
+                cash = latest.balance if latest else 100000.0
+                now = datetime.now()
+                session.add(Trade(symbol='AAPL', quantity=1, price=100.0, side='buy', status='open',
+                                  broker='tradier', strategy=strategy, timestamp=now))
+                session.add(Balance(broker='tradier', strategy=strategy, type='cash', balance=cash - 100.0, timestamp=now))
+                await session.commit()
+            committed += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    return committed, locked
+
+
+async def run_writers(profile, url, process_index, writers, orders):
+    engine = create_async_engine(url) if profile == 'default' else get_async_engine(url)
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    results = await asyncio.gather(*[
+        place_orders(Session, f'strategy_{process_index}_{writer}', orders) for writer in range(writers)
+    ])
+    await engine.dispose()
+    return tuple(map(sum, zip(*results)))
+
+
+def worker(args):
+    return asyncio.run(run_writers(*args))
+
+
+def read_history(profile, path, stop):
+    url = f'sqlite:///{path}'
+    engine = create_engine(url) if profile == 'default' else get_engine(url)
+    query = select(Balance.strategy, func.count(Balance.id), func.max(Balance.balance)).group_by(Balance.strategy)
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                conn.execute(query).all()
+        except OperationalError:
+            pass
+    engine.dispose()
+
+
+def run_profile(profile, processes, writers, orders, readers):
+    path = os.path.join(tempfile.mkdtemp(), 'writes_benchmark.db')
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    reader_processes = [context.Process(target=read_history, args=(profile, path, stop)) for _ in range(readers)]
+    for process in reader_processes:
+        process.start()
+
+    url = f'sqlite+aiosqlite:///{path}'
+    started = time.perf_counter()
+    with context.Pool(processes) as pool:
+        results = pool.map(worker, [(profile, url, index, writers, orders) for index in range(processes)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for process in reader_processes:
+        process.join()
+    committed, locked = map(sum, zip(*results))
+    return committed, locked, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent SQLite order writes')
+    parser.add_argument('--processes', type=int, default=4, help='Writer processes sharing the database file')
+    parser.add_argument('--writers', type=int, default=8, help='Concurrent asyncio writers per process')
+    parser.add_argument('--orders', type=int, default=100, help='Orders placed by each writer')
+    parser.add_argument('--readers', type=int, default=1, help='Dashboard reader processes')
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'committed':>12}{'locked':>10}{'seconds':>10}{'orders/s':>12}")
+    for profile in PROFILES:
+        committed, locked, elapsed = run_profile(profile, args.processes, args.writers, args.orders, args.readers)
+        print(f'{profile:<10}{committed:>12}{locked:>10}{elapsed:>10.1f}{committed / elapsed:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
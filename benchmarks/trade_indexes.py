@@ -0,0 +1,115 @@
+'''Time the hot trades/positions queries with and without the index set.
+
+    python -m benchmarks.trade_indexes --rows 10000000
+
+Builds a trades table in a scratch database (SQLite by default, or --url),
+times each query shape without secondary indexes, creates the indexes and
+times them again. Only a small fraction of trades is left open, like in
+production where almost every trade is eventually filled or cancelled.
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, select, func, text
+from database.models import Base, Trade, Position
+
+BROKERS = ['tradier', 'tastytrade', 'alpaca', 'kraken']
+STRATEGIES = [f'strategy_{i}' for i in range(20)]
+SYMBOLS = [f'SYM{i}' for i in range(2000)]
+CHUNK_SIZE = 50000
+OPEN_FRACTION = 0.0005
+
+
+def hot_queries(now):
+    return {
+        'open trades': select(Trade).filter_by(status='open'),
+        'has_bought_today': select(Trade).where(
+            Trade.symbol == 'SYM42', Trade.broker == 'tradier', Trade.side == 'buy',
+            Trade.timestamp >= now.replace(hour=0, minute=0, second=0, microsecond=0)),
+        'strategy stats': select(func.count(Trade.id), func.sum(Trade.profit_loss)).filter_by(
+            strategy='strategy_7', broker='tastytrade'),
+        'by broker_id': select(Trade).filter_by(broker_id=123456),
+        'position lookup': select(Position).filter_by(broker='tradier', strategy='strategy_7', symbol='SYM42'),
+    }
+
+
+def populate(engine, rows, now):
+    rng = random.Random(0)
+    start = now - timedelta(days=365 * 3)
+    step = (now - start) / rows
+    with engine.begin() as conn:
+        for offset in range(0, rows, CHUNK_SIZE):
+            conn.execute(Trade.__table__.insert(), [{
+                'broker_id': i,
+                'symbol': rng.choice(SYMBOLS),
+                'quantity': rng.randint(1, 100),
+                'price': 100.0,
+                'executed_price': 100.0,
+                'side': rng.choice(('buy', 'sell')),
+                'status': 'open' if rng.random() < OPEN_FRACTION else 'filled',
+                'timestamp': start + step * i,
+                'broker': rng.choice(BROKERS),
+                'strategy': rng.choice(STRATEGIES),
+            } for i in range(offset, min(offset + CHUNK_SIZE, rows))])
+        conn.execute(Position.__table__.insert(), [{
+            'broker': broker, 'strategy': strategy, 'symbol': symbol, 'quantity': 1, 'latest_price': 100.0
+        } for broker in BROKERS for strategy in STRATEGIES for symbol in SYMBOLS[:100]])
+
+
+def time_queries(engine, queries, repeat):
+    timings = {}
+    with engine.connect() as conn:
+        for name, query in queries.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(query).all()
+            timings[name] = (time.perf_counter() - started) / repeat * 1000
+    return timings
+
+
+def set_indexes(engine, create):
+    with engine.begin() as conn:
+        for table in (Trade.__table__, Position.__table__):
+            for index in table.indexes:
+                if create:
+                    index.create(conn, checkfirst=True)
+                else:
+                    index.drop(conn, checkfirst=True)
+        if engine.dialect.name == 'sqlite':
+            conn.execute(text('ANALYZE'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trades/positions index set')
+    parser.add_argument('--rows', type=int, default=10_000_000, help='Number of trades to generate')
+    parser.add_argument('--repeat', type=int, default=5, help='Executions per query')
+    parser.add_argument('--url', help='Scratch database URL (tables are dropped and recreated)')
+    args = parser.parse_args()
+
+    url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'trades_benchmark.db')}"
+    engine = create_engine(url)
+    now = datetime.now()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    set_indexes(engine, create=False)
+
+    started = time.perf_counter()
+    populate(engine, args.rows, now)
+    print(f'Inserted {args.rows} trades in {time.perf_counter() - started:.1f}s')
+
+    queries = hot_queries(now)
+    before = time_queries(engine, queries, args.repeat)
+    set_indexes(engine, create=True)
+    after = time_queries(engine, queries, args.repeat)
+
+    print(f"{'query':<20}{'no index (ms)':>16}{'indexed (ms)':>16}{'speedup':>10}")
+    for name in queries:
+        print(f'{name:<20}{before[name]:>16.2f}{after[name]:>16.2f}{before[name] / max(after[name], 1e-6):>9.0f}x')
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
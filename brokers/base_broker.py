@@ -5,9 +5,13 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import and_
 from sqlalchemy import select
 from database.db_manager import DBManager
+from database.cash_ledger import CashLedger
 from database.models import Trade, AccountInfo, Position, Balance
 from datetime import datetime
+import time
+from functools import partial
 from utils.logger import logger
+from utils.latency import latency_tracker, asset_class, decision_started
 from utils.utils import is_option, OPTION_MULTIPLIER, is_futures_symbol, futures_contract_size
 
 
@@ -32,6 +36,9 @@ class BaseBroker(ABC):
             expire_on_commit=True)
         self.account_id = None
         self.prevent_day_trading = prevent_day_trading
+        self.cash_ledger = CashLedger(self.broker_name)
+        # Optional WriteBehindQueue shared by brokers, see utils.config
+        self.write_queue = None
         logger.debug(
             'Initialized BaseBroker', extra={
                 'broker_name': self.broker_name})
@@ -40,6 +47,10 @@ class BaseBroker(ABC):
     def connect(self):
         pass
 
+    def now(self, tz=None):
+        '''The time orders, positions and balances are stamped with; a simulated broker returns its own clock'''
+        return datetime.now(tz)
+
     def get_cost_basis(self, symbol):
         """
         Retrieve the cost basis for a specific position (symbol) from the broker.
@@ -120,7 +131,7 @@ class BaseBroker(ABC):
 
     async def has_bought_today(self, symbol):
         try:
-            today = datetime.now().date()
+            today = self.now().date()
             logger.debug('Checking if bought today', extra={'symbol': symbol})
 
             async with self.Session() as session:
@@ -130,7 +141,7 @@ class BaseBroker(ABC):
                     .filter(Trade.timestamp >= today)
                 )
                 trade = result.scalars().first()
-                return trade is not None
+            return trade is not None
         except Exception as e:
             logger.error(
                 'Failed to check if bought today', extra={
@@ -226,7 +237,7 @@ class BaseBroker(ABC):
                             abs(trade.quantity)
                         position.quantity += trade.quantity  # Add back the covered quantity
                         position.latest_price = float(trade.executed_price)
-                        position.timestamp = datetime.now()
+                        position.timestamp = self.now()
                         logger.info(
                             'Updating position with new quantity and cost basis',
                             extra={
@@ -261,7 +272,7 @@ class BaseBroker(ABC):
                             position.cost_basis += cost_increment
                         position.quantity += trade.quantity
                         position.latest_price = float(trade.executed_price)
-                        position.timestamp = datetime.now()
+                        position.timestamp = self.now()
                         session.add(position)
                     else:
                         # Create a new position
@@ -392,7 +403,12 @@ class BaseBroker(ABC):
             order_type='limit',
             execution_style=''
             ):
-        '''Generic method to place an order and update database'''
+        '''Generic method to place an order and update database.
+
+        With a write_queue the Trade and cash Balance are only queued, so this
+        returns before they are persisted; they reach the database, and the
+        order manager, on the queue's next flush.
+        '''
         logger.info(
             'Placing order',
             extra={
@@ -400,19 +416,27 @@ class BaseBroker(ABC):
                 'quantity': quantity,
                 'side': side,
                 'strategy': strategy})
-        if self.prevent_day_trading and side == 'sell' and await self.has_bought_today(symbol):
-            logger.error(
-                'Day trading is not allowed. Cannot sell positions opened today.',
-                extra={
-                    'symbol': symbol})
-            return None
+        kind = asset_class(symbol)
+        if self.prevent_day_trading and side == 'sell':
+            with latency_tracker.time(self.broker_name, kind, order_type, 'pre_checks'):
+                bought_today = await self.has_bought_today(symbol)
+            if bought_today:
+                logger.error(
+                    'Day trading is not allowed. Cannot sell positions opened today.',
+                    extra={
+                        'symbol': symbol})
+                return None
 
         try:
+            submitted_at = time.monotonic()
+            if decision_started() is not None:
+                latency_tracker.record(self.broker_name, kind, order_type, 'decision_to_submit', submitted_at - decision_started())
             if asyncio.iscoroutinefunction(broker_order_func):
                 response = await broker_order_func(symbol, quantity, side, price, order_type)
             else:
                 response = broker_order_func(
                     symbol, quantity, side, price, order_type)
+            latency_tracker.record(self.broker_name, kind, order_type, 'submit_to_ack', time.monotonic() - submitted_at)
 
             broker_id = response.get('order_id', None)
 
@@ -438,7 +462,7 @@ class BaseBroker(ABC):
                 side=side,
                 status='open',
                 broker_id=broker_id,
-                timestamp=datetime.now(),
+                timestamp=self.now(),
                 broker=self.broker_name,
                 strategy=strategy,
                 profit_loss=0,
@@ -446,33 +470,38 @@ class BaseBroker(ABC):
                 execution_style=execution_style
             )
 
-            # Update the trade and positions in the database
+            # Write the trade and the new cash balance in a single transaction
             async with self.Session() as session:
-                session.add(trade)
-                await session.flush()
-                await session.commit()
-
-                # Update balance
-                latest_balance = await session.execute(
-                    select(Balance).filter_by(
-                        broker=self.broker_name, strategy=strategy, type='cash'
-                    ).order_by(Balance.timestamp.desc())
-                )
-                latest_balance = latest_balance.scalars().first()
-                if latest_balance:
+                new_balance = None
+                cash = await self.cash_ledger.get(session, strategy)
+                if cash is not None:
                     order_cost = price * quantity * multiplier
-                    new_balance_amount = latest_balance.balance - \
-                        order_cost if side == 'buy' else latest_balance.balance + order_cost
-
+                    cash_delta = -order_cost if side == 'buy' else order_cost
+                    now = self.now()
                     new_balance = Balance(
                         broker=self.broker_name,
                         strategy=strategy,
                         type='cash',
-                        balance=new_balance_amount,
-                        timestamp=datetime.now()
+                        balance=self.cash_ledger.apply(strategy, cash_delta, now),
+                        timestamp=now
                     )
-                    session.add(new_balance)
-                    await session.commit()
+
+                if self.write_queue is not None:
+                    # Undo the ledger if the queue gives up on the write
+                    on_failure = None
+                    if new_balance is not None:
+                        on_failure = partial(self.cash_ledger.apply, strategy, -cash_delta, now)
+                    self.write_queue.put(trade, new_balance, on_failure=on_failure)
+                else:
+                    session.add(trade)
+                    if new_balance is not None:
+                        session.add(new_balance)
+                    try:
+                        await session.commit()
+                    except Exception:
+                        if new_balance is not None:
+                            self.cash_ledger.apply(strategy, -cash_delta, now)
+                        raise
 
             return response
         except Exception as e:
@@ -5,6 +5,7 @@ import re
 from decimal import Decimal
 from brokers.base_broker import BaseBroker
 from utils.logger import logger
+from utils.blocking import blocking_executor, run_blocking
 from utils.utils import extract_underlying_symbol, is_ticker, is_option, is_futures_symbol
 from tastytrade import Session, DXLinkStreamer, Account
 from tastytrade.instruments import Equity, NestedOptionChain, Option, Future, FutureOption
@@ -75,7 +76,7 @@ class TastytradeBroker(BaseBroker):
         self.auth = auth_response['session-token']
         self.headers["Authorization"] = self.auth
         # Refresh the session
-        self.session = Session(self.username, self.password)
+        self.session = blocking_executor.call('tastytrade', Session, self.username, self.password)
         logger.info('Connected to Tastytrade API')
 
     def _get_account_info(self, retry=True):
@@ -168,7 +169,7 @@ class TastytradeBroker(BaseBroker):
         ticker = extract_underlying_symbol(symbol)
         logger.info('Placing future option order', extra={
                     'symbol': symbol, 'quantity': quantity, 'side': side, 'price': price, 'order_type': order_type})
-        option = FutureOption.get_future_option(self.session, symbol)
+        option = await run_blocking('tastytrade', FutureOption.get_future_option, self.session, symbol)
         if price is None:
             price = await self.get_current_price(symbol)
             price = round(price * 4) / 4
@@ -180,7 +181,7 @@ class TastytradeBroker(BaseBroker):
         elif side == 'sell':
             action = OrderAction.SELL_TO_CLOSE
             effect = PriceEffect.CREDIT
-        account = Account.get_account(self.session, self.account_id)
+        account = await run_blocking('tastytrade', Account.get_account, self.session, self.account_id)
         leg = option.build_leg(quantity, action)
         if order_type == 'limit':
             order = NewOrder(
@@ -203,7 +204,9 @@ class TastytradeBroker(BaseBroker):
                          'symbol': symbol, 'quantity': quantity, 'side': side, 'price': price, 'order_type': order_type})
             return {'filled_price': None}
 
-        response = account.place_order(self.session, order, dry_run=False)
+        # No timeout: placing an order is not idempotent, and giving up on a
+        # call that still goes through would leave a live order unrecorded
+        response = await run_blocking('tastytrade', account.place_order, self.session, order, dry_run=False, timeout=None)
         return response
 
     async def _place_option_order(self, symbol, quantity, side, price=None, order_type='limit'):
@@ -220,8 +223,8 @@ class TastytradeBroker(BaseBroker):
         elif side == 'sell':
             action = OrderAction.SELL_TO_CLOSE
             effect = PriceEffect.CREDIT
-        account = Account.get_account(self.session, self.account_id)
-        option = Option.get_option(self.session, symbol)
+        account = await run_blocking('tastytrade', Account.get_account, self.session, self.account_id)
+        option = await run_blocking('tastytrade', Option.get_option, self.session, symbol)
         leg = option.build_leg(quantity, action)
         if order_type == 'limit':
             order = NewOrder(
@@ -243,7 +246,7 @@ class TastytradeBroker(BaseBroker):
                          'symbol': symbol, 'quantity': quantity, 'side': side, 'price': price, 'order_type': order_type})
             return {'filled_price': None}
 
-        response = account.place_order(self.session, order, dry_run=False)
+        response = await run_blocking('tastytrade', account.place_order, self.session, order, dry_run=False, timeout=None)
         # TODO: refactor as part of introducing generic order method
         if hasattr(response, 'order'):
             return response.order
@@ -283,8 +286,8 @@ class TastytradeBroker(BaseBroker):
             else:
                 raise ValueError(f"Unsupported order type: {side}")
 
-            account = Account.get_account(self.session, self.account_id)
-            symbol = Equity.get_equity(self.session, symbol)
+            account = await run_blocking('tastytrade', Account.get_account, self.session, self.account_id)
+            symbol = await run_blocking('tastytrade', Equity.get_equity, self.session, symbol)
             leg = symbol.build_leg(quantity, action)
 
             if order_type == 'limit':
@@ -307,7 +310,7 @@ class TastytradeBroker(BaseBroker):
                              'symbol': symbol, 'quantity': quantity, 'side': side, 'price': price, 'order_type': order_type})
                 return {'filled_price': None}
 
-            response = account.place_order(self.session, order, dry_run=False)
+            response = await run_blocking('tastytrade', account.place_order, self.session, order, dry_run=False, timeout=None)
 
             if getattr(response, 'errors', None):
                 logger.error('Order placement failed with no order ID', extra={'response': str(
@@ -359,8 +362,8 @@ class TastytradeBroker(BaseBroker):
     def _cancel_order(self, order_id):
         logger.info('Cancelling order', extra={'order_id': order_id})
         try:
-            account = Account.get_account(self.session, self.account_id)
-            account.delete_order(self.session, order_id)
+            account = blocking_executor.call('tastytrade', Account.get_account, self.session, self.account_id)
+            blocking_executor.call('tastytrade', account.delete_order, self.session, order_id)
             logger.info('Order cancelled successfully')
         except requests.RequestException as e:
             logger.error('Failed to cancel order', extra={'error': str(e)})
@@ -391,7 +394,7 @@ class TastytradeBroker(BaseBroker):
         elif is_futures_symbol(symbol):
             logger.info('Getting current price for futures symbol',
                         extra={'symbol': symbol})
-            option = FutureOption.get_future_option(self.session, symbol)
+            option = await run_blocking('tastytrade', FutureOption.get_future_option, self.session, symbol)
             symbol = option.streamer_symbol
         elif is_option(symbol):
             # Convert to streamer symbol
@@ -415,7 +418,7 @@ class TastytradeBroker(BaseBroker):
         elif is_futures_symbol(symbol):
             logger.info('Getting current price for futures symbol',
                         extra={'symbol': symbol})
-            option = FutureOption.get_future_option(self.session, symbol)
+            option = await run_blocking('tastytrade', FutureOption.get_future_option, self.session, symbol)
             symbol = option.streamer_symbol
         elif is_option(symbol):
             # Convert to streamer symbol
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import select, delete, Integer, Float, DateTime
+from database.models import Trade, Balance, BalanceLatest, Position
+from utils.logger import logger
+
+TRADE_RETENTION_DAYS = 365
+BALANCE_RETENTION_DAYS = 365
+BATCH_SIZE = 5000
+MANIFEST = 'manifest.json'
+# Parquet files kept in memory by readers such as the API server
+CACHED_FILES = 256
+
+
+def _arrow_type(column):
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    return pa.string()
+
+
+def _schema(model):
+    return pa.schema([(column.name, _arrow_type(column)) for column in model.__table__.columns])
+
+
+class ParquetArchive:
+    '''Archived rows stored as Parquet under root.
+
+    Files are laid out as <table>/year=YYYY/month=MM/broker=<broker>/ and
+    listed in manifest.json with their row count and id and timestamp
+    ranges, so reads only open the files overlapping the requested range.
+    Files read are cached until they change on disk, so repeated reads
+    (every dashboard request) do not decode the same Parquet again.
+    '''
+    def __init__(self, root, cached_files=CACHED_FILES):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST)
+        self.cached_files = cached_files
+        self._tables = OrderedDict()
+        self._tables_lock = threading.Lock()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {'files': {}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def write(self, model, rows):
+        '''Write rows (dicts of model columns) and record the files in the manifest'''
+        table_name = model.__tablename__
+        groups = {}
+        for row in rows:
+            key = (row['timestamp'].year, row['timestamp'].month, row['broker'])
+            groups.setdefault(key, []).append(row)
+
+        manifest = self.load_manifest()
+        schema = _schema(model)
+        for (year, month, broker), group in sorted(groups.items()):
+            ids = [row['id'] for row in group]
+            timestamps = [row['timestamp'] for row in group]
+            # Named after the id range, so archiving the same rows again after a crash overwrites the file
+            path = os.path.join(table_name, f'year={year}', f'month={month:02d}', f'broker={broker}', f'part-{min(ids)}-{max(ids)}.parquet')
+            full_path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            pq.write_table(pa.Table.from_pylist(group, schema=schema), full_path)
+            manifest['files'][path] = {
+                'table': table_name,
+                'broker': broker,
+                'year': year,
+                'month': month,
+                'rows': len(group),
+                'min_id': min(ids),
+                'max_id': max(ids),
+                'min_timestamp': min(timestamps).isoformat(),
+                'max_timestamp': max(timestamps).isoformat(),
+            }
+        self._save_manifest(manifest)
+        return len(groups)
+
+    def files(self, model, start=None, end=None, brokers=None):
+        '''Manifest paths of model's files that may hold rows in [start, end)'''
+        paths = []
+        for path, entry in sorted(self.load_manifest()['files'].items()):
+            if entry['table'] != model.__tablename__:
+                continue
+            if brokers and entry['broker'] not in brokers:
+                continue
+            if start is not None and datetime.fromisoformat(entry['max_timestamp']) < start:
+                continue
+            if end is not None and datetime.fromisoformat(entry['min_timestamp']) >= end:
+                continue
+            paths.append(path)
+        return paths
+
+    def _table(self, model, path):
+        '''File as an Arrow table, cached per file and modification time'''
+        full_path = os.path.join(self.root, path)
+        key = (path, os.stat(full_path).st_mtime_ns)
+        with self._tables_lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                return table
+        table = pq.read_table(full_path, schema=_schema(model))
+        with self._tables_lock:
+            self._tables[key] = table
+            while len(self._tables) > self.cached_files:
+                self._tables.popitem(last=False)
+        return table
+
+    def read(self, model, start=None, end=None, brokers=None, strategies=None):
+        '''Archived rows of model as dicts, oldest first'''
+        condition = None
+        for expression in (
+            pc.field('timestamp') >= pa.scalar(start, pa.timestamp('us')) if start is not None else None,
+            pc.field('timestamp') < pa.scalar(end, pa.timestamp('us')) if end is not None else None,
+            pc.field('strategy').isin(list(strategies)) if strategies else None,
+        ):
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+        rows = []
+        for path in self.files(model, start, end, brokers):
+            table = self._table(model, path)
+            if condition is not None:
+                table = table.filter(condition)
+            rows.extend(table.to_pylist())
+        rows.sort(key=lambda row: (row['timestamp'], row['id']))
+        return rows
+
+
+def with_archived(model, hot_rows, archive, start=None, end=None, brokers=None, strategies=None):
+    '''Archived rows followed by hot_rows, as model instances.
+
+    Rows still in the database win over archived copies of the same id, which
+    only exist if an archival run stopped between writing and deleting.
+    '''
+    hot_ids = {row.id for row in hot_rows}
+    archived = [
+        model(**row) for row in archive.read(model, start, end, brokers, strategies)
+        if row['id'] not in hot_ids
+    ]
+    return archived + list(hot_rows)
+
+
+async def _archive_rows(engine, archive, model, conditions, batch_size):
+    archived = 0
+    while True:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                select(model.__table__).where(*conditions).order_by(model.id).limit(batch_size)
+            )).mappings().all()
+        if not rows:
+            return archived
+        archive.write(model, [dict(row) for row in rows])
+        # Delete only after the files and manifest are written
+        async with engine.begin() as conn:
+            await conn.execute(delete(model).where(model.id.in_([row['id'] for row in rows])))
+        archived += len(rows)
+        logger.debug('Archived rows', extra={'table': model.__tablename__, 'rows': len(rows)})
+
+
+async def archive_history(engine, archive_path, trade_retention_days=TRADE_RETENTION_DAYS, balance_retention_days=BALANCE_RETENTION_DAYS, batch_size=BATCH_SIZE, now=None):
+    '''Move closed trades and balance history older than the retention windows to Parquet.
+
+    Open trades are never archived, and neither are balances that
+    balance_latest or a position still points to.
+    '''
+    archive = ParquetArchive(archive_path)
+    now = now or datetime.now()
+    trades = await _archive_rows(engine, archive, Trade, [
+        Trade.status != 'open',
+        Trade.timestamp < now - timedelta(days=trade_retention_days),
+    ], batch_size)
+
+    referenced = select(Position.balance_id).where(Position.balance_id.isnot(None))
+    latest = select(BalanceLatest.balance_id).where(BalanceLatest.balance_id.isnot(None))
+    balances = await _archive_rows(engine, archive, Balance, [
+        Balance.timestamp < now - timedelta(days=balance_retention_days),
+        Balance.id.notin_(referenced),
+        Balance.id.notin_(latest),
+    ], batch_size)
+
+    logger.info('Archival completed', extra={'trades': trades, 'balances': balances, 'archive_path': archive_path})
+    return {'trades': trades, 'balances': balances}
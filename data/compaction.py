@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, func
+from database.models import Balance, BalanceLatest, OrderLatency, Position
+from utils.logger import logger
+
+FULL_RESOLUTION_DAYS = 7
+HOURLY_RESOLUTION_DAYS = 90
+LATENCY_RETENTION_DAYS = 30
+BATCH_SIZE = 5000
+
+
+def _bucket(dialect_name, resolution):
+    '''SQL expression truncating a balance timestamp to the given resolution'''
+    if dialect_name == 'postgresql':
+        return func.date_trunc(resolution, Balance.timestamp)
+    if dialect_name == 'sqlite':
+        return func.strftime('%Y-%m-%d %H' if resolution == 'hour' else '%Y-%m-%d', Balance.timestamp)
+    raise ValueError(f"Unsupported database type: {dialect_name}")
+
+
+def _start_of_day(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def _superseded_balance_ids(conn, balance_type, start, end, resolution):
+    '''Ids of every row that is not the last one of its (broker, strategy, bucket)'''
+    bucket = _bucket(conn.dialect.name, resolution)
+    ranked = select(
+        Balance.id,
+        func.row_number().over(
+            partition_by=(Balance.broker, Balance.strategy, bucket),
+            order_by=(Balance.timestamp.desc(), Balance.id.desc())
+        ).label('rank')
+    ).where(
+        Balance.type == balance_type,
+        Balance.timestamp >= start,
+        Balance.timestamp < end
+    ).subquery()
+    referenced = select(Position.balance_id).where(Position.balance_id.isnot(None))
+    latest = select(BalanceLatest.balance_id).where(BalanceLatest.balance_id.isnot(None))
+    result = await conn.execute(
+        select(ranked.c.id).where(ranked.c.rank > 1, ranked.c.id.notin_(referenced), ranked.c.id.notin_(latest))
+    )
+    return result.scalars().all()
+
+
+async def _delete_in_batches(engine, ids, batch_size):
+    # One short transaction per batch so concurrent writers are never blocked for long
+    for i in range(0, len(ids), batch_size):
+        async with engine.begin() as conn:
+            await conn.execute(delete(Balance).where(Balance.id.in_(ids[i:i + batch_size])))
+
+
+async def compact_balances(engine, full_resolution_days=FULL_RESOLUTION_DAYS, hourly_resolution_days=HOURLY_RESOLUTION_DAYS, batch_size=BATCH_SIZE, now=None):
+    '''Downsample old balance history to last-value rows.
+
+    Rows newer than full_resolution_days are untouched. Older rows keep only
+    the last row per hour until hourly_resolution_days, then the last row per
+    day. The kept rows are the original rows, so the newest balance of every
+    (broker, strategy, type) always survives and "latest row" queries keep
+    returning the same answer. Compaction walks one day at a time and only
+    touches rows far older than anything writers insert.
+    '''
+    now = now or datetime.now()
+    full_cutoff = _start_of_day(now - timedelta(days=full_resolution_days))
+    hourly_cutoff = _start_of_day(now - timedelta(days=max(hourly_resolution_days, full_resolution_days)))
+    deleted = 0
+
+    async with engine.connect() as conn:
+        balance_types = (await conn.execute(select(Balance.type).distinct())).scalars().all()
+
+    for balance_type in balance_types:
+        async with engine.connect() as conn:
+            oldest = (await conn.execute(
+                select(func.min(Balance.timestamp)).where(Balance.type == balance_type)
+            )).scalar()
+        if oldest is None:
+            continue
+        day = _start_of_day(oldest)
+        while day < full_cutoff:
+            resolution = 'day' if day < hourly_cutoff else 'hour'
+            async with engine.connect() as conn:
+                ids = await _superseded_balance_ids(conn, balance_type, day, day + timedelta(days=1), resolution)
+            await _delete_in_batches(engine, ids, batch_size)
+            if ids:
+                logger.debug('Compacted balances', extra={
+                    'type': balance_type, 'day': day.isoformat(), 'resolution': resolution, 'deleted': len(ids)})
+            deleted += len(ids)
+            day += timedelta(days=1)
+
+    logger.info('Balance compaction completed', extra={
+        'deleted': deleted, 'full_cutoff': full_cutoff.isoformat(), 'hourly_cutoff': hourly_cutoff.isoformat()})
+    return deleted
+
+
+async def prune_order_latencies(engine, retention_days=LATENCY_RETENTION_DAYS, batch_size=BATCH_SIZE, now=None):
+    '''Delete order latency samples older than retention_days, oldest first'''
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        async with engine.begin() as conn:
+            ids = (await conn.execute(
+                select(OrderLatency.id).where(OrderLatency.timestamp < cutoff).order_by(OrderLatency.id).limit(batch_size)
+            )).scalars().all()
+            if ids:
+                await conn.execute(delete(OrderLatency).where(OrderLatency.id.in_(ids)))
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+
+    logger.info('Order latency pruning completed', extra={'deleted': deleted, 'cutoff': cutoff.isoformat()})
+    return deleted
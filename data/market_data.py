@@ -0,0 +1,231 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func, or_
+from database.models import Trade
+from strategies.base_strategy import BaseStrategy
+from utils.logger import logger
+
+QUOTE_POLL_INTERVAL_SECONDS = 5
+FILL_POLL_INTERVAL_SECONDS = 2
+BAR_SECONDS = 60
+HOOKS = ('on_quote', 'on_bar', 'on_fill')
+
+
+def handled_hooks(strategy):
+    '''The event hooks strategy overrides'''
+    hooks = set()
+    for hook in HOOKS:
+        method = getattr(type(strategy), hook, None)
+        if method is not None and method is not getattr(BaseStrategy, hook):
+            hooks.add(hook)
+    return hooks
+
+
+def _bar_start(ts, bar_seconds):
+    epoch = ts.timestamp()
+    return datetime.fromtimestamp(epoch - epoch % bar_seconds, tz=timezone.utc)
+
+
+class MarketDataBus:
+    '''Delivers quotes, bars and fills to the strategies that subscribed to them.
+
+    There is one quote feed per broker for the union of the symbols its
+    strategies subscribe to. A broker that implements
+    stream_quotes(symbols) as an async generator of quotes is streamed;
+    the others are polled with get_current_price, once per symbol no matter
+    how many strategies want it. Bars are built from the quotes. Fills come
+    from trades the order manager marks filled.
+
+    Each strategy has its own queue and consumer task, so a slow hook delays
+    only that strategy's events, which it still receives in order. With an
+    executor, hooks run through it and take turns with rebalances on the
+    same broker account.
+    '''
+    def __init__(self, engine=None, poll_interval_seconds=QUOTE_POLL_INTERVAL_SECONDS, bar_seconds=BAR_SECONDS,
+                 fill_poll_interval_seconds=FILL_POLL_INTERVAL_SECONDS, executor=None):
+        self.engine = engine
+        self.executor = executor
+        self.poll_interval_seconds = poll_interval_seconds
+        self.bar_seconds = bar_seconds
+        self.fill_poll_interval_seconds = fill_poll_interval_seconds
+        self.strategies = {}
+        self.hooks = {}
+        self.symbol_subscribers = {}
+        self.brokers = {}
+        self.bars = {}
+        self.queues = {}
+        self.consumers = {}
+        self.feeds = {}
+        self.fill_task = None
+        self.started = False
+
+    def subscribe(self, strategy):
+        '''Register strategy's hooks, replacing an earlier registration under the same name'''
+        name = strategy.strategy_name
+        self.unsubscribe(name)
+        hooks = handled_hooks(strategy)
+        if not hooks:
+            return False
+        broker_name = strategy.broker.broker_name
+        self.strategies[name] = strategy
+        self.hooks[name] = hooks
+        self.brokers[broker_name] = strategy.broker
+        if hooks & {'on_quote', 'on_bar'}:
+            for symbol in strategy.subscriptions():
+                self.symbol_subscribers.setdefault((broker_name, symbol), set()).add(name)
+        self.queues.setdefault(name, asyncio.Queue())
+        logger.info('Strategy subscribed to market data', extra={
+            'strategy_name': name, 'broker': broker_name, 'hooks': sorted(hooks), 'symbols': list(strategy.subscriptions())})
+        if self.started:
+            self._start_tasks()
+        return True
+
+    def unsubscribe(self, name):
+        self.strategies.pop(name, None)
+        self.hooks.pop(name, None)
+        for subscribers in self.symbol_subscribers.values():
+            subscribers.discard(name)
+
+    def symbols(self, broker_name):
+        return sorted(symbol for (broker, symbol), subscribers in self.symbol_subscribers.items()
+                      if broker == broker_name and subscribers)
+
+    def publish_quote(self, broker_name, quote):
+        quote = dict(quote, broker=broker_name)
+        quote.setdefault('timestamp', datetime.now(timezone.utc))
+        if quote['timestamp'].tzinfo is None:
+            quote['timestamp'] = quote['timestamp'].replace(tzinfo=timezone.utc)
+        for name in self.symbol_subscribers.get((broker_name, quote['symbol']), ()):
+            if 'on_quote' in self.hooks.get(name, ()):
+                self._deliver(name, 'on_quote', quote)
+        self._update_bar(broker_name, quote)
+
+    def _update_bar(self, broker_name, quote):
+        key = (broker_name, quote['symbol'])
+        start = _bar_start(quote['timestamp'], self.bar_seconds)
+        bar = self.bars.get(key)
+        if bar is not None and bar['start'] != start:
+            for name in self.symbol_subscribers.get(key, ()):
+                if 'on_bar' in self.hooks.get(name, ()):
+                    self._deliver(name, 'on_bar', bar)
+            bar = None
+        price = quote['price']
+        if bar is None:
+            self.bars[key] = {'broker': broker_name, 'symbol': quote['symbol'], 'open': price, 'high': price, 'low': price,
+                              'close': price, 'count': 1, 'start': start, 'end': start + timedelta(seconds=self.bar_seconds)}
+        else:
+            bar.update(high=max(bar['high'], price), low=min(bar['low'], price), close=price, count=bar['count'] + 1)
+
+    def publish_fill(self, fill):
+        name = fill.get('strategy')
+        strategy = self.strategies.get(name)
+        if strategy is None or strategy.broker.broker_name != fill.get('broker'):
+            return
+        if 'on_fill' in self.hooks[name]:
+            self._deliver(name, 'on_fill', fill)
+
+    def _deliver(self, name, hook, event):
+        self.queues[name].put_nowait((hook, event))
+
+    async def _consume(self, name):
+        queue = self.queues[name]
+        while True:
+            hook, event = await queue.get()
+            # Looked up per event, so a restarted strategy gets the events after its restart
+            strategy = self.strategies.get(name)
+            if strategy is None:
+                continue
+            try:
+                if self.executor is not None:
+                    await self.executor.run_hook(strategy, hook, event)
+                else:
+                    await getattr(strategy, hook)(event)
+            except Exception as e:
+                logger.error(f'Error in {hook} of strategy {name}', extra={
+                    'strategy_name': name, 'symbol': event.get('symbol'), 'error': str(e)}, exc_info=True)
+
+    async def _poll_quotes(self, broker_name):
+        broker = self.brokers[broker_name]
+        while True:
+            symbols = self.symbols(broker_name)
+            prices = await asyncio.gather(*[broker.get_current_price(symbol) for symbol in symbols], return_exceptions=True)
+            now = datetime.now(timezone.utc)
+            for symbol, price in zip(symbols, prices):
+                if isinstance(price, Exception):
+                    logger.error('Failed to poll quote', extra={'broker': broker_name, 'symbol': symbol, 'error': str(price)})
+                elif price is not None:
+                    self.publish_quote(broker_name, {'symbol': symbol, 'price': price, 'timestamp': now})
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    async def _stream_quotes(self, broker_name):
+        broker = self.brokers[broker_name]
+        while True:
+            try:
+                async for quote in broker.stream_quotes(self.symbols(broker_name)):
+                    self.publish_quote(broker_name, quote)
+            except Exception as e:
+                logger.error('Quote stream failed, reconnecting', extra={'broker': broker_name, 'error': str(e)})
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    async def _poll_fills(self):
+        last_id, pending = None, set()
+        while True:
+            try:
+                if last_id is None:
+                    last_id, pending = await self._open_trades()
+                else:
+                    last_id = await self._check_fills(last_id, pending)
+            except Exception as e:
+                logger.error('Failed to poll fills', extra={'error': str(e)})
+            await asyncio.sleep(self.fill_poll_interval_seconds)
+
+    async def _open_trades(self):
+        '''Where fill polling starts: the newest trade id and the ids of trades still open'''
+        async with self.engine.connect() as conn:
+            last_id = (await conn.execute(select(func.max(Trade.id)))).scalar() or 0
+            pending = set((await conn.execute(select(Trade.id).where(Trade.status == 'open'))).scalars().all())
+        return last_id, pending
+
+    async def _check_fills(self, last_id, pending):
+        '''Publish trades filled since the last check; pending holds the ids of trades still open'''
+        conditions = [Trade.id > last_id]
+        if pending:
+            conditions.append(Trade.id.in_(pending))
+        async with self.engine.connect() as conn:
+            trades = (await conn.execute(select(Trade).where(or_(*conditions)).order_by(Trade.id))).all()
+        for trade in trades:
+            last_id = max(last_id, trade.id)
+            if trade.status == 'open':
+                pending.add(trade.id)
+                continue
+            pending.discard(trade.id)
+            if trade.status == 'filled':
+                self.publish_fill({
+                    'trade_id': trade.id, 'broker': trade.broker, 'strategy': trade.strategy, 'symbol': trade.symbol,
+                    'side': trade.side, 'quantity': trade.quantity, 'price': trade.executed_price or trade.price,
+                    'timestamp': trade.timestamp,
+                })
+        return last_id
+
+    def _start_tasks(self):
+        for name in self.queues:
+            if name not in self.consumers:
+                self.consumers[name] = asyncio.create_task(self._consume(name))
+        for broker_name, broker in self.brokers.items():
+            if broker_name not in self.feeds and self.symbols(broker_name):
+                feed = self._stream_quotes if hasattr(broker, 'stream_quotes') else self._poll_quotes
+                self.feeds[broker_name] = asyncio.create_task(feed(broker_name))
+        wants_fills = any('on_fill' in hooks for hooks in self.hooks.values())
+        if self.fill_task is None and wants_fills and self.engine is not None:
+            self.fill_task = asyncio.create_task(self._poll_fills())
+
+    def start(self):
+        self.started = True
+        self._start_tasks()
+
+    async def stop(self):
+        tasks = [*self.consumers.values(), *self.feeds.values(), *([self.fill_task] if self.fill_task else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.consumers, self.feeds, self.fill_task, self.started = {}, {}, None, False
@@ -0,0 +1,82 @@
+import asyncio
+from database.lease_manager import LeaseManager, DEFAULT_LEASE_SECONDS
+from database.locks import create_locks
+from order_manager.sharding import rendezvous_owner, default_worker_id
+from utils.logger import logger
+
+ROLE = 'sync_worker'
+MODE_STANDBY = 'standby'
+MODE_PARTITION = 'partition'
+
+
+class SyncCoordinator:
+    '''Decides which brokers a sync worker replica syncs, so no two replicas write the same broker.
+
+    mode='standby': replicas compete for one lock; its holder syncs every
+    broker and the others stand by until it stops renewing it.
+    mode='partition': live replicas heartbeat a membership lease and brokers
+    are hashed onto them. A replica only syncs a broker while holding that
+    broker's lock, so while membership changes a broker moves only after its
+    previous owner has given it up.
+    '''
+    def __init__(self, engine, mode=MODE_STANDBY, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS, backend='auto'):
+        if mode not in (MODE_STANDBY, MODE_PARTITION):
+            raise ValueError(f"Unknown sync coordination mode: {mode}")
+        self.mode = mode
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.lease_manager = LeaseManager(engine)
+        self.locks = create_locks(engine, self.worker_id, lease_seconds, backend)
+        self.assigned_brokers = []
+
+    @staticmethod
+    def lock_name(broker=None):
+        return ROLE if broker is None else f'{ROLE}:{broker}'
+
+    async def assign(self, brokers):
+        '''Names of the brokers this replica should sync now'''
+        try:
+            if self.mode == MODE_STANDBY:
+                assigned = list(brokers) if await self.locks.acquire(self.lock_name()) else []
+            else:
+                assigned = await self._assign_partition(brokers)
+        except Exception as e:
+            logger.error('Failed to coordinate sync workers, skipping this iteration', extra={'error': str(e), 'worker_id': self.worker_id})
+            assigned = []
+        if assigned != self.assigned_brokers:
+            logger.info('Sync worker assignment changed', extra={
+                'worker_id': self.worker_id, 'mode': self.mode, 'brokers': assigned, 'previous_brokers': self.assigned_brokers})
+        self.assigned_brokers = assigned
+        return assigned
+
+    async def _assign_partition(self, brokers):
+        await self.lease_manager.heartbeat(ROLE, self.worker_id, self.lease_seconds)
+        workers = await self.lease_manager.live_workers(ROLE)
+        if self.worker_id not in workers:
+            workers = sorted([*workers, self.worker_id])
+        assigned = []
+        for broker in brokers:
+            name = self.lock_name(broker)
+            if rendezvous_owner(broker, workers) == self.worker_id:
+                if await self.locks.acquire(name):
+                    assigned.append(broker)
+            elif name in self.locks.held:
+                # Hand it over to its new owner
+                await self.locks.release(name)
+        return assigned
+
+    async def run_heartbeat(self):
+        '''Keep the locks and membership alive between and during iterations'''
+        while True:
+            try:
+                await self.locks.renew()
+                if self.mode == MODE_PARTITION:
+                    await self.lease_manager.heartbeat(ROLE, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error('Failed to renew sync worker locks', extra={'error': str(e), 'worker_id': self.worker_id})
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    async def release(self):
+        await self.locks.release_all()
+        if self.mode == MODE_PARTITION:
+            await self.lease_manager.release(ROLE, self.worker_id)
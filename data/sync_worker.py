@@ -1,11 +1,16 @@
 import asyncio
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import time
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy import select
 from datetime import datetime
 from utils.logger import logger
 from utils.utils import is_option, extract_option_details, is_futures_symbol, futures_contract_size
-from database.models import Position, Balance
+from database.models import Position, BalanceLatest
+from database.upserts import upsert_positions, insert_balances
+from database.engines import get_async_engine
+from utils.blocking import run_blocking
 import yfinance as yf
 import sqlalchemy
 
@@ -13,6 +18,14 @@ UPDATE_UNCATEGORIZED_POSITIONS = False
 # TODO: harden/fix this (super buggy right now)
 RECONCILE_POSITIONS = False
 TIMEOUT_DURATION = 120
+# Each broker gets less than the whole iteration, so one slow broker times out on its own
+BROKER_TIMEOUT_DURATION = 90
+# Quotes requested at once while loading a market snapshot
+PRICE_CONCURRENCY = 10
+# Balances and positions are only rewritten when they moved by more than this
+# fraction, after a fill, or once their last write is HEARTBEAT_INTERVAL old
+CHANGE_THRESHOLD = 0.001
+HEARTBEAT_INTERVAL = 30 * 60
 
 class BrokerService:
     def __init__(self, brokers):
@@ -39,6 +52,47 @@ class BrokerService:
         return broker_instance.get_current_price(symbol)
 
 
+class MarketSnapshot:
+    '''Quotes shared by every service during one sync worker iteration.
+
+    Each (broker, symbol) is quoted at most once and concurrent lookups of the
+    same symbol share one request, so all balances and positions of an
+    iteration are valued at the same prices. Has the same get_latest_price as
+    BrokerService and stands in for it.
+    '''
+    def __init__(self, broker_service, concurrency=PRICE_CONCURRENCY):
+        self.broker_service = broker_service
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.prices = {}
+        self.volatilities = {}
+
+    async def load(self, positions):
+        '''Quote every symbol and underlying of positions up front'''
+        keys = set()
+        for position in positions:
+            keys.add((position.broker, position.symbol))
+            keys.add((position.broker, PositionService._get_underlying_symbol(position)))
+        results = await asyncio.gather(*[self.get_latest_price(broker, symbol) for broker, symbol in keys], return_exceptions=True)
+        failed = [key for key, result in zip(keys, results) if isinstance(result, Exception)]
+        logger.info('Market snapshot loaded', extra={'symbols': len(keys), 'failed': len(failed)})
+
+    async def get_latest_price(self, broker_name, symbol):
+        key = (broker_name, symbol)
+        if key not in self.prices:
+            self.prices[key] = asyncio.ensure_future(self._fetch_price(broker_name, symbol))
+        # Shielded, so a broker timing out does not cancel a quote other brokers wait on
+        return await asyncio.shield(self.prices[key])
+
+    async def get_volatility(self, symbol):
+        if symbol not in self.volatilities:
+            self.volatilities[symbol] = asyncio.ensure_future(PositionService._calculate_historical_volatility(symbol))
+        return await asyncio.shield(self.volatilities[symbol])
+
+    async def _fetch_price(self, broker_name, symbol):
+        async with self.semaphore:
+            return await self.broker_service.get_latest_price(broker_name, symbol)
+
+
 class PositionService:
     def __init__(self, broker_service):
         self.broker_service = broker_service
@@ -48,9 +102,7 @@ class PositionService:
         broker_positions, db_positions = await self._get_positions(session, broker)
         await self._remove_excess_uncategorized_positions(session, broker, db_positions, broker_positions)
         await self._remove_db_positions(session, broker, db_positions, broker_positions)
-        broker_positions, db_positions = await self._get_positions(session, broker)
         await self._add_missing_positions(session, broker, db_positions, broker_positions, now)
-        session.add_all(db_positions.values())  # Add updated positions to the session
         await session.commit()
         logger.info(f"Reconciliation for broker {broker} completed.")
 
@@ -120,35 +172,48 @@ class PositionService:
             await session.execute(
                 sqlalchemy.delete(Position).where(Position.broker == broker, Position.symbol.in_(symbols_to_remove))
             )
+            for symbol in symbols_to_remove:
+                db_positions.pop(symbol)
             logger.info(f"Removed positions from DB for broker {broker}: {symbols_to_remove}")
 
     async def _add_missing_positions(self, session, broker, db_positions, broker_positions, now):
+        """
+        Builds the desired state of every broker position and writes it in a single upsert.
+        """
+        rows = []
         for symbol, broker_position in broker_positions.items():
             if symbol in db_positions:
                 existing_position = db_positions[symbol]
-                self._update_existing_position(existing_position, broker_position, now)
+                rows.append(self._update_existing_position(existing_position, broker_position, now))
             else:
                 logger.warn(f"Found uncategorized position in broker: {symbol}")
                 if UPDATE_UNCATEGORIZED_POSITIONS:
-                    await self._insert_new_position(session, broker, broker_position, now)
+                    rows.append(await self._new_position_row(broker, broker_position, now))
+        await upsert_positions(session, rows)
 
     def _update_existing_position(self, existing_position, broker_position, now):
         logger.info("Updating existing position in DB: {existing_position.symbol}", extra={'symbol': existing_position.symbol, 'quantity': broker_position['quantity'], 'old_quantity': existing_position.quantity})
-        existing_position.quantity = broker_position['quantity']
-        existing_position.last_updated = now
+        # The row is written by the bulk upsert; keep the loaded object in step without dirtying it
+        set_committed_value(existing_position, 'quantity', broker_position['quantity'])
+        set_committed_value(existing_position, 'last_updated', now)
+        return self._position_row(existing_position.broker, existing_position.strategy, existing_position.symbol,
+                                  existing_position.quantity, existing_position.latest_price, now)
 
-    async def _insert_new_position(self, session, broker, broker_position, now):
+    async def _new_position_row(self, broker, broker_position, now):
         price = await self.broker_service.get_latest_price(broker, broker_position['symbol'])
-        new_position = Position(
-            broker=broker,
-            strategy='uncategorized',
-            symbol=broker_position['symbol'],
-            latest_price=price,
-            quantity=broker_position['quantity'],
-            last_updated=now,
-        )
-        session.add(new_position)
-        logger.info(f"Added uncategorized position to DB: {new_position.symbol}")
+        logger.info(f"Adding uncategorized position to DB: {broker_position['symbol']}")
+        return self._position_row(broker, 'uncategorized', broker_position['symbol'], broker_position['quantity'], price, now)
+
+    @staticmethod
+    def _position_row(broker, strategy, symbol, quantity, latest_price, now):
+        return {
+            'broker': broker,
+            'strategy': strategy,
+            'symbol': symbol,
+            'quantity': quantity,
+            'latest_price': latest_price,
+            'last_updated': now,
+        }
 
     async def update_position_cost_basis(self, session, position, broker_instance):
         """
@@ -166,9 +231,9 @@ class PositionService:
         except Exception as e:
             logger.error(f'Error updating cost basis for {position.symbol}: {e}')
 
-    async def update_position_prices_and_volatility(self, session, positions, timestamp):
+    async def update_position_prices_and_volatility(self, session, positions, timestamp, snapshot=None):
         now_naive = self._strip_timezone(timestamp or datetime.now())
-        await self._update_prices_and_volatility(session, positions, now_naive)
+        await self._update_prices_and_volatility(session, positions, now_naive, snapshot or MarketSnapshot(self.broker_service))
         await session.commit()
         logger.info('Completed updating latest prices and volatility')
 
@@ -180,35 +245,35 @@ class PositionService:
         broker_instance = await self.broker_service.get_broker_instance(position.broker)
         await self.update_position_cost_basis(session, position, broker_instance)
 
-    async def _update_prices_and_volatility(self, session, positions, now_naive):
+    async def _update_prices_and_volatility(self, session, positions, now_naive, snapshot):
         for position in positions:
             try:
-                await self._update_position_price(session, position, now_naive)
+                await self._update_position_price(session, position, now_naive, snapshot)
                 if RECONCILE_POSITIONS:
                     await self.update_cost_basis(session, position)
             except Exception:
                 logger.exception(f"Error processing position {position.symbol}")
 
-    async def _update_position_price(self, session, position, now_naive):
-        latest_price = await self._fetch_and_log_price(position)
-        if not latest_price:
+    async def _update_position_price(self, session, position, now_naive, snapshot):
+        latest_price = await self._fetch_and_log_price(position, snapshot)
+        if not latest_price or not self._is_dirty(position, latest_price, now_naive):
             return
 
         position.latest_price, position.last_updated = latest_price, now_naive
         underlying_symbol = self._get_underlying_symbol(position)
-        await self._update_volatility_and_underlying_price(session, position, underlying_symbol)
+        await self._update_volatility_and_underlying_price(session, position, underlying_symbol, snapshot)
 
-    async def _fetch_and_log_price(self, position):
-        latest_price = await self.broker_service.get_latest_price(position.broker, position.symbol)
+    async def _fetch_and_log_price(self, position, snapshot=None):
+        latest_price = await (snapshot or self.broker_service).get_latest_price(position.broker, position.symbol)
         if latest_price is None:
             logger.error(f'Could not get latest price for {position.symbol}')
         else:
             logger.debug(f'Updated latest price for {position.symbol} to {latest_price}')
         return latest_price
 
-    async def _update_volatility_and_underlying_price(self, session, position, underlying_symbol):
-        latest_underlying_price = await self.broker_service.get_latest_price(position.broker, underlying_symbol)
-        volatility = await self._calculate_historical_volatility(underlying_symbol)
+    async def _update_volatility_and_underlying_price(self, session, position, underlying_symbol, snapshot):
+        latest_underlying_price = await snapshot.get_latest_price(position.broker, underlying_symbol)
+        volatility = await snapshot.get_volatility(underlying_symbol)
 
         if volatility is not None:
             position.underlying_volatility = float(volatility)
@@ -218,6 +283,14 @@ class PositionService:
             logger.error(f'Could not calculate volatility for {underlying_symbol}')
         session.add(position)
 
+    @staticmethod
+    def _is_dirty(position, latest_price, now_naive):
+        if not position.latest_price or position.last_updated is None:
+            return True
+        if (now_naive - position.last_updated).total_seconds() >= HEARTBEAT_INTERVAL:
+            return True
+        return abs(latest_price - position.latest_price) > CHANGE_THRESHOLD * abs(position.latest_price)
+
     @staticmethod
     def _get_underlying_symbol(position):
         return extract_option_details(position.symbol)[0] if is_option(position.symbol) else position.symbol
@@ -227,7 +300,8 @@ class PositionService:
         logger.debug(f'Calculating historical volatility for {symbol}')
         try:
             stock = yf.Ticker(symbol)
-            hist = stock.history(period="1y")
+            # yfinance blocks; keep it off the event loop so other brokers keep syncing
+            hist = await run_blocking('yfinance', stock.history, period="1y")
             hist['returns'] = hist['Close'].pct_change()
             return hist['returns'].std() * (252 ** 0.5)
         except Exception as e:
@@ -239,41 +313,82 @@ class BalanceService:
     def __init__(self, broker_service):
         self.broker_service = broker_service
 
-    async def update_all_strategy_balances(self, session, broker, timestamp):
+    async def update_all_strategy_balances(self, session, broker, timestamp, snapshot=None):
+        '''Write balances for the strategies that changed since their last write.
+
+        Every strategy is valued, but only dirty ones get new rows: a fill wrote
+        cash after their last total, the total moved by more than
+        CHANGE_THRESHOLD, or the last total is HEARTBEAT_INTERVAL old.
+        '''
+        snapshot = snapshot or MarketSnapshot(self.broker_service)
+        latest = await self._get_latest_balances(session, broker)
         strategies = await self._get_strategies(session, broker)
-        await self._update_each_strategy_balance(session, broker, strategies, timestamp)
-        await self.update_uncategorized_balances(session, broker, timestamp)
+        rows = []
+        categorized_balance_sum = 0
+        dirty = {}
+        for strategy in strategies:
+            strategy_rows = await self.strategy_balance_rows(session, broker, strategy, timestamp, snapshot)
+            total = next(row['balance'] for row in strategy_rows if row['type'] == 'total')
+            categorized_balance_sum += total
+            reason = self._dirty_reason(latest, strategy, 'total', total, timestamp)
+            if reason is not None:
+                dirty[strategy] = reason
+                rows.extend(strategy_rows)
+        uncategorized_row = await self._uncategorized_balance_row(broker, categorized_balance_sum, timestamp)
+        reason = self._dirty_reason(latest, 'uncategorized', 'cash', uncategorized_row['balance'], timestamp)
+        if rows or reason is not None:
+            dirty['uncategorized'] = reason or 'categorized'
+            rows.append(uncategorized_row)
+        await insert_balances(session, rows)
         await session.commit()
-        logger.info(f"Updated all strategy balances for broker {broker}")
+        logger.info(f"Updated all strategy balances for broker {broker}", extra={
+            'dirty': dirty, 'skipped': len(strategies) + 1 - len(dirty)})
+
+    async def _get_latest_balances(self, session, broker):
+        latest_result = await session.execute(select(BalanceLatest).filter_by(broker=broker))
+        return {(row.strategy, row.type): row for row in latest_result.scalars()}
+
+    @staticmethod
+    def _dirty_reason(latest, strategy, balance_type, balance, now):
+        last = latest.get((strategy, balance_type))
+        if last is None:
+            return 'new'
+        # Orders write a cash row when they fill, the sync writes cash and total together
+        cash = latest.get((strategy, 'cash'))
+        if balance_type != 'cash' and cash is not None and cash.timestamp > last.timestamp:
+            return 'fill'
+        if (now - last.timestamp).total_seconds() >= HEARTBEAT_INTERVAL:
+            return 'heartbeat'
+        if abs(balance - last.balance) > CHANGE_THRESHOLD * abs(last.balance):
+            return 'change'
+        return None
 
     async def _get_strategies(self, session, broker):
         strategies_result = await session.execute(
-            select(Balance.strategy).filter_by(broker=broker).distinct().where(Balance.strategy != 'uncategorized')
+            select(BalanceLatest.strategy).filter_by(broker=broker).distinct().where(BalanceLatest.strategy != 'uncategorized')
         )
         return strategies_result.scalars().all()
 
-    async def _update_each_strategy_balance(self, session, broker, strategies, timestamp):
-        for strategy in strategies:
-            await self.update_strategy_balance(session, broker, strategy, timestamp)
-
-    async def update_strategy_balance(self, session, broker, strategy, timestamp):
+    async def strategy_balance_rows(self, session, broker, strategy, timestamp, snapshot=None):
         cash_balance = await self._get_cash_balance(session, broker, strategy)
-        positions_balance = await self._calculate_positions_balance(session, broker, strategy)
-
-        self._insert_or_update_balance(session, broker, strategy, 'cash', cash_balance, timestamp)
-        self._insert_or_update_balance(session, broker, strategy, 'positions', positions_balance, timestamp)
+        positions_balance = await self._calculate_positions_balance(session, broker, strategy, snapshot or self.broker_service)
+        logger.info(f"Strategy: {strategy}, Cash: {cash_balance}, Positions: {positions_balance}")
 
         total_balance = cash_balance + positions_balance
-        self._insert_or_update_balance(session, broker, strategy, 'total', total_balance, timestamp)
+        return [
+            self._balance_row(broker, strategy, 'cash', cash_balance, timestamp),
+            self._balance_row(broker, strategy, 'positions', positions_balance, timestamp),
+            self._balance_row(broker, strategy, 'total', total_balance, timestamp),
+        ]
 
     async def _get_cash_balance(self, session, broker, strategy):
         balance_result = await session.execute(
-            select(Balance).filter_by(broker=broker, strategy=strategy, type='cash').order_by(Balance.timestamp.desc()).limit(1)
+            select(BalanceLatest).filter_by(broker=broker, strategy=strategy, type='cash')
         )
         balance = balance_result.scalar()
         return balance.balance if balance else 0
 
-    async def _calculate_positions_balance(self, session, broker, strategy):
+    async def _calculate_positions_balance(self, session, broker, strategy, snapshot):
         positions_result = await session.execute(
             select(Position).filter_by(broker=broker, strategy=strategy)
         )
@@ -281,7 +396,7 @@ class BalanceService:
 
         total_positions_value = 0
         for position in positions:
-            latest_price = await self.broker_service.get_latest_price(broker, position.symbol)
+            latest_price = await snapshot.get_latest_price(broker, position.symbol)
             if is_option(position.symbol):
                 latest_price = latest_price * position.quantity * 100
             elif is_futures_symbol(position.symbol):
@@ -291,59 +406,30 @@ class BalanceService:
 
         return total_positions_value
 
-    def _insert_or_update_balance(self, session, broker, strategy, balance_type, balance_value, timestamp=None):
-        timestamp = timestamp or datetime.now()
-        new_balance_record = Balance(
-            broker=broker,
-            strategy=strategy,
-            type=balance_type,
-            balance=balance_value,
-            timestamp=timestamp
-        )
-        session.add(new_balance_record)
+    def _balance_row(self, broker, strategy, balance_type, balance_value, timestamp=None):
         logger.debug(f"Updated {balance_type} balance for strategy {strategy}: {balance_value}")
-
-    async def update_uncategorized_balances(self, session, broker, timestamp):
-        total_value, categorized_balance_sum = await self._get_account_balance_info(session, broker)
+        return {
+            'broker': broker,
+            'strategy': strategy,
+            'type': balance_type,
+            'balance': balance_value,
+            'timestamp': timestamp or datetime.now(),
+        }
+
+    async def _uncategorized_balance_row(self, broker, categorized_balance_sum, timestamp):
+        account_info = await self.broker_service.get_account_info(broker)
+        total_value = account_info['value']
         logger.info(f"Broker {broker}: Total account value: {total_value}, Categorized balance sum: {categorized_balance_sum}")
 
         uncategorized_balance = max(0, total_value - categorized_balance_sum)
         logger.debug(f"Calculated uncategorized balance for broker {broker}: {uncategorized_balance}")
+        return self._balance_row(broker, 'uncategorized', 'cash', uncategorized_balance, timestamp)
 
-        self._insert_uncategorized_balance(session, broker, uncategorized_balance, timestamp)
 
-    async def _get_account_balance_info(self, session, broker):
-        account_info = await self.broker_service.get_account_info(broker)
-        total_value = account_info['value']
-        categorized_balance_sum = await self._sum_all_strategy_balances(session, broker)
-        return total_value, categorized_balance_sum
-
-    def _insert_uncategorized_balance(self, session, broker, uncategorized_balance, timestamp):
-        new_balance_record = Balance(
-            broker=broker,
-            strategy='uncategorized',
-            type='cash',
-            balance=uncategorized_balance,
-            timestamp=timestamp
-        )
-        session.add(new_balance_record)
-        logger.debug(f"Updated uncategorized balance for broker {broker}: {uncategorized_balance}")
-
-    async def _sum_all_strategy_balances(self, session, broker):
-        strategies = await self._get_strategies(session, broker)
-        return await self._sum_each_strategy_balance(session, broker, strategies)
-
-    async def _sum_each_strategy_balance(self, session, broker, strategies):
-        total_balance = 0
-        for strategy in strategies:
-            cash_balance = await self._get_cash_balance(session, broker, strategy)
-            positions_balance = await self._calculate_positions_balance(session, broker, strategy)
-            logger.info(f"Strategy: {strategy}, Cash: {cash_balance}, Positions: {positions_balance}")
-            total_balance += (cash_balance + positions_balance)
-        return total_balance
-
-
-async def start(engine, brokers, timeout_duration=TIMEOUT_DURATION):
+async def start(engine, brokers, timeout_duration=None, broker_timeout_duration=None):
+    # Read at call time so values set from the config file apply
+    timeout_duration = timeout_duration or TIMEOUT_DURATION
+    broker_timeout_duration = broker_timeout_duration or BROKER_TIMEOUT_DURATION
     async_engine = await _get_async_engine(engine)
     Session = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=True)
 
@@ -351,50 +437,81 @@ async def start(engine, brokers, timeout_duration=TIMEOUT_DURATION):
     position_service = PositionService(broker_service)
     balance_service = BalanceService(broker_service)
 
-    await _run_sync_worker_iteration(Session, position_service, balance_service, brokers, timeout_duration=timeout_duration)
+    await _run_sync_worker_iteration(Session, position_service, balance_service, brokers, timeout_duration=timeout_duration, broker_timeout_duration=broker_timeout_duration)
 
 
 async def _get_async_engine(engine):
     if isinstance(engine, str):
-        return create_async_engine(engine)
+        return get_async_engine(engine)
     if isinstance(engine, sqlalchemy.engine.Engine):
         raise ValueError("AsyncEngine expected, but got a synchronous Engine.")
     if isinstance(engine, sqlalchemy.ext.asyncio.AsyncEngine):
         return engine
     raise ValueError("Invalid engine type. Expected a connection string or an AsyncEngine object.")
 
-async def _run_sync_worker_iteration(Session, position_service, balance_service, brokers, timeout_duration):
+async def _run_sync_worker_iteration(Session, position_service, balance_service, brokers, timeout_duration, broker_timeout_duration=BROKER_TIMEOUT_DURATION):
     try:
-        await asyncio.wait_for(_run_sync_worker_iteration_logic(Session, position_service, balance_service, brokers), timeout=timeout_duration)
+        await asyncio.wait_for(_run_sync_worker_iteration_logic(Session, position_service, balance_service, brokers, broker_timeout_duration), timeout=timeout_duration)
     except asyncio.TimeoutError:
         logger.error('Iteration exceeded the maximum allowed time. Forcing restart.')
         raise
 
-async def _run_sync_worker_iteration_logic(Session, position_service, balance_service, brokers):
+async def _run_sync_worker_iteration_logic(Session, position_service, balance_service, brokers, broker_timeout_duration=BROKER_TIMEOUT_DURATION):
     logger.info('Starting sync worker iteration')
     now = datetime.now()
+    snapshot = MarketSnapshot(position_service.broker_service)
+    # Brokers run side by side, so the iteration takes as long as the slowest one
+    timings = await asyncio.gather(*[
+        _sync_broker(Session, position_service, balance_service, broker, now, broker_timeout_duration, snapshot)
+        for broker in brokers
+    ])
+    logger.info('Sync worker completed an iteration', extra={'timings': timings})
+
+async def _sync_broker(Session, position_service, balance_service, broker, now, timeout_duration, snapshot):
+    '''Reconcile, balance and price one broker in its own session.
+
+    Each step commits on its own, so a broker that fails or times out keeps
+    whatever it finished and does not hold up the other brokers.
+    '''
+    started = time.monotonic()
+    status = 'ok'
     async with Session() as session:
-        logger.info('Session started')
-        try:
-            await _reconcile_brokers_and_update_balances(session, position_service, balance_service, brokers, now)
-        except Exception as e:
-            logger.exception(f'Error reconciling brokers and updating balances: {e}')
         try:
-            await _fetch_and_update_positions(session, position_service, now)
+            await asyncio.wait_for(_sync_broker_logic(session, position_service, balance_service, broker, now, snapshot), timeout=timeout_duration)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            logger.error('Sync exceeded the maximum allowed time for broker', extra={'broker': broker, 'timeout': timeout_duration})
         except Exception as e:
-            logger.exception(f'Error fetching and updating positions: {e}')
-        # commit anything we forgot about
-        await session.commit()
-    logger.info('Sync worker completed an iteration')
+            status = 'error'
+            logger.exception(f'Error syncing broker {broker}: {e}')
+    timing = {'broker': broker, 'status': status, 'seconds': round(time.monotonic() - started, 3)}
+    logger.info('Sync worker broker completed', extra=timing)
+    return timing
 
-async def _fetch_and_update_positions(session, position_service, now):
-    positions = await session.execute(select(Position))
+async def _sync_broker_logic(session, position_service, balance_service, broker, now, snapshot):
+    try:
+        await _reconcile_broker_and_update_balances(session, position_service, balance_service, broker, now, snapshot)
+    except Exception as e:
+        logger.exception(f'Error reconciling broker {broker} and updating balances: {e}')
+        await session.rollback()
+    await _fetch_and_update_positions(session, position_service, now, broker, snapshot)
+    # commit anything we forgot about
+    await session.commit()
+
+async def _fetch_and_update_positions(session, position_service, now, broker=None, snapshot=None):
+    query = select(Position)
+    if broker is not None:
+        query = query.filter_by(broker=broker)
+    positions = await session.execute(query)
     logger.info('Positions fetched')
-    await position_service.update_position_prices_and_volatility(session, positions.scalars(), now)
+    await position_service.update_position_prices_and_volatility(session, positions.scalars(), now, snapshot)
 
 
-async def _reconcile_brokers_and_update_balances(session, position_service, balance_service, brokers, now):
-    for broker in brokers:
-        if RECONCILE_POSITIONS:
-            await position_service.reconcile_positions(session, broker)
-        await balance_service.update_all_strategy_balances(session, broker, now)
+async def _reconcile_broker_and_update_balances(session, position_service, balance_service, broker, now, snapshot=None):
+    if RECONCILE_POSITIONS:
+        await position_service.reconcile_positions(session, broker)
+    if snapshot is not None:
+        # Quote all of the broker's symbols at once, balances and prices then read them from the snapshot
+        positions = await session.execute(select(Position).filter_by(broker=broker))
+        await snapshot.load(positions.scalars().all())
+    await balance_service.update_all_strategy_balances(session, broker, now, snapshot)
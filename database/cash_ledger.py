@@ -0,0 +1,49 @@
+from sqlalchemy import select
+from .models import BalanceLatest
+from utils.logger import logger
+
+
+
+class CashLedger:
+    '''In-memory cash balance per strategy of one broker.
+
+    Updated by every order as it is placed, so orders queued in a
+    write-behind queue are already reflected before they reach the database.
+    Every order still reads the strategy's balance_latest row in its own
+    transaction: a row newer than our last write was written elsewhere (UI
+    adjust_balance, sync worker) and replaces the in-memory value, while an
+    older one only lags behind writes of ours that are still queued.
+    '''
+    def __init__(self, broker_name):
+        self.broker_name = broker_name
+        self.entries = {}
+
+    async def get(self, session, strategy):
+        '''Current cash of the strategy, or None if it has no cash balance'''
+        result = await session.execute(
+            select(BalanceLatest.balance, BalanceLatest.timestamp).filter_by(broker=self.broker_name, strategy=strategy, type='cash')
+        )
+        row = result.first()
+        if row is not None:
+            self._merge(strategy, row.balance, row.timestamp)
+        entry = self.entries.get(strategy)
+        return entry['balance'] if entry else None
+
+    def apply(self, strategy, delta, timestamp):
+        '''Adjust the strategy's cash by delta and return the new balance.
+
+        Synchronous on purpose: concurrent orders of the same strategy cannot
+        interleave between reading and writing the balance.
+        '''
+        entry = self.entries[strategy]
+        entry['balance'] += delta
+        entry['timestamp'] = max(entry['timestamp'], timestamp)
+        return entry['balance']
+
+    def _merge(self, strategy, balance, timestamp):
+        entry = self.entries.get(strategy)
+        if entry is None or timestamp > entry['timestamp']:
+            if entry is not None:
+                logger.debug('Cash ledger re-seeded from balance_latest', extra={
+                    'broker': self.broker_name, 'strategy': strategy, 'balance': balance, 'previous_balance': entry['balance']})
+            self.entries[strategy] = {'balance': balance, 'timestamp': timestamp}
@@ -2,7 +2,8 @@ import json
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import sessionmaker
-from .models import Base, Trade, AccountInfo, Position, Balance
+from sqlalchemy import delete, update, case, func
+from .models import Base, Trade, AccountInfo, Position, Balance, BalanceLatest, backfill_balance_latest
 from utils.utils import is_option, OPTION_MULTIPLIER, is_futures_symbol, futures_contract_size
 from utils.logger import logger
 
@@ -33,15 +34,35 @@ class DBManager:
         async with self.Session() as session:
             try:
                 logger.debug('Updating trade status', extra={'trade_id': trade_id, 'status': status})
-                result = await session.execute(select(Trade).filter_by(id=trade_id))
-                trade = result.scalar()
-                trade.status = status
+                result = await session.execute(
+                    update(Trade).where(Trade.id == trade_id).values(status=status)
+                )
                 await session.commit()
-                logger.debug('Trade status updated', extra={'trade': trade})
+                if result.rowcount == 0:
+                    logger.warning(f"No trade found with id {trade_id}")
+                logger.debug('Trade status updated', extra={'trade_id': trade_id, 'status': status})
             except Exception as e:
                 await session.rollback()
                 logger.error('Failed to update trade status', extra={'error': str(e)})
 
+    async def update_trade_statuses(self, trade_ids, status):
+        '''Set the status of many trades with a single UPDATE; returns the number updated'''
+        if not trade_ids:
+            return 0
+        async with self.Session() as session:
+            try:
+                logger.debug('Updating trade statuses', extra={'trade_ids': list(trade_ids), 'status': status})
+                result = await session.execute(
+                    update(Trade).where(Trade.id.in_(trade_ids)).values(status=status)
+                )
+                await session.commit()
+                logger.debug('Trade statuses updated', extra={'count': result.rowcount, 'status': status})
+                return result.rowcount
+            except Exception as e:
+                await session.rollback()
+                logger.error('Failed to update trade statuses', extra={'error': str(e)})
+                return 0
+
     async def get_trade(self, trade_id):
         async with self.Session() as session:
             try:
@@ -61,11 +82,11 @@ class DBManager:
         async with self.Session() as session:
             try:
                 logger.debug('Setting trade filled', extra={'trade_id': trade_id})
-                result = await session.execute(select(Trade).filter_by(id=trade_id))
-                trade = result.scalar()
-                trade.status = 'filled'
+                await session.execute(
+                    update(Trade).where(Trade.id == trade_id).values(status='filled')
+                )
                 await session.commit()
-                logger.debug('Trade status set to filled', extra={'trade': trade})
+                logger.debug('Trade status set to filled', extra={'trade_id': trade_id})
             except Exception as e:
                 await session.rollback()
                 logger.error('Failed to set trade filled', extra={'error': str(e)})
@@ -74,11 +95,11 @@ class DBManager:
         async with self.Session() as session:
             try:
                 logger.debug('Setting trade cancelled', extra={'trade_id': trade_id})
-                result = await session.execute(select(Trade).filter_by(id=trade_id))
-                trade = result.scalar()
-                trade.status = 'cancelled'
+                await session.execute(
+                    update(Trade).where(Trade.id == trade_id).values(status='cancelled')
+                )
                 await session.commit()
-                logger.debug('Trade status set to cancelled', extra={'trade': trade})
+                logger.debug('Trade status set to cancelled', extra={'trade_id': trade_id})
             except Exception as e:
                 await session.rollback()
                 logger.error('Failed to set trade cancelled', extra={'error': str(e)})
@@ -207,45 +228,68 @@ class DBManager:
             return None
 
     async def rename_strategy(self, broker, old_strategy_name, new_strategy_name):
+        '''Re-key a strategy's balances, trades and positions in one transaction'''
         async with self.Session() as session:
             try:
                 logger.info('Updating strategy name', extra={'old_strategy_name': old_strategy_name, 'broker': broker})
+                merged = await self._merge_positions_into(session, broker, old_strategy_name, new_strategy_name)
+                counts = {'merged_positions': merged}
+                for model in (Balance, Trade, Position):
+                    result = await session.execute(
+                        update(model)
+                        .where(model.broker == broker, model.strategy == old_strategy_name)
+                        .values(strategy=new_strategy_name)
+                        .execution_options(synchronize_session=False)
+                    )
+                    counts[model.__tablename__] = result.rowcount
 
-                # Update balances
-                result = await session.execute(
-                    select(Balance).filter_by(broker=broker, strategy=old_strategy_name)
-                )
-                balances = result.scalars().all()
-                for balance in balances:
-                    balance.strategy = new_strategy_name
-                await session.commit()
-                logger.info(f'Updated {len(balances)} balances', extra={'old_strategy_name': old_strategy_name, 'broker': broker})
-
-                # Update trades
-                result = await session.execute(
-                    select(Trade).filter_by(broker=broker, strategy=old_strategy_name)
-                )
-                trades = result.scalars().all()
-                for trade in trades:
-                    trade.strategy = new_strategy_name
-                await session.commit()
-                logger.info(f'Updated {len(trades)} trades', extra={'old_strategy_name': old_strategy_name, 'broker': broker})
-
-                # Update positions
-                result = await session.execute(
-                    select(Position).filter_by(broker=broker, strategy=old_strategy_name)
+                # Bulk UPDATEs skip the balance_latest events; rebuild both keys
+                await session.execute(
+                    delete(BalanceLatest).where(
+                        BalanceLatest.broker == broker,
+                        BalanceLatest.strategy.in_([old_strategy_name, new_strategy_name])
+                    )
                 )
-                positions = result.scalars().all()
-                for position in positions:
-                    position.strategy = new_strategy_name
+                await backfill_balance_latest(await session.connection(), broker=broker, strategy=new_strategy_name)
                 await session.commit()
-                logger.info(f'Updated {len(positions)} positions', extra={'old_strategy_name': old_strategy_name, 'broker': broker})
+                logger.info('Updated strategy name', extra={
+                    'old_strategy_name': old_strategy_name, 'new_strategy_name': new_strategy_name, 'broker': broker, **counts})
 
             except Exception as e:
                 await session.rollback()
                 logger.error('Failed to update strategy name', extra={'error': str(e)})
 
 
+    async def _merge_positions_into(self, session, broker, old_strategy_name, new_strategy_name):
+        '''Fold the old strategy's positions into the new one's rows for symbols both hold.
+
+        Keeps (broker, strategy, symbol) unique when the rest is re-keyed.
+        '''
+        positions = Position.__table__
+        old = positions.alias('old')
+        target = positions.alias('target')
+        old_for_symbol = (old.c.broker == broker) & (old.c.strategy == old_strategy_name) & (old.c.symbol == positions.c.symbol)
+        old_quantity = select(old.c.quantity).where(old_for_symbol).scalar_subquery()
+        old_cost_basis = select(old.c.cost_basis).where(old_for_symbol).scalar_subquery()
+        result = await session.execute(
+            update(positions)
+            .where(positions.c.broker == broker, positions.c.strategy == new_strategy_name,
+                   positions.c.symbol.in_(select(old.c.symbol).where(old.c.broker == broker, old.c.strategy == old_strategy_name)))
+            .values(
+                quantity=positions.c.quantity + old_quantity,
+                cost_basis=case(
+                    (old_cost_basis.is_(None), positions.c.cost_basis),
+                    else_=func.coalesce(positions.c.cost_basis, 0) + old_cost_basis
+                )
+            )
+        )
+        await session.execute(
+            delete(positions)
+            .where(positions.c.broker == broker, positions.c.strategy == old_strategy_name,
+                   positions.c.symbol.in_(select(target.c.symbol).where(target.c.broker == broker, target.c.strategy == new_strategy_name)))
+        )
+        return result.rowcount
+
     async def get_profit_loss(self, trade_id):
         async with self.Session() as session:
             try:
@@ -0,0 +1,203 @@
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from utils.latency import LatencyHistogram
+from utils.logger import logger
+
+# Defaults for the `database.pool` section of the config file. It also
+# accepts query_cache_size (SQLAlchemy compiled statement cache) and
+# statement_cache_size (asyncpg prepared statement cache).
+DEFAULT_POOL_CONFIG = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True,
+}
+# Defaults for the `database.sqlite` section, applied to SQLite engines only
+DEFAULT_SQLITE_CONFIG = {
+    'enabled': True,
+    'begin_immediate': False,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout_ms': 30000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,  # negative values are KiB, i.e. 64MB
+}
+REPORT_INTERVAL_SECONDS = 60 * 5
+
+_engines = {}
+_lock = threading.Lock()
+_last_report = time.monotonic()
+
+
+class _CheckoutTimingMixin:
+    '''Records how long each connection checkout waited on the pool'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_wait = LatencyHistogram()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.checkout_wait.add((time.perf_counter() - started) * 1000)
+
+    def recreate(self):
+        # Keep the histogram when SQLAlchemy swaps the pool, e.g. on invalidation
+        pool = super().recreate()
+        pool.checkout_wait = self.checkout_wait
+        return pool
+
+
+class InstrumentedQueuePool(_CheckoutTimingMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _engine_kwargs(url, pool_config, is_async):
+    pool_config = {**DEFAULT_POOL_CONFIG, **(pool_config or {})}
+    url = make_url(url)
+    kwargs = {'pool_pre_ping': pool_config['pool_pre_ping']}
+    if 'query_cache_size' in pool_config:
+        kwargs['query_cache_size'] = pool_config['query_cache_size']
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # In-memory SQLite lives in a single connection; keep SQLAlchemy's default pool
+        return kwargs
+    kwargs['poolclass'] = InstrumentedAsyncAdaptedQueuePool if is_async else InstrumentedQueuePool
+    for option in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+        kwargs[option] = pool_config[option]
+    if url.get_driver_name() == 'asyncpg' and 'statement_cache_size' in pool_config:
+        kwargs['connect_args'] = {'prepared_statement_cache_size': pool_config['statement_cache_size']}
+    return kwargs
+
+
+def configure_sqlite(engine, sqlite_config=None, begin_immediate=False):
+    '''Apply the SQLite performance profile to every new connection of engine.
+
+    WAL lets readers run alongside the single writer, synchronous=NORMAL only
+    syncs at checkpoints, and busy_timeout makes a blocked writer wait for the
+    lock instead of failing with "database is locked". With begin_immediate,
+    transactions take the write lock at BEGIN, so concurrent writers queue up
+    there rather than failing when a read transaction upgrades to a write;
+    it deadlocks code that opens a second session while one is in progress,
+    so it is off by default.
+    '''
+    sqlite_config = {**DEFAULT_SQLITE_CONFIG, **(sqlite_config or {})}
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(sqlite_config['busy_timeout_ms'])}",
+        f"PRAGMA synchronous = {sqlite_config['synchronous']}",
+        f"PRAGMA cache_size = {int(sqlite_config['cache_size'])}",
+    ]
+    if sync_engine.url.database not in (None, '', ':memory:'):
+        pragmas += [
+            f"PRAGMA journal_mode = {sqlite_config['journal_mode']}",
+            f"PRAGMA mmap_size = {int(sqlite_config['mmap_size'])}",
+        ]
+
+    @event.listens_for(sync_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if begin_immediate:
+            # Stop the driver from emitting its own BEGIN, see begin_immediate below
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    if begin_immediate:
+        @event.listens_for(sync_engine, 'begin')
+        def begin_immediate_transaction(conn):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def _get_or_create(url, pool_config, sqlite_config, is_async):
+    key = (str(url), is_async)
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            factory = create_async_engine if is_async else create_engine
+            engine = factory(url, **_engine_kwargs(url, pool_config, is_async))
+            sqlite_config = {**DEFAULT_SQLITE_CONFIG, **(sqlite_config or {})}
+            if make_url(url).get_backend_name() == 'sqlite' and sqlite_config['enabled']:
+                configure_sqlite(engine, sqlite_config, sqlite_config['begin_immediate'])
+            _engines[key] = engine
+            logger.info('Database engine created', extra={
+                'db_url': engine.url.render_as_string(hide_password=True), 'async': is_async})
+        return engine
+
+
+def get_async_engine(url, pool_config=None, sqlite_config=None):
+    '''Process-wide AsyncEngine for url, created on first use.
+
+    Later calls with the same url return the same engine (and pool), so
+    restarting the trading loop does not open a fresh pool each time.
+    pool_config and sqlite_config only apply when the engine is first created.
+    Pooled aiosqlite connections each run a non-daemon thread, so call
+    dispose_engines() before the process exits.
+    '''
+    return _get_or_create(url, pool_config, sqlite_config, is_async=True)
+
+
+def get_engine(url, pool_config=None, sqlite_config=None):
+    '''Process-wide synchronous Engine for url, see get_async_engine'''
+    return _get_or_create(url, pool_config, sqlite_config, is_async=False)
+
+
+async def dispose_engines():
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        if hasattr(engine, 'sync_engine'):
+            await engine.dispose()
+        else:
+            engine.dispose()
+
+
+def pool_metrics():
+    '''Current pool usage of every registered engine'''
+    metrics = []
+    with _lock:
+        engines = list(_engines.items())
+    for (url, is_async), engine in engines:
+        pool = engine.pool
+        row = {
+            'db_url': engine.url.render_as_string(hide_password=True),
+            'async': is_async,
+            'pool': type(pool).__name__,
+        }
+        if isinstance(pool, QueuePool):
+            row.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+            })
+        wait = getattr(pool, 'checkout_wait', None)
+        if wait is not None:
+            row.update({
+                'checkouts': wait.count,
+                'wait_p50_ms': wait.percentile(50),
+                'wait_p99_ms': wait.percentile(99),
+                'wait_max_ms': wait.max_ms,
+            })
+        metrics.append(row)
+    return metrics
+
+
+def report_pool_metrics_if_due(interval_seconds=REPORT_INTERVAL_SECONDS):
+    global _last_report
+    if time.monotonic() - _last_report < interval_seconds:
+        return
+    _last_report = time.monotonic()
+    for row in pool_metrics():
+        logger.info('Database pool metrics', extra=row)
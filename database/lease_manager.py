@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from .models import WorkerLease
+from utils.logger import logger
+
+DEFAULT_LEASE_SECONDS = 30
+
+
+class LeaseManager:
+    '''DB-backed membership leases shared by replicas of the same role.
+
+    Each replica keeps a (role, worker_id) row alive by heartbeating it; a
+    replica whose row has expired is considered dead by the others. Lease
+    times use UTC and assume replica clocks agree to well within the TTL.
+    '''
+    def __init__(self, engine):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def heartbeat(self, role, worker_id, ttl_seconds=DEFAULT_LEASE_SECONDS):
+        now = datetime.utcnow()
+        async with self.Session() as session:
+            await session.merge(WorkerLease(
+                role=role,
+                worker_id=worker_id,
+                heartbeat_at=now,
+                expires_at=now + timedelta(seconds=ttl_seconds)
+            ))
+            await session.commit()
+        logger.debug('Lease heartbeat', extra={'role': role, 'worker_id': worker_id})
+
+    async def live_workers(self, role):
+        async with self.Session() as session:
+            result = await session.execute(
+                select(WorkerLease.worker_id)
+                .filter(WorkerLease.role == role, WorkerLease.expires_at > datetime.utcnow())
+                .order_by(WorkerLease.worker_id)
+            )
+            return result.scalars().all()
+
+    async def purge_expired(self, role):
+        async with self.Session() as session:
+            result = await session.execute(
+                delete(WorkerLease).where(WorkerLease.role == role, WorkerLease.expires_at <= datetime.utcnow())
+            )
+            await session.commit()
+            if result.rowcount:
+                logger.info('Purged expired leases', extra={'role': role, 'count': result.rowcount})
+            return result.rowcount
+
+    async def release(self, role, worker_id):
+        async with self.Session() as session:
+            await session.execute(
+                delete(WorkerLease).where(WorkerLease.role == role, WorkerLease.worker_id == worker_id)
+            )
+            await session.commit()
+        logger.info('Released lease', extra={'role': role, 'worker_id': worker_id})
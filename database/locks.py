@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from sqlalchemy import update, delete, or_, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from .models import LeaderLease
+from .lease_manager import DEFAULT_LEASE_SECONDS
+from utils.logger import logger
+
+
+def _advisory_key(name):
+    return int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], 'big', signed=True)
+
+
+class TableLocks:
+    '''Named exclusive locks held as expiring rows in leader_leases.
+
+    A lock is taken with a conditional UPDATE that only succeeds when the row
+    is ours or has expired (or with an INSERT when there is no row yet), so
+    at most one holder has it at a time on any database. The holder keeps it
+    by renewing it within ttl_seconds.
+    '''
+    def __init__(self, engine, holder, ttl_seconds=DEFAULT_LEASE_SECONDS):
+        self.holder = holder
+        self.ttl_seconds = ttl_seconds
+        self.Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        self.held = set()
+
+    async def acquire(self, name):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        async with self.Session() as session:
+            result = await session.execute(
+                update(LeaderLease)
+                .where(LeaderLease.name == name, or_(LeaderLease.holder == self.holder, LeaderLease.expires_at <= now))
+                .values(holder=self.holder, heartbeat_at=now, expires_at=expires_at)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                session.add(LeaderLease(name=name, holder=self.holder, heartbeat_at=now, expires_at=expires_at))
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Someone else holds it
+                await session.rollback()
+                self.held.discard(name)
+                return False
+        self.held.add(name)
+        return True
+
+    async def renew(self):
+        '''Extend every held lock; returns the names that were lost'''
+        lost = [name for name in sorted(self.held) if not await self.acquire(name)]
+        if lost:
+            logger.warning('Lost locks', extra={'holder': self.holder, 'locks': lost})
+        return lost
+
+    async def release(self, name):
+        async with self.Session() as session:
+            await session.execute(delete(LeaderLease).where(LeaderLease.name == name, LeaderLease.holder == self.holder))
+            await session.commit()
+        self.held.discard(name)
+
+    async def release_all(self):
+        for name in sorted(self.held):
+            await self.release(name)
+
+
+class AdvisoryLocks:
+    '''Named exclusive locks as Postgres session advisory locks.
+
+    The locks live on one dedicated connection; Postgres drops them the
+    moment that connection goes away, so a crashed holder frees its locks
+    at once instead of after a lease expires. The heartbeat and assign()
+    share the connection, which runs one statement at a time, so every
+    statement on it is serialized by self.lock.
+    '''
+    def __init__(self, engine, holder):
+        self.engine = engine
+        self.holder = holder
+        self.conn = None
+        self.held = set()
+        self.lock = asyncio.Lock()
+
+    async def _scalar(self, statement, **params):
+        async with self.lock:
+            return await self._execute(statement, **params)
+
+    async def _execute(self, statement, **params):
+        if self.conn is None:
+            self.conn = await self.engine.connect()
+        try:
+            value = (await self.conn.execute(text(statement), params)).scalar()
+            # Advisory locks outlive the transaction; do not sit idle in one
+            await self.conn.commit()
+            return value
+        except Exception:
+            await self._drop()
+            raise
+
+    async def _drop(self):
+        if self.held:
+            logger.warning('Lost advisory locks with their connection', extra={'holder': self.holder, 'locks': sorted(self.held)})
+        self.held.clear()
+        conn, self.conn = self.conn, None
+        try:
+            await conn.invalidate()
+        except Exception:
+            pass
+
+    async def acquire(self, name):
+        if name in self.held:
+            await self._scalar('SELECT 1')
+            return name in self.held
+        if await self._scalar('SELECT pg_try_advisory_lock(:key)', key=_advisory_key(name)):
+            self.held.add(name)
+            return True
+        return False
+
+    async def renew(self):
+        '''Check the connection holding the locks is alive; returns the names that were lost'''
+        held = sorted(self.held)
+        if held:
+            try:
+                await self._scalar('SELECT 1')
+            except Exception:
+                return held
+        return []
+
+    async def release(self, name):
+        if name in self.held:
+            await self._scalar('SELECT pg_advisory_unlock(:key)', key=_advisory_key(name))
+            self.held.discard(name)
+
+    async def release_all(self):
+        async with self.lock:
+            if self.conn is not None:
+                await self._execute('SELECT pg_advisory_unlock_all()')
+                self.held.clear()
+                await self.conn.close()
+                self.conn = None
+
+
+def create_locks(engine, holder, ttl_seconds=DEFAULT_LEASE_SECONDS, backend='auto'):
+    '''Advisory locks on Postgres, lease rows elsewhere, unless backend says otherwise'''
+    if backend not in ('auto', 'advisory', 'table'):
+        raise ValueError(f"Unknown lock backend: {backend}")
+    if backend == 'advisory' or (backend == 'auto' and engine.dialect.name == 'postgresql'):
+        return AdvisoryLocks(engine, holder)
+    return TableLocks(engine, holder, ttl_seconds)
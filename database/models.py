@@ -1,10 +1,18 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, PrimaryKeyConstraint, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, PrimaryKeyConstraint, Index, event, select, update, insert, delete, func, and_, exists, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime
 
 Base = declarative_base()
 
+
+def _utcnow():
+    # Looked up on each call rather than bound at import, so a frozen clock (tests, backtests) applies
+    return datetime.utcnow()
+
+
 class Trade(Base):
     __tablename__ = 'trades'
 
@@ -17,13 +25,23 @@ class Trade(Base):
     executed_price = Column(Float, nullable=True)
     side = Column(String, nullable=False)
     status = Column(String, nullable=False)
-    timestamp = Column(DateTime, nullable=False, default=datetime.utcnow)
+    timestamp = Column(DateTime, nullable=False, default=_utcnow)
     broker = Column(String, nullable=False)
     strategy = Column(String, nullable=True)
     profit_loss = Column(Float, nullable=True)
     success = Column(String, nullable=True)
     execution_style = Column(String, nullable=True)
 
+    __table_args__ = (
+        # Order manager polls open trades; the partial index stays small as history grows
+        Index('ix_trades_open_status', 'status', postgresql_where=text("status = 'open'"), sqlite_where=text("status = 'open'")),
+        # has_bought_today
+        Index('ix_trades_symbol_broker_side_timestamp', 'symbol', 'broker', 'side', 'timestamp'),
+        # UI per-strategy stats
+        Index('ix_trades_strategy_broker', 'strategy', 'broker'),
+        Index('ix_trades_broker_id', 'broker_id'),
+    )
+
 class AccountInfo(Base):
     __tablename__ = 'account_info'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -37,7 +55,7 @@ class Balance(Base):
     strategy = Column(String, nullable=True)
     type = Column(String, nullable=False)  # 'cash' or 'positions'
     balance = Column(Float, default=0.0)
-    timestamp = Column(DateTime, nullable=False, default=datetime.utcnow)
+    timestamp = Column(DateTime, nullable=False, default=_utcnow)
 
     positions = relationship("Position", back_populates="balance", foreign_keys="[Position.balance_id]", primaryjoin="and_(Balance.id==Position.balance_id, Balance.type=='positions')")
 
@@ -47,6 +65,22 @@ class Balance(Base):
         Index('ix_type_timestamp', 'type', 'timestamp'),
     )
 
+class BalanceLatest(Base):
+    '''Newest Balance row per (broker, strategy, type).
+
+    Maintained in the same transaction as every Balance insert/update so the
+    hot "latest balance" reads are primary key lookups instead of
+    ORDER BY timestamp DESC scans over the whole history.
+    '''
+    __tablename__ = 'balance_latest'
+
+    broker = Column(String, primary_key=True)
+    strategy = Column(String, primary_key=True)
+    type = Column(String, primary_key=True)
+    balance = Column(Float, default=0.0)
+    timestamp = Column(DateTime, nullable=False)
+    balance_id = Column(Integer, nullable=True)
+
 class Position(Base):
     __tablename__ = 'positions'
 
@@ -58,12 +92,156 @@ class Position(Base):
     quantity = Column(Float, nullable=False)
     latest_price = Column(Float, nullable=False)
     cost_basis = Column(Float, nullable=True)
-    last_updated = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_updated = Column(DateTime, nullable=False, default=_utcnow)
     underlying_volatility = Column(Float, nullable=True)
     underlying_latest_price = Column(Float, nullable=True)
 
     balance = relationship("Balance", back_populates="positions", foreign_keys=[balance_id])
 
+    __table_args__ = (
+        Index('ux_positions_broker_strategy_symbol', 'broker', 'strategy', 'symbol', unique=True),
+    )
+
+class OrderLatency(Base):
+    __tablename__ = 'order_latencies'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    broker = Column(String, nullable=False)
+    # equity, option, future or future_option
+    asset_class = Column(String, nullable=False)
+    # limit or market; unknown where the order type isn't recorded
+    order_type = Column(String, nullable=False)
+    stage = Column(String, nullable=False)
+    latency_ms = Column(Float, nullable=False)
+    timestamp = Column(DateTime, nullable=False, default=_utcnow)
+
+    __table_args__ = (
+        Index('ix_order_latencies_timestamp', 'timestamp'),
+    )
+
+class WorkerLease(Base):
+    __tablename__ = 'worker_leases'
+
+    role = Column(String, primary_key=True)
+    worker_id = Column(String, primary_key=True)
+    heartbeat_at = Column(DateTime, nullable=False, default=_utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+class LeaderLease(Base):
+    __tablename__ = 'leader_leases'
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False, default=_utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+def balance_latest_upsert(dialect_name):
+    '''INSERT ... ON CONFLICT into balance_latest that only moves forward in time.
+
+    Returns None for dialects without an upsert.
+    '''
+    if dialect_name not in ('postgresql', 'sqlite'):
+        return None
+    dialect_insert = pg_insert if dialect_name == 'postgresql' else sqlite_insert
+    table = BalanceLatest.__table__
+    stmt = dialect_insert(table)
+    # Matches ORDER BY timestamp DESC semantics: an older row never replaces a newer one
+    return stmt.on_conflict_do_update(
+        index_elements=['broker', 'strategy', 'type'],
+        set_={column: stmt.excluded[column] for column in ('balance', 'timestamp', 'balance_id')},
+        where=table.c.timestamp <= stmt.excluded.timestamp
+    )
+
+def _upsert_balance_latest(connection, balance):
+    values = {
+        'broker': balance.broker,
+        'strategy': balance.strategy,
+        'type': balance.type,
+        'balance': balance.balance,
+        'timestamp': balance.timestamp,
+        'balance_id': balance.id,
+    }
+    stmt = balance_latest_upsert(connection.dialect.name)
+    if stmt is not None:
+        connection.execute(stmt, values)
+        return
+    keys = {'broker': balance.broker, 'strategy': balance.strategy, 'type': balance.type}
+    result = connection.execute(
+        update(BalanceLatest).filter_by(**keys).where(BalanceLatest.timestamp <= balance.timestamp)
+        .values(balance=balance.balance, timestamp=balance.timestamp, balance_id=balance.id)
+    )
+    if result.rowcount == 0 and connection.execute(select(BalanceLatest.type).filter_by(**keys)).first() is None:
+        connection.execute(insert(BalanceLatest).values(**values))
+
+@event.listens_for(Balance, 'after_insert')
+@event.listens_for(Balance, 'after_update')
+def _track_latest_balance(mapper, connection, target):
+    # Rows without a strategy cannot be keyed; nothing reads them as "latest"
+    if target.strategy is None or target.timestamp is None:
+        return
+    _upsert_balance_latest(connection, target)
+
+async def backfill_balance_latest(conn, broker=None, strategy=None):
+    '''Populate balance_latest for keys written before the table existed.
+
+    broker and strategy restrict the backfill to one broker/strategy, e.g.
+    after its balances were re-keyed with a bulk UPDATE.
+    '''
+    filters = [Balance.strategy.isnot(None)]
+    if broker is not None:
+        filters.append(Balance.broker == broker)
+    if strategy is not None:
+        filters.append(Balance.strategy == strategy)
+    ranked = select(
+        Balance.id, Balance.broker, Balance.strategy, Balance.type, Balance.balance, Balance.timestamp,
+        func.row_number().over(
+            partition_by=(Balance.broker, Balance.strategy, Balance.type),
+            order_by=(Balance.timestamp.desc(), Balance.id.desc())
+        ).label('rank')
+    ).where(*filters).subquery()
+    already_tracked = exists().where(and_(
+        BalanceLatest.broker == ranked.c.broker,
+        BalanceLatest.strategy == ranked.c.strategy,
+        BalanceLatest.type == ranked.c.type
+    ))
+    await conn.execute(insert(BalanceLatest).from_select(
+        ['broker', 'strategy', 'type', 'balance', 'timestamp', 'balance_id'],
+        select(ranked.c.broker, ranked.c.strategy, ranked.c.type, ranked.c.balance, ranked.c.timestamp, ranked.c.id)
+        .where(ranked.c.rank == 1, ~already_tracked)
+    ))
+
+def _merge_duplicate_positions(connection):
+    '''Fold duplicate (broker, strategy, symbol) positions into the oldest row'''
+    positions = Position.__table__
+    duplicates = connection.execute(
+        select(positions.c.broker, positions.c.strategy, positions.c.symbol)
+        .group_by(positions.c.broker, positions.c.strategy, positions.c.symbol)
+        .having(func.count() > 1)
+    ).all()
+    for broker, strategy, symbol in duplicates:
+        rows = connection.execute(
+            select(positions).filter_by(broker=broker, strategy=strategy, symbol=symbol).order_by(positions.c.id)
+        ).all()
+        keeper, newest = rows[0], max(rows, key=lambda row: row.last_updated)
+        cost_bases = [row.cost_basis for row in rows if row.cost_basis is not None]
+        connection.execute(
+            update(positions).where(positions.c.id == keeper.id).values(
+                quantity=sum(row.quantity for row in rows),
+                cost_basis=sum(cost_bases) if cost_bases else None,
+                latest_price=newest.latest_price,
+                last_updated=newest.last_updated
+            )
+        )
+        connection.execute(delete(positions).where(positions.c.id.in_([row.id for row in rows[1:]])))
+    return len(duplicates)
+
+def _create_missing_indexes(connection):
+    # create_all skips tables that already exist, so indexes added later are created here
+    _merge_duplicate_positions(connection)
+    for table in (Trade.__table__, Position.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
 # Drop and create tables asynchronously
 async def drop_then_init_db(engine):
     async with engine.begin() as conn:
@@ -73,3 +251,5 @@ async def drop_then_init_db(engine):
 async def init_db(engine):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+        await backfill_balance_latest(conn)
@@ -0,0 +1,151 @@
+import re
+from datetime import datetime
+from sqlalchemy import text
+from .models import Balance, Trade
+from utils.logger import logger
+
+# Tables range partitioned by month on their timestamp column (Postgres only)
+PARTITIONED_TABLES = (Balance.__table__, Trade.__table__)
+MONTHS_AHEAD = 3
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def _month_start(timestamp):
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _partition_name(table_name, month):
+    return f'{table_name}_p{month:%Y_%m}'
+
+
+def _upper_bound(partition_bound):
+    '''Upper bound of a FOR VALUES FROM (...) TO (...) clause, None for MAXVALUE'''
+    match = _UPPER_BOUND.search(partition_bound or '')
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+async def is_partitioned(conn, table_name):
+    result = await conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {'name': table_name})
+    return result.scalar() is not None
+
+
+async def partitions(conn, table_name):
+    '''(name, upper bound) of every partition of table_name, oldest first'''
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:name AS regclass)"
+    ), {'name': table_name})
+    bounds = [(name, _upper_bound(bound)) for name, bound in result.all()]
+    return sorted(bounds, key=lambda row: row[1] or datetime.max)
+
+
+async def _convert_table(conn, table, first_month):
+    '''Turn an existing table into a partitioned one without copying rows.
+
+    The old table is renamed and attached as the partition holding every row
+    before first_month; monthly partitions take over from there. The primary
+    key becomes (id, timestamp) as Postgres requires, ids keep coming from the
+    same sequence, and foreign keys pointing at the table are dropped because
+    Postgres cannot reference a partitioned table by id alone.
+    '''
+    quote = conn.dialect.identifier_preparer.quote
+    name = table.name
+    history = f'{name}_before_{first_month:%Y_%m}'
+
+    sequence = (await conn.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {'name': name})).scalar()
+    pk_name = (await conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) AND contype = 'p'"
+    ), {'name': name})).scalar()
+    foreign_keys = (await conn.execute(text(
+        "SELECT CAST(conrelid AS regclass)::text, conname FROM pg_constraint "
+        "WHERE confrelid = CAST(:name AS regclass) AND contype = 'f'"
+    ), {'name': name})).all()
+    for referencing, constraint in foreign_keys:
+        await conn.execute(text(f'ALTER TABLE {referencing} DROP CONSTRAINT {quote(constraint)}'))
+
+    await conn.execute(text(f'ALTER TABLE {quote(name)} RENAME TO {quote(history)}'))
+    await conn.execute(text(f'ALTER TABLE {quote(history)} RENAME CONSTRAINT {quote(pk_name)} TO {quote(history + "_pkey")}'))
+    for index in table.indexes:
+        await conn.execute(text(f'ALTER INDEX IF EXISTS {quote(index.name)} RENAME TO {quote(history + "_" + index.name)}'))
+
+    await conn.execute(text(
+        f'CREATE TABLE {quote(name)} (LIKE {quote(history)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE ("timestamp")'
+    ))
+    await conn.execute(text(f'ALTER TABLE {quote(name)} ADD CONSTRAINT {quote(pk_name)} PRIMARY KEY (id, "timestamp")'))
+    if sequence:
+        await conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY {quote(name)}.id'))
+    await conn.execute(text(
+        f"ALTER TABLE {quote(name)} ATTACH PARTITION {quote(history)} FOR VALUES FROM (MINVALUE) TO ('{first_month.isoformat()}')"
+    ))
+    # Matching indexes of the attached history partition are adopted, not rebuilt
+    for index in table.indexes:
+        await conn.run_sync(index.create)
+    logger.info('Table converted to monthly partitions', extra={'table': name, 'history_partition': history})
+
+
+async def create_partitions(conn, table_name, until):
+    '''Create the monthly partitions missing between the newest one and until'''
+    quote = conn.dialect.identifier_preparer.quote
+    bounds = [upper for _, upper in await partitions(conn, table_name) if upper is not None]
+    month = max(bounds) if bounds else _month_start(until)
+    created = []
+    while month <= until:
+        next_month = _add_months(month, 1)
+        partition = _partition_name(table_name, month)
+        await conn.execute(text(
+            f"CREATE TABLE {quote(partition)} PARTITION OF {quote(table_name)} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        ))
+        created.append(partition)
+        month = next_month
+    return created
+
+
+async def detach_partitions(conn, table_name, before):
+    '''Detach every partition holding only rows older than before.
+
+    Detaching only updates the catalog, no rows are touched; the detached
+    partitions stay behind as ordinary tables to archive or drop.
+    '''
+    quote = conn.dialect.identifier_preparer.quote
+    detached = []
+    for partition, upper in await partitions(conn, table_name):
+        if upper is not None and upper <= before:
+            await conn.execute(text(f'ALTER TABLE {quote(table_name)} DETACH PARTITION {quote(partition)}'))
+            detached.append(partition)
+    return detached
+
+
+async def maintain_partitions(engine, months_ahead=MONTHS_AHEAD, retention_months=None, now=None):
+    '''Partition balances and trades by month and keep partitions ahead of time.
+
+    Converts the tables on first run, creates partitions up to months_ahead
+    months from now and, when retention_months is set, detaches partitions
+    older than that. A no-op on databases other than Postgres.
+    '''
+    if engine.dialect.name != 'postgresql':
+        logger.debug('Skipping partition maintenance', extra={'dialect': engine.dialect.name})
+        return {}
+    current = _month_start(now or datetime.now())
+    changes = {}
+    async with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if not await is_partitioned(conn, table.name):
+                await _convert_table(conn, table, _add_months(current, 1))
+            created = await create_partitions(conn, table.name, _add_months(current, months_ahead))
+            detached = []
+            if retention_months is not None:
+                detached = await detach_partitions(conn, table.name, _add_months(current, -retention_months))
+            changes[table.name] = {'created': created, 'detached': detached}
+    logger.info('Partition maintenance completed', extra={'changes': changes})
+    return changes
@@ -0,0 +1,79 @@
+import time
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+from utils.logger import logger
+
+LAG_CHECK_INTERVAL_SECONDS = 5
+
+# Zero while the replica has replayed everything it received, so an idle
+# primary does not look like a lagging replica
+POSTGRES_REPLICA_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaLagMonitor:
+    '''Tells whether a read replica is fresh enough to serve reads.
+
+    The lag is measured at most every check_interval_seconds. A replica that
+    cannot be queried counts as stale, so reads fall back to the primary.
+    Databases without a lag query (e.g. SQLite) are always fresh.
+    '''
+    def __init__(self, engine, max_lag_seconds, check_interval_seconds=LAG_CHECK_INTERVAL_SECONDS):
+        self.engine = engine
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self.lag_seconds = None
+        self.checked_at = None
+
+    def measure(self):
+        if self.engine.dialect.name != 'postgresql':
+            return 0.0
+        with self.engine.connect() as conn:
+            return float(conn.execute(POSTGRES_REPLICA_LAG).scalar() or 0)
+
+    def fresh(self):
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= self.check_interval_seconds:
+            self.checked_at = now
+            try:
+                self.lag_seconds = self.measure()
+            except Exception as e:
+                logger.error('Failed to measure replica lag', extra={'error': str(e)})
+                self.lag_seconds = None
+            if self.lag_seconds is None or self.lag_seconds > self.max_lag_seconds:
+                logger.warning('Read replica is stale, reading from the primary', extra={
+                    'lag_seconds': self.lag_seconds, 'max_lag_seconds': self.max_lag_seconds})
+        return self.lag_seconds is not None and self.lag_seconds <= self.max_lag_seconds
+
+
+class RoutingSession(Session):
+    '''Session reading from a replica and writing to the primary.
+
+    Queries go to the replica until the session writes (a flush or an
+    INSERT/UPDATE/DELETE statement) or use_primary() is called; from then on
+    everything goes to the primary so the session reads its own writes.
+    Without a replica, or when the lag monitor reports it stale, the primary
+    serves everything.
+    '''
+    def __init__(self, primary, replica=None, lag_monitor=None, **kwargs):
+        kwargs['bind'] = primary
+        super().__init__(**kwargs)
+        self.primary = primary
+        self.replica = replica
+        self.lag_monitor = lag_monitor
+        self.pinned = replica is None
+
+    def use_primary(self):
+        self.pinned = True
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.pinned = True
+        if self.pinned:
+            return self.primary
+        if self.lag_monitor is not None and not self.lag_monitor.fresh():
+            return self.primary
+        return self.replica
@@ -0,0 +1,82 @@
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import Position, Balance, balance_latest_upsert
+from utils.logger import logger
+
+POSITION_KEY = ('broker', 'strategy', 'symbol')
+
+
+def _dialect_name(session):
+    return session.get_bind().dialect.name
+
+
+def _uniform(rows):
+    # executemany binds every row against the first row's columns
+    columns = set(rows[0])
+    if any(set(row) != columns for row in rows):
+        raise ValueError("All rows in a bulk write must have the same columns")
+    return columns
+
+
+async def upsert_positions(session, rows):
+    '''Insert or update positions keyed by (broker, strategy, symbol).
+
+    rows are plain dicts of Position columns. The whole batch is sent as one
+    INSERT ... ON CONFLICT DO UPDATE executemany; the ORM identity map is not
+    touched, so callers holding loaded Position objects should refresh them.
+    '''
+    if not rows:
+        return 0
+    columns = _uniform(rows)
+    dialect_name = _dialect_name(session)
+    if dialect_name not in ('postgresql', 'sqlite'):
+        raise ValueError(f"Unsupported database type: {dialect_name}")
+    dialect_insert = pg_insert if dialect_name == 'postgresql' else sqlite_insert
+    stmt = dialect_insert(Position.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(POSITION_KEY),
+        set_={column: stmt.excluded[column] for column in columns if column not in POSITION_KEY}
+    )
+    await session.execute(stmt, rows)
+    logger.debug('Upserted positions', extra={'count': len(rows)})
+    return len(rows)
+
+
+async def insert_balances(session, rows):
+    '''Append balance rows and advance balance_latest, one statement each.
+
+    Core executemany skips the ORM events that normally maintain
+    balance_latest, so the newest inserted row per key is upserted here in
+    the same transaction.
+    '''
+    if not rows:
+        return 0
+    _uniform(rows)
+    table = Balance.__table__
+    inserted = (await session.execute(
+        table.insert().returning(table.c.id, table.c.broker, table.c.strategy, table.c.type, table.c.balance, table.c.timestamp),
+        rows
+    )).all()
+
+    # One row per key: an ON CONFLICT statement may not touch the same row twice
+    latest = {}
+    for row in inserted:
+        if row.strategy is None:
+            continue
+        key = (row.broker, row.strategy, row.type)
+        if key not in latest or (row.timestamp, row.id) > (latest[key]['timestamp'], latest[key]['balance_id']):
+            latest[key] = {
+                'broker': row.broker,
+                'strategy': row.strategy,
+                'type': row.type,
+                'balance': row.balance,
+                'timestamp': row.timestamp,
+                'balance_id': row.id,
+            }
+    if latest:
+        stmt = balance_latest_upsert(_dialect_name(session))
+        if stmt is None:
+            raise ValueError(f"Unsupported database type: {_dialect_name(session)}")
+        await session.execute(stmt, list(latest.values()))
+    logger.debug('Inserted balances', extra={'count': len(inserted)})
+    return len(inserted)
@@ -0,0 +1,112 @@
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from utils.logger import logger
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL_SECONDS = 0.5
+# Failed flushes after which a group is dropped and its on_failure called
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class WriteBehindQueue:
+    '''Batches ORM objects and writes them in one transaction per flush.
+
+    Used for the order write path: each order enqueues its Trade and Balance
+    together, and a background task commits everything queued every
+    flush_interval_seconds (or as soon as batch_size objects are waiting).
+    Objects of one put() always land in the same transaction. When a batch
+    fails its groups are retried one by one, so a bad group cannot hold back
+    the others; a group that keeps failing is dropped after max_attempts
+    flushes and its on_failure callback undoes whatever the caller did
+    in memory. close() drains the queue and must be awaited before the
+    process exits, since anything still queued when it dies is lost.
+    '''
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_attempts = max_attempts
+        self.pending = []
+        self.task = None
+        self.full = asyncio.Event()
+        self.lock = asyncio.Lock()
+
+    def put(self, *objects, on_failure=None):
+        self.pending.append({
+            'objects': [obj for obj in objects if obj is not None],
+            'attempts': 0,
+            'on_failure': on_failure,
+        })
+        if sum(len(group['objects']) for group in self.pending) >= self.batch_size:
+            self.full.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def _write(self, groups):
+        async with self.Session() as session:
+            for group in groups:
+                session.add_all(group['objects'])
+            await session.commit()
+
+    async def flush(self):
+        async with self.lock:
+            groups, self.pending = self.pending, []
+            if not groups:
+                return 0
+            try:
+                await self._write(groups)
+            except Exception as e:
+                logger.error('Failed to flush write-behind queue', extra={'error': str(e), 'groups': len(groups)})
+                failed = groups
+                if len(groups) > 1:
+                    failed = []
+                    for group in groups:
+                        try:
+                            await self._write([group])
+                        except Exception:
+                            failed.append(group)
+                self._requeue(failed)
+                return len(groups) - len(failed)
+            logger.debug('Flushed write-behind queue', extra={'groups': len(groups)})
+            return len(groups)
+
+    def _requeue(self, groups):
+        retry = []
+        for group in groups:
+            group['attempts'] += 1
+            if group['attempts'] < self.max_attempts:
+                retry.append(group)
+                continue
+            logger.error('Dropping write-behind group after failed flushes', extra={
+                'attempts': group['attempts'], 'objects': [repr(obj) for obj in group['objects']]})
+            if group['on_failure'] is not None:
+                group['on_failure']()
+        self.pending = retry + self.pending
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.full.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            await self.flush()
+
+    async def close(self):
+        if self.task is not None:
+            # Cancelled under the lock, so a flush in progress is never cut short
+            async with self.lock:
+                self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # Every failed flush counts as an attempt, so this ends once the
+        # remaining groups are written or dropped
+        while self.pending:
+            await self.flush()
+            if self.pending:
+                await asyncio.sleep(self.flush_interval_seconds)
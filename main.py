@@ -1,23 +1,49 @@
 import argparse
 import asyncio
+import signal
 import time
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from sqlalchemy.ext.asyncio import create_async_engine
 from ui.app import create_app
-from utils.config import parse_config, initialize_brokers, initialize_strategies, create_database_engine, create_api_database_engine, initialize_database, initialize_brokers_and_strategies
+from utils.config import parse_config, initialize_brokers, initialize_strategies, initialize_strategy, create_database_engine, create_api_database_engine, create_api_read_engine, initialize_database, initialize_brokers_and_strategies, close_write_queues
 from utils.logger import logger  # Import the logger
-from utils.utils import is_market_open, is_futures_market_open
+from utils.trading_calendar import NYSE, CME_GLOBEX, CRYPTO, seconds_until_open
+from utils.latency import latency_tracker
+from utils.blocking import blocking_executor, loop_lag_monitor
+from database.engines import report_pool_metrics_if_due, dispose_engines
 import data.sync_worker as sync_worker
+from data.compaction import compact_balances, prune_order_latencies
+from data.archive import archive_history
+from database.partitioning import maintain_partitions
 from order_manager.manager import run_order_manager
+from order_manager.sharding import ShardAssigner
+from data.sync_coordination import SyncCoordinator
+from data.market_data import MarketDataBus
+from strategies.executor import StrategyExecutor
+from strategies.scheduler import Schedule, StrategyScheduler
+from backtest.history import MarketHistory
+from backtest.engine import Backtester
 
 SYNC_WORKER_INTERVAL_SECONDS = 60 * 5
 ORDER_MANAGER_INTERVAL_SECONDS = 9 # TODO: stream orders instead of polling
 DASHBOARD_BIND_PORT = os.environ.get("DASHBOARD_BIND_PORT", 8000)
+METRICS_REPORT_INTERVAL_SECONDS = 60
+
+def monitor_event_loop(config):
+    '''Apply the blocking call limits from config and start watching the event loop for stalls'''
+    blocking_config = config.get('blocking_calls', {})
+    blocking_executor.configure(max_workers=blocking_config.get('max_workers'), timeout_seconds=blocking_config.get('timeout_seconds'))
+    loop_lag_monitor.threshold_seconds = blocking_config.get('loop_lag_threshold_seconds', loop_lag_monitor.threshold_seconds)
+    loop_lag_monitor.start()
+
+async def report_metrics(engine):
+    while True:
+        await latency_tracker.report_if_due(engine)
+        report_pool_metrics_if_due()
+        await asyncio.sleep(METRICS_REPORT_INTERVAL_SECONDS)
 
 # TODO: fix the need to restart to refresh the tastytrade token
-# TODO: refactor/redesign to allow strategies that are not discretely rebalanced
-#       (i.e. streaming via websockets)
 async def start_trading_system(config_path):
     logger.info('Starting the trading system', extra={'config_path': config_path})
 
@@ -28,6 +54,7 @@ async def start_trading_system(config_path):
     except Exception as e:
         logger.error('Failed to parse configuration', extra={'error': str(e)}, exc_info=True)
         raise e
+    monitor_event_loop(config)
 
     # Setup the database engine
     engine = create_database_engine(config)
@@ -39,46 +66,38 @@ async def start_trading_system(config_path):
     # Initialize the brokers and strategies
     brokers, strategies = await initialize_brokers_and_strategies(config)
 
+    async def restart_strategy(strategy_name):
+        strategy_config = config['strategies'][strategy_name]
+        strategy = await initialize_strategy(strategy_name, strategy_config['type'], brokers[strategy_config['broker']], strategy_config)
+        market_data.subscribe(strategy)
+        return strategy
+
     # Execute the strategies loop
-    rebalance_intervals = {s: timedelta(minutes=strategies[s].rebalance_interval_minutes) for s in strategies}
-    last_rebalances = {s: datetime.min for s in strategies}
+    executor = StrategyExecutor(
+        strategies,
+        restart=restart_strategy,
+        timeouts={name: strategy_config.get('timeout_seconds') for name, strategy_config in config['strategies'].items()}
+    )
+
+    # Strategies with on_quote, on_bar or on_fill hooks get market data events between rebalances
+    market_data_config = config.get('market_data', {})
+    market_data = MarketDataBus(engine, executor=executor, **market_data_config)
+    for strategy in strategies.values():
+        market_data.subscribe(strategy)
+    scheduler = StrategyScheduler(executor, {
+        name: Schedule.from_config(config['strategies'][name], strategy) for name, strategy in strategies.items()
+    })
     logger.info('Entering the strategies execution loop')
 
-    start_time = datetime.now()
-    end_time = start_time + timedelta(hours=24)
-
-    while datetime.now() < end_time:
-        now = datetime.now()
-        # Collect all the strategies that need rebalancing
-        # rebalance synchronously
-        for strategy_name, strategy in strategies.items():
-            if now - last_rebalances[strategy_name] >= rebalance_intervals[strategy_name]:
-                try:
-                    await strategy.rebalance()
-                except Exception as e:
-                    logger.error(f"Error during rebalancing strategy {strategy_name}",
-                                 extra={'error': str(e)}, exc_info=True)
-                    brokers, strategies = await initialize_brokers_and_strategies(config)
-
-        #strategies_to_rebalance = []
-        #for strategy_name, strategy in strategies.items():
-        #    if now - last_rebalances[strategy_name] >= rebalance_intervals[strategy_name]:
-        #        strategies_to_rebalance.append((strategy_name, strategy))
-        #if strategies_to_rebalance:
-        #    try:
-        #        # Perform all rebalances concurrently
-        #        await asyncio.gather(
-        #            *[strategy.rebalance() for _, strategy in strategies_to_rebalance]
-        #        )
-        #        for strategy_name, _ in strategies_to_rebalance:
-        #            last_rebalances[strategy_name] = now
-        #            logger.info(f'Strategy {strategy_name} rebalanced successfully', extra={'time': now})
-        #    except Exception as e:
-        #        logger.error(f"Error during rebalancing strategies",
-        #                     extra={'error': str(e), 'strategy': strategy_name}, exc_info=True)
-        #        brokers, strategies = await initialize_brokers_and_strategies(config)
-
-        await asyncio.sleep(60)  # Check every minute
+    end_time = datetime.now(timezone.utc) + timedelta(hours=24)
+    reporter = asyncio.create_task(report_metrics(engine))
+    market_data.start()
+    try:
+        await scheduler.run(until=end_time)
+    finally:
+        reporter.cancel()
+        await market_data.stop()
+        await close_write_queues(brokers)
     logger.info('Trading system finished 24 hours of trading')
 
 async def start_api_server(config_path=None, local_testing=False):
@@ -98,6 +117,11 @@ async def start_api_server(config_path=None, local_testing=False):
     engine = create_api_database_engine(config, local_testing)
     logger.info('Database engine created for API server', extra={'db_url': engine.url})
 
+    # Dashboard reads go to the replica when one is configured
+    read_engine = create_api_read_engine(config, local_testing)
+    if read_engine is not None:
+        logger.info('Read replica engine created for API server', extra={'db_url': read_engine.url})
+
     # Initialize the database
     async_db_url = os.environ.get("ASYNC_DATABASE_URL", 'sqlite+aiosqlite:///default_trading_system.db')
     async_db_engine = create_database_engine(async_db_url, local_testing)
@@ -105,7 +129,7 @@ async def start_api_server(config_path=None, local_testing=False):
 
     # Create and run the app
     try:
-        app = create_app(engine)
+        app = create_app(engine, read_engine, config.get('database', {}).get('read_max_lag_seconds'), config.get('archive', {}).get('path'))
         logger.info('API server created successfully')
         app.run(host="0.0.0.0", port=DASHBOARD_BIND_PORT, debug=True)
     except Exception as e:
@@ -114,6 +138,7 @@ async def start_api_server(config_path=None, local_testing=False):
 async def start_order_manager(config_path):
     logger.info('Starting order manager', extra={'config_path': config_path})
     config = parse_config(config_path)
+    monitor_event_loop(config)
     engine = create_database_engine(config)
     await initialize_database(engine)
     try:
@@ -122,14 +147,57 @@ async def start_order_manager(config_path):
     except Exception as e:
         logger.error('Failed to initialize brokers', extra={'error': str(e)})
         return
-    while True:
-        try:
-            await run_order_manager(engine, brokers)
-            logger.info('Order manager started successfully')
-            await asyncio.sleep(ORDER_MANAGER_INTERVAL_SECONDS)
-        except Exception as e:
-            logger.error('Failed to start order manager, trying to initialize brokers again', extra={'error': str(e)}, exc_info=True)
-            brokers = initialize_brokers(config)
+    shard_assigner = None
+    heartbeat_task = None
+    sharding_config = config.get('order_manager', {}).get('sharding', {})
+    if sharding_config.get('enabled'):
+        shard_assigner = ShardAssigner(
+            engine,
+            shard_by=sharding_config.get('shard_by', 'trade'),
+            lease_seconds=sharding_config.get('lease_seconds', 30)
+        )
+        await shard_assigner.lease_manager.purge_expired(shard_assigner.role)
+        heartbeat_task = asyncio.create_task(shard_assigner.run_heartbeat())
+        logger.info('Order manager sharding enabled', extra={'worker_id': shard_assigner.worker_id, 'shard_by': shard_assigner.shard_by})
+    try:
+        while True:
+            try:
+                await run_order_manager(engine, brokers, shard_assigner)
+                logger.info('Order manager started successfully')
+                await latency_tracker.report_if_due(engine)
+                report_pool_metrics_if_due()
+                await asyncio.sleep(ORDER_MANAGER_INTERVAL_SECONDS)
+            except Exception as e:
+                logger.error('Failed to start order manager, trying to initialize brokers again', extra={'error': str(e)}, exc_info=True)
+                await close_write_queues(brokers)
+                brokers = initialize_brokers(config)
+    finally:
+        await close_write_queues(brokers)
+        await stop_heartbeat(heartbeat_task, shard_assigner)
+
+async def stop_heartbeat(heartbeat_task, lease_holder):
+    '''Stop renewing leases and give them up, so other replicas take over without waiting for them to expire'''
+    if heartbeat_task is None:
+        return
+    heartbeat_task.cancel()
+    try:
+        await heartbeat_task
+    except asyncio.CancelledError:
+        pass
+    try:
+        await lease_holder.release()
+        logger.info('Released leases', extra={'worker_id': lease_holder.worker_id})
+    except Exception as e:
+        logger.error('Failed to release leases', extra={'error': str(e), 'worker_id': lease_holder.worker_id})
+
+def market_calendars(config):
+    '''Calendars of the markets the configured brokers trade'''
+    calendars = [NYSE]
+    if config.get('futures_enabled', False):
+        calendars.append(CME_GLOBEX)
+    if 'kraken' in config.get('brokers', {}):
+        calendars.append(CRYPTO)
+    return calendars
 
 async def start_sync_worker(config_path):
     logger.info('Starting sync worker', extra={'config_path': config_path})
@@ -142,10 +210,17 @@ async def start_sync_worker(config_path):
             sync_worker.UPDATE_UNCATEGORIZED_POSITIONS = True
         if config.get("timeout_duration"):
             sync_worker.TIMEOUT_DURATION = config.get("timeout_duration")
+        if config.get("broker_timeout_duration"):
+            sync_worker.BROKER_TIMEOUT_DURATION = config.get("broker_timeout_duration")
+        if config.get("sync_change_threshold") is not None:
+            sync_worker.CHANGE_THRESHOLD = config.get("sync_change_threshold")
+        if config.get("sync_heartbeat_interval"):
+            sync_worker.HEARTBEAT_INTERVAL = config.get("sync_heartbeat_interval")
         logger.info('Configuration parsed successfully')
     except Exception as e:
         logger.error('Failed to parse configuration', extra={'error': str(e)}, exc_info=True)
         return
+    monitor_event_loop(config)
 
     # Setup the database engine
     engine = create_database_engine(config)
@@ -153,6 +228,7 @@ async def start_sync_worker(config_path):
 
     # Initialize the database
     await initialize_database(engine)
+    await maintain_database_partitions(engine, config)
 
     # Initialize the brokers
     try:
@@ -162,28 +238,138 @@ async def start_sync_worker(config_path):
         logger.error('Failed to initialize brokers', extra={'error': str(e)})
         return
 
+    # Replicas split the brokers or stand by, so each broker has a single writer
+    coordinator = None
+    heartbeat_task = None
+    coordination_config = config.get('sync_worker', {}).get('coordination', {})
+    if coordination_config.get('enabled'):
+        coordinator = SyncCoordinator(
+            engine,
+            mode=coordination_config.get('mode', 'standby'),
+            lease_seconds=coordination_config.get('lease_seconds', 30),
+            backend=coordination_config.get('backend', 'auto')
+        )
+        heartbeat_task = asyncio.create_task(coordinator.run_heartbeat())
+        logger.info('Sync worker coordination enabled', extra={'worker_id': coordinator.worker_id, 'mode': coordinator.mode})
+
     # Start the sync worker
-    while True:
-        try:
-            await sync_worker.start(engine, brokers)
-            logger.info('Sync worker started successfully')
-            if is_market_open():
-                await asyncio.sleep(SYNC_WORKER_INTERVAL_SECONDS)
-            elif config.get('futures_enabled', False) and is_futures_market_open():
-                await asyncio.sleep(SYNC_WORKER_INTERVAL_SECONDS)
-            else:
-                logger.info('Market is closed, sleeping for 30 minutes')
-                await asyncio.sleep(60 * 30)
-        except Exception as e:
-            logger.error('Failed to start sync worker, trying to initialize brokers again', extra={'error': str(e)}, exc_info=True)
-            brokers = initialize_brokers(config)
+    try:
+        while True:
+            try:
+                sync_brokers = brokers
+                if coordinator is not None:
+                    sync_brokers = {name: brokers[name] for name in await coordinator.assign(brokers)}
+                if sync_brokers:
+                    await sync_worker.start(engine, sync_brokers)
+                logger.info('Sync worker started successfully')
+                report_pool_metrics_if_due()
+                seconds = seconds_until_open(market_calendars(config))
+                if seconds == 0:
+                    await asyncio.sleep(SYNC_WORKER_INTERVAL_SECONDS)
+                else:
+                    logger.info('Markets are closed, sleeping until the next session', extra={'seconds': seconds})
+                    await asyncio.sleep(seconds)
+            except Exception as e:
+                logger.error('Failed to start sync worker, trying to initialize brokers again', extra={'error': str(e)}, exc_info=True)
+                brokers = initialize_brokers(config)
+    finally:
+        await stop_heartbeat(heartbeat_task, coordinator)
+
+async def maintain_database_partitions(engine, config):
+    partitioning_config = config.get('database', {}).get('partitioning', {})
+    if not partitioning_config.get('enabled', False):
+        return
+    try:
+        await maintain_partitions(
+            engine,
+            months_ahead=partitioning_config.get('months_ahead', 3),
+            retention_months=partitioning_config.get('retention_months')
+        )
+    except Exception as e:
+        logger.error('Failed to maintain database partitions', extra={'error': str(e)}, exc_info=True)
+
+async def start_compaction(config_path):
+    logger.info('Starting balance compaction', extra={'config_path': config_path})
+    config = parse_config(config_path)
+    compaction_config = config.get('compaction', {})
+    engine = create_database_engine(config)
+    await initialize_database(engine)
+    try:
+        await maintain_database_partitions(engine, config)
+        await compact_balances(
+            engine,
+            full_resolution_days=compaction_config.get('full_resolution_days', 7),
+            hourly_resolution_days=compaction_config.get('hourly_resolution_days', 90),
+            batch_size=compaction_config.get('batch_size', 5000)
+        )
+        await prune_order_latencies(
+            engine,
+            retention_days=compaction_config.get('latency_retention_days', 30),
+            batch_size=compaction_config.get('batch_size', 5000)
+        )
+    finally:
+        await dispose_engines()
+
+async def start_archive(config_path):
+    logger.info('Starting archival', extra={'config_path': config_path})
+    config = parse_config(config_path)
+    archive_config = config.get('archive', {})
+    if not archive_config.get('path'):
+        logger.error('archive.path is required to archive history')
+        return
+    engine = create_database_engine(config)
+    await initialize_database(engine)
+    try:
+        await archive_history(
+            engine,
+            archive_config['path'],
+            trade_retention_days=archive_config.get('trade_retention_days', 365),
+            balance_retention_days=archive_config.get('balance_retention_days', 365),
+            batch_size=archive_config.get('batch_size', 5000)
+        )
+    finally:
+        await dispose_engines()
+
+async def start_backtest(config_path):
+    logger.info('Starting backtest', extra={'config_path': config_path})
+    config = parse_config(config_path)
+    backtest_config = config.get('backtest', {})
+    if not backtest_config.get('data_path'):
+        logger.error('backtest.data_path is required to run a backtest')
+        return
+    started = time.monotonic()
+    result = await Backtester(
+        config['strategies'],
+        MarketHistory(backtest_config['data_path']),
+        start=backtest_config.get('start'),
+        end=backtest_config.get('end'),
+        cash=backtest_config.get('cash'),
+        slippage_bps=backtest_config.get('slippage_bps', 0.0),
+        log_level=backtest_config.get('log_level', 'WARNING')
+    ).run()
+    if backtest_config.get('output'):
+        result.to_csv(backtest_config['output'])
+    logger.info('Backtest finished', extra={'bars': len(result.timestamps), 'seconds': round(time.monotonic() - started, 3)})
+    for strategy_name, stats in result.stats().items():
+        logger.info(f'Backtest results for {strategy_name}', extra={'strategy_name': strategy_name, **stats})
+
+def cancel_on_sigterm():
+    '''Cancel the main task on SIGTERM, so shutdown paths drain queues and release leases'''
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        # No signal handlers on Windows event loops
+        pass
 
 async def main():
     parser = argparse.ArgumentParser(description="Run trading strategies, start API server, or start sync worker based on YAML configuration.")
-    parser.add_argument('--mode', choices=['trade', 'api', 'sync', 'manager'], required=True, help='Mode to run the system in: "trade", "api", or "sync"')
+    parser.add_argument('--mode', choices=['trade', 'api', 'sync', 'manager', 'compact', 'archive', 'backtest'], required=True, help='Mode to run the system in: "trade", "api", "sync", "manager", "compact", "archive" or "backtest"')
     parser.add_argument('--config', type=str, help='Path to the YAML configuration file.')
     parser.add_argument('--local_testing', action='store_true', help='Run API server with local testing configuration.')
     args = parser.parse_args()
+    # The long-running modes; the API server blocks the loop in Flask and keeps the default handler
+    if args.mode in ('trade', 'sync', 'manager'):
+        cancel_on_sigterm()
 
     if args.mode == 'trade':
         if not args.config:
@@ -216,6 +402,18 @@ async def main():
         except Exception as e:
             logger.error('Error in order manager', extra={'error': str(e)}, exc_info=True)
             await start_order_manager(args.config)
+    elif args.mode == 'compact':
+        if not args.config:
+            parser.error('--config is required when mode is "compact"')
+        await start_compaction(args.config)
+    elif args.mode == 'archive':
+        if not args.config:
+            parser.error('--config is required when mode is "archive"')
+        await start_archive(args.config)
+    elif args.mode == 'backtest':
+        if not args.config:
+            parser.error('--config is required when mode is "backtest"')
+        await start_backtest(args.config)
 
 if __name__ == "__main__":
     asyncio.run(main())
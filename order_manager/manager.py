@@ -1,5 +1,6 @@
 from database.db_manager import DBManager
 from utils.logger import logger
+from utils.latency import latency_tracker, asset_class
 from datetime import datetime, timedelta
 from sqlalchemy import select
 from database.models import Position, Trade
@@ -8,19 +9,40 @@ MARK_ORDER_STALE_AFTER = 60 * 60 * 24 * 2 # 2 days
 PEGGED_ORDER_CANCEL_AFTER = 15 # 15 seconds
 
 class OrderManager:
-    def __init__(self, engine, brokers):
+    def __init__(self, engine, brokers, shard_assigner=None):
         logger.info('Initializing OrderManager')
         self.engine = engine
         self.db_manager = DBManager(engine)
         self.brokers = brokers
+        self.shard_assigner = shard_assigner
 
     async def reconcile_orders(self, orders):
         logger.info('Reconciling orders', extra={'orders': orders})
+        # Stale orders need no broker call, mark them all with one statement
+        stale_ids = {order.id for order in orders if self.is_stale(order)}
+        if stale_ids:
+            logger.info('Marking orders as stale', extra={'order_ids': sorted(stale_ids)})
+            await self.db_manager.update_trade_statuses(stale_ids, 'stale')
+        cancelled = []
         for order in orders:
-            await self.reconcile_order(order)
-        # Commit the transaction
+            if order.id not in stale_ids:
+                await self.reconcile_order(order, cancelled)
+        if cancelled:
+            # Cancelled pegged orders are marked before they are placed again, so a replaced order is never reconciled twice
+            logger.info('Marking pegged orders as cancelled', extra={'order_ids': [order.id for order, _ in cancelled]})
+            await self.db_manager.update_trade_statuses([order.id for order, _ in cancelled], 'cancelled')
+            for order, mid_price in cancelled:
+                await self.replace_pegged_order(order, mid_price)
 
-    async def reconcile_order(self, order):
+    def is_stale(self, order):
+        stale_threshold = datetime.utcnow() - timedelta(seconds=MARK_ORDER_STALE_AFTER)
+        if order.timestamp < stale_threshold and order.status not in ['filled', 'cancelled', 'stale', 'rejected']:
+            return True
+        # An order without a broker_id can't be looked up at the broker
+        return order.broker_id is None
+
+    async def reconcile_order(self, order, cancelled=None):
+        '''Reconcile one order; pegged orders it cancels are added to cancelled, if given, instead of being replaced here'''
         logger.info(f'Reconciling order {order.id}', extra={
             'order_id': order.id,
             'broker_id': order.broker_id,
@@ -32,32 +54,27 @@ class OrderManager:
             'status': order.status
         })
 
-        # Calculate the stale threshold
-        stale_threshold = datetime.utcnow() - timedelta(seconds=MARK_ORDER_STALE_AFTER)
-
-        # Check if the order is stale
-        if order.timestamp < stale_threshold and order.status not in ['filled', 'cancelled', 'stale', 'rejected']:
+        if self.is_stale(order):
             try:
                 logger.info(f'Marking order {order.id} as stale', extra={'order_id': order.id})
                 await self.db_manager.update_trade_status(order.id, 'stale')
-                return  # Exit early if the order is stale
             except Exception as e:
                 logger.error(f'Error marking order {order.id} as stale', extra={'error': str(e)})
-                return
+            return
 
         # If the order is not stale, reconcile it
         broker = self.brokers[order.broker]
-        if order.broker_id is None:
-            # If the order has no broker_id, mark it as stale
-            logger.info(f'Marking order {order.id} as stale, missing broker_id', extra={'order_id': order.id})
-            await self.db_manager.update_trade_status(order.id, 'stale')
-            return
         filled = await broker.is_order_filled(order.broker_id)
         if filled:
+            kind = asset_class(order.symbol)
+            # Trade timestamps are written with the local clock when the broker acks the order.
+            # Trades don't record their order type, so these stages are labelled unknown
+            latency_tracker.record(order.broker, kind, None, 'ack_to_fill', (datetime.now() - order.timestamp).total_seconds())
             try:
-                async with self.db_manager.Session() as session:
-                    await self.db_manager.set_trade_filled(order.id)
-                    await broker.update_positions(order.id, session)
+                with latency_tracker.time(order.broker, kind, None, 'fill_to_position_update'):
+                    async with self.db_manager.Session() as session:
+                        await self.db_manager.set_trade_filled(order.id)
+                        await broker.update_positions(order.id, session)
             except Exception as e:
                 logger.error(f'Error reconciling order {order.id}', extra={'error': str(e)})
         status = await broker.get_order_status(order.broker_id)
@@ -76,24 +93,38 @@ class OrderManager:
                     logger.info(f'Cancelling pegged order {order.id}', extra={'order_id': order.id})
                     mid_price = await broker.get_mid_price(order.symbol)
                     await broker.cancel_order(order.broker_id)
+                    if cancelled is not None:
+                        cancelled.append((order, mid_price))
+                        return
                     await self.db_manager.update_trade_status(order.id, 'cancelled')
-                    await broker.place_order(
-                        symbol=order.symbol,
-                        quantity=order.quantity,
-                        side=order.side,
-                        strategy=order.strategy,
-                        price=round(mid_price, 2),
-                        order_type='limit',
-                        execution_style=order.execution_style
-                    )
+                    await self.replace_pegged_order(order, mid_price)
                 except Exception as e:
                     logger.error(f'Error cancelling pegged order {order.id}', extra={'error': str(e)})
 
+    async def replace_pegged_order(self, order, mid_price):
+        try:
+            await self.brokers[order.broker].place_order(
+                symbol=order.symbol,
+                quantity=order.quantity,
+                side=order.side,
+                strategy=order.strategy,
+                price=round(mid_price, 2),
+                order_type='limit',
+                execution_style=order.execution_style
+            )
+        except Exception as e:
+            logger.error(f'Error replacing pegged order {order.id}', extra={'error': str(e)})
+
     async def run(self):
         logger.info('Running OrderManager')
         orders = await self.db_manager.get_open_trades()
+        if self.shard_assigner:
+            await self.shard_assigner.refresh()
+            orders = self.shard_assigner.owned(orders)
+            logger.info('Reconciling owned shard of open trades', extra={
+                'worker_id': self.shard_assigner.worker_id, 'workers': self.shard_assigner.workers, 'owned': len(orders)})
         await self.reconcile_orders(orders)
 
-async def run_order_manager(engine, brokers):
-    order_manager = OrderManager(engine, brokers)
+async def run_order_manager(engine, brokers, shard_assigner=None):
+    order_manager = OrderManager(engine, brokers, shard_assigner)
     await order_manager.run()
@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import os
+import socket
+from database.lease_manager import LeaseManager, DEFAULT_LEASE_SECONDS
+from utils.logger import logger
+
+SHARD_BY_BROKER = 'broker'
+SHARD_BY_TRADE = 'trade'
+
+
+def default_worker_id():
+    # HOSTNAME is the pod name on Kubernetes, which is unique per replica
+    return f"{os.environ.get('HOSTNAME', socket.gethostname())}-{os.getpid()}"
+
+
+def rendezvous_owner(key, workers):
+    '''Pick the owner of key with highest-random-weight hashing.
+
+    When a worker joins or leaves, only the keys it owned (or now owns) move,
+    so a replica dying does not reshuffle every other replica's orders.
+    '''
+    if not workers:
+        return None
+    return max(workers, key=lambda worker: hashlib.sha1(f'{worker}:{key}'.encode()).hexdigest())
+
+
+class ShardAssigner:
+    '''Splits open trades between order manager replicas.
+
+    Replicas heartbeat a lease in the worker_leases table; the live leases
+    form the membership that trades are hashed onto. With shard_by='broker'
+    every trade of a broker account is reconciled by the same replica, with
+    shard_by='trade' trades are spread by the hash of their id.
+    '''
+    def __init__(self, engine, role='order_manager', worker_id=None, shard_by=SHARD_BY_TRADE, lease_seconds=DEFAULT_LEASE_SECONDS):
+        if shard_by not in (SHARD_BY_BROKER, SHARD_BY_TRADE):
+            raise ValueError(f"Unknown shard_by: {shard_by}")
+        self.lease_manager = LeaseManager(engine)
+        self.role = role
+        self.worker_id = worker_id or default_worker_id()
+        self.shard_by = shard_by
+        self.lease_seconds = lease_seconds
+        self.workers = [self.worker_id]
+
+    async def refresh(self):
+        '''Renew our lease and reload the live membership'''
+        await self.lease_manager.heartbeat(self.role, self.worker_id, self.lease_seconds)
+        workers = await self.lease_manager.live_workers(self.role)
+        if self.worker_id not in workers:
+            workers = sorted([*workers, self.worker_id])
+        if workers != self.workers:
+            logger.info('Shard membership changed', extra={
+                'role': self.role, 'worker_id': self.worker_id, 'workers': workers, 'previous_workers': self.workers})
+        self.workers = workers
+        return workers
+
+    async def run_heartbeat(self):
+        '''Keep the lease alive while a long reconciliation pass is running'''
+        while True:
+            try:
+                await self.lease_manager.heartbeat(self.role, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error('Failed to heartbeat lease', extra={'error': str(e), 'worker_id': self.worker_id})
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    async def release(self):
+        await self.lease_manager.release(self.role, self.worker_id)
+
+    def shard_key(self, trade):
+        if self.shard_by == SHARD_BY_BROKER:
+            return trade.broker
+        return f'{trade.broker}:{trade.id}'
+
+    def owns(self, trade):
+        return rendezvous_owner(self.shard_key(trade), self.workers) == self.worker_id
+
+    def owned(self, trades):
+        return [trade for trade in trades if self.owns(trade)]
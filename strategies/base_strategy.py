@@ -1,9 +1,13 @@
 from abc import ABC, abstractmethod
-from database.models import Balance, Position
+from database.models import Balance, BalanceLatest, Position
 from utils.logger import logger
+from strategies.context import StrategyContext
+from strategies.rebalancer import rebalance_orders
+from utils.latency import order_decision
 from utils.utils import is_market_open, is_futures_symbol, is_futures_market_open
-from datetime import datetime
+from datetime import timezone
 import asyncio
+import numpy as np
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from inspect import iscoroutine
@@ -22,6 +26,24 @@ class BaseStrategy(ABC):
     async def rebalance(self):
         pass
 
+    # Event-driven strategies override the hooks they need and return the
+    # symbols they want quotes and bars for from subscriptions(); the market
+    # data bus only calls the hooks a strategy overrides.
+    def subscriptions(self):
+        return []
+
+    async def on_quote(self, quote):
+        '''Called with {'broker', 'symbol', 'price', 'timestamp'} for every new quote'''
+        pass
+
+    async def on_bar(self, bar):
+        '''Called with {'broker', 'symbol', 'open', 'high', 'low', 'close', 'count', 'start', 'end'} as each bar closes'''
+        pass
+
+    async def on_fill(self, fill):
+        '''Called with {'trade_id', 'broker', 'strategy', 'symbol', 'side', 'quantity', 'price', 'timestamp'} when an order fills'''
+        pass
+
     async def initialize_starting_balance(self):
         if self.initialized:
             logger.debug("Starting balance already initialized",
@@ -43,11 +65,11 @@ class BaseStrategy(ABC):
 
         async with self.broker.Session() as session:
             result = await session.execute(
-                select(Balance).filter_by(
+                select(BalanceLatest).filter_by(
                     strategy=self.strategy_name,
                     broker=self.broker.broker_name,
                     type='cash'
-                ).order_by(Balance.timestamp.desc())
+                )
             )
             strategy_balance = result.scalar()
 
@@ -56,7 +78,8 @@ class BaseStrategy(ABC):
                     strategy=self.strategy_name,
                     broker=self.broker.broker_name,
                     type='cash',
-                    balance=self.starting_capital
+                    balance=self.starting_capital,
+                    timestamp=self.broker.now()
                 )
                 session.add(strategy_balance)
                 await session.commit()
@@ -77,38 +100,65 @@ class BaseStrategy(ABC):
             )
             return result.scalars().all()  # Use scalars().all() for multiple rows
 
-    async def current_balance(self):
+    async def load_context(self):
+        '''Snapshot of this strategy's cash and positions, read in one query'''
         async with self.broker.Session() as session:
-            result = await session.execute(
-                select(Balance).filter_by(
-                    strategy=self.strategy_name,
-                    broker=self.broker.broker_name,
-                    type='cash'
-                ).order_by(Balance.timestamp.desc())
-            )
-            balance = result.scalar()  # Use scalar() to fetch the latest balance
-            total_balance = balance.balance
+            return await StrategyContext.load(session, self.strategy_name, self.broker.broker_name)
+
+    def target_weights(self):
+        '''Weights of the investable balance by symbol, for strategies rebalanced with rebalance_to_weights'''
+        return None
+
+    async def rebalance_to_weights(self, investable, context=None, weights=None, buffer=0.0, lot_size=1, min_order_value=0.0):
+        '''Place the orders that bring the strategy's positions to weights of investable.
+
+        Holdings without a weight are sold without a price, as they always
+        were. Prices are fetched concurrently and the orders sized in one
+        vectorized pass; sells go out before buys.
+        '''
+        weights = weights if weights is not None else self.target_weights()
+        if weights is None:
+            logger.error(f"No target weights for {self.strategy_name} strategy", extra={'strategy_name': self.strategy_name})
+            raise ValueError(f"{type(self).__name__} has no target weights: pass weights or override target_weights().")
+        context = context or await self.load_context()
+        unallocated = [symbol for symbol in context.holdings() if symbol not in weights]
+        symbols = list(weights) + unallocated
+        prices = await asyncio.gather(*[self._current_price(symbol) for symbol in weights])
+        # Positions being closed out are priced at their last known price
+        prices = [price if price is not None else np.nan for price in prices]
+        prices += [context.positions[symbol].latest_price for symbol in unallocated]
+        orders = rebalance_orders(
+            symbols,
+            [weights[symbol] for symbol in weights] + [0.0] * len(unallocated),
+            prices,
+            [context.quantity(symbol) for symbol in symbols],
+            investable,
+            cash=context.cash,
+            buffer=buffer,
+            lot_size=lot_size,
+            min_order_value=min_order_value,
+        )
+        for symbol, quantity, side, price in orders:
+            # The last known price only sizes close-outs, they are not limited to it
+            await self.place_order(symbol, quantity, side, None if symbol in unallocated else price)
+        return orders
+
+    async def _current_price(self, symbol):
+        if asyncio.iscoroutinefunction(self.broker.get_current_price):
+            return await self.broker.get_current_price(symbol)
+        return self.broker.get_current_price(symbol)
 
-            result_positions = await session.execute(
-                select(Position).filter_by(
-                    strategy=self.strategy_name,
-                    broker=self.broker.broker_name
-                )
-            )
-            positions = result_positions.scalars().all()
-
-            for position in positions:
-                total_balance += position.quantity * position.latest_price
-            return total_balance
+    async def current_balance(self):
+        return (await self.load_context()).total_balance
 
     async def cash(self):
         async with self.broker.Session() as session:
             result = await session.execute(
-                select(Balance).filter_by(
+                select(BalanceLatest).filter_by(
                     strategy=self.strategy_name,
                     broker=self.broker.broker_name,
                     type='cash'
-                ).order_by(Balance.timestamp.desc())
+                )
             )
             balance = result.scalar()
             return balance.balance
@@ -149,25 +199,28 @@ class BaseStrategy(ABC):
 
                 if target_quantity is not None and target_quantity > 0:
                     # We have a way of determining the target quantity for this strategy and symbol
-                    # See if there are uncategorized positions for this symbol that we can update
                     result = await session.execute(
                         select(Position).filter_by(
                             broker=self.broker.broker_name,
-                            strategy="uncategorized",
+                            strategy=self.strategy_name,
                             symbol=symbol
                         )
                     )
                     position = result.scalar()
 
-                    if not position:
-                        result = await session.execute(
-                            select(Position).filter_by(
-                                broker=self.broker.broker_name,
-                                strategy=self.strategy_name,
-                                symbol=symbol
-                            )
+                    # See if there are uncategorized positions for this symbol that we can update
+                    result = await session.execute(
+                        select(Position).filter_by(
+                            broker=self.broker.broker_name,
+                            strategy="uncategorized",
+                            symbol=symbol
                         )
-                        position = result.scalar()
+                    )
+                    uncategorized_position = result.scalar()
+
+                    if not position and uncategorized_position:
+                        # Claim the uncategorized position for this strategy
+                        position, uncategorized_position = uncategorized_position, None
 
                     if position:
                         position.strategy = self.strategy_name
@@ -176,7 +229,7 @@ class BaseStrategy(ABC):
                         position.quantity = min(
                             target_quantity, data['quantity'])
                         position.latest_price = current_price
-                        position.last_updated = datetime.now()
+                        position.last_updated = self.broker.now()
                         logger.info(
                             f"Updated position for {symbol} with quantity {position.quantity} and price {current_price}",
                             extra={'strategy_name': self.strategy_name})
@@ -187,25 +240,30 @@ class BaseStrategy(ABC):
                             symbol=symbol,
                             quantity=min(target_quantity, data['quantity']),
                             latest_price=current_price,
-                            last_updated=datetime.now()
+                            last_updated=self.broker.now()
                         )
                         session.add(position)
                         logger.info(
                             f"Created new position for {symbol} with quantity {data['quantity']} and price {current_price}",
                             extra={'strategy_name': self.strategy_name})
-                    # Create uncategorized positions for the remaining quantity
+                    # Keep the remaining quantity in the (single) uncategorized position
                     if target_quantity < data['quantity']:
-                        position = Position(
-                            broker=self.broker.broker_name,
-                            strategy="uncategorized",
-                            symbol=symbol,
-                            quantity=data['quantity'] - target_quantity,
-                            latest_price=current_price,
-                            last_updated=datetime.now()
-                        )
-                        session.add(position)
+                        if uncategorized_position:
+                            uncategorized_position.quantity = data['quantity'] - target_quantity
+                            uncategorized_position.latest_price = current_price
+                            uncategorized_position.last_updated = self.broker.now()
+                        else:
+                            uncategorized_position = Position(
+                                broker=self.broker.broker_name,
+                                strategy="uncategorized",
+                                symbol=symbol,
+                                quantity=data['quantity'] - target_quantity,
+                                latest_price=current_price,
+                                last_updated=self.broker.now()
+                            )
+                            session.add(uncategorized_position)
                         logger.info(
-                            f"Created uncategorized position for {symbol} with quantity {data['quantity'] - target_quantity} and price {current_price}",
+                            f"Set uncategorized position for {symbol} with quantity {data['quantity'] - target_quantity} and price {current_price}",
                             extra={'strategy_name': self.strategy_name})
 
             db_positions = await self.current_positions()
@@ -263,8 +321,9 @@ class BaseStrategy(ABC):
     async def place_future_option_order(self, symbol, quantity, side, price, wait_till_open=True, order_type='limit', execution_style=''):
         if execution_style == '':
             execution_style = self.execution_style
-        if is_futures_market_open() or not wait_till_open:
-            await self.broker.place_future_option_order(symbol, quantity, side, self.strategy_name, price, order_type, execution_style=execution_style)
+        if is_futures_market_open(self.broker.now(timezone.utc)) or not wait_till_open:
+            with order_decision():
+                await self.broker.place_future_option_order(symbol, quantity, side, self.strategy_name, price, order_type, execution_style=execution_style)
             logger.info(f"Placed {side} order for {symbol}: {quantity} shares", extra={
                         'strategy_name': self.strategy_name, 'symbol': symbol, 'quantity': quantity, 'side': side, 'price': price, 'order_type': order_type})
         else:
@@ -274,8 +333,9 @@ class BaseStrategy(ABC):
     async def place_option_order(self, symbol, quantity, side, price, wait_till_open=True, order_type='limit', execution_style=''):
         if execution_style == '':
             execution_style = self.execution_style
-        if is_market_open() or not wait_till_open:
-            await self.broker.place_option_order(symbol, quantity, side, self.strategy_name, price, order_type, execution_style=execution_style)
+        if is_market_open(self.broker.now(timezone.utc)) or not wait_till_open:
+            with order_decision():
+                await self.broker.place_option_order(symbol, quantity, side, self.strategy_name, price, order_type, execution_style=execution_style)
             logger.info(f"Placed {side} order for {symbol}: {quantity} shares", extra={
                         'strategy_name': self.strategy_name, 'symbol': symbol, 'quantity': quantity, 'side': side, 'price': price, 'order_type': order_type})
         else:
@@ -285,8 +345,9 @@ class BaseStrategy(ABC):
     async def place_order(self, stock, quantity, side, price, wait_till_open=True, order_type='limit', execution_style=''):
         if execution_style == '':
             execution_style = self.execution_style
-        if is_market_open() or not wait_till_open:
-            await self.broker.place_order(stock, quantity, side, self.strategy_name, price, order_type, execution_style=execution_style)
+        if is_market_open(self.broker.now(timezone.utc)) or not wait_till_open:
+            with order_decision():
+                await self.broker.place_order(stock, quantity, side, self.strategy_name, price, order_type, execution_style=execution_style)
             logger.info(f"Placed {side} order for {stock}: {quantity} shares", extra={
                         'strategy_name': self.strategy_name, 'stock': stock, 'quantity': quantity, 'side': side, 'price': price, 'order_type': order_type})
         else:
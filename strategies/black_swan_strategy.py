@@ -1,8 +1,9 @@
 import random
 from datetime import timedelta, datetime, UTC
-from database.models import Balance, Trade
+from database.models import BalanceLatest, Trade
 from utils.utils import is_market_open
 from utils.logger import logger
+from utils.blocking import run_blocking
 from strategies.base_strategy import BaseStrategy
 import asyncio
 import yfinance as yf
@@ -29,11 +30,11 @@ class BlackSwanStrategy(BaseStrategy):
         logger.debug("Starting rebalance process")
 
         with self.broker.Session() as session:
-            balance = session.query(Balance).filter_by(
+            balance = session.query(BalanceLatest).filter_by(
                 strategy=self.strategy_name,
                 broker=self.broker.broker_name,
                 type='cash'
-            ).order_by(Balance.timestamp.desc()).first()
+            ).first()
             if balance is None:
                 logger.error(
                     f"Strategy balance not initialized for {self.strategy_name} strategy on {self.broker.broker_name}.")
@@ -86,7 +87,7 @@ class BlackSwanStrategy(BaseStrategy):
         target_exp_date = current_date + timedelta(days=self.expiry_days)
         ticker = yf.Ticker(symbol)
         # Fetch the available expiration dates
-        exp_dates = ticker.options
+        exp_dates = await run_blocking('yfinance', lambda: ticker.options)
         exp_dates = pd.to_datetime(exp_dates)
         # Find the closest expiration date
         closest_exp_date = min(exp_dates, key=lambda x: abs(x - target_exp_date)).strftime('%Y-%m-%d')
@@ -98,7 +99,7 @@ class BlackSwanStrategy(BaseStrategy):
             return None
 
     async def get_otm_option(self, symbol, exp_date, option_type):
-        options_chain = await yf.Ticker(symbol).option_chain(exp_date)
+        options_chain = await run_blocking('yfinance', yf.Ticker(symbol).option_chain, exp_date)
         current_price = await self.broker.get_current_price(symbol) if asyncio.iscoroutinefunction(self.broker.get_current_price) else self.broker.get_current_price(symbol)
 
         if option_type == 'put':
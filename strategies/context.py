@@ -0,0 +1,50 @@
+from sqlalchemy import select, and_
+from database.models import BalanceLatest, Position
+from utils.logger import logger
+
+
+class StrategyContext:
+    '''A strategy's cash and positions as of one read.
+
+    load() fetches the latest cash balance and every position of the
+    strategy in a single query, so a rebalance reads the database once and
+    looks positions up by symbol instead of querying for them.
+    '''
+    def __init__(self, strategy_name, broker_name, cash, positions):
+        self.strategy_name = strategy_name
+        self.broker_name = broker_name
+        self.cash = cash
+        self.positions = {position.symbol: position for position in positions}
+
+    @classmethod
+    async def load(cls, session, strategy_name, broker_name):
+        # One row per position, each carrying the cash balance; a single row with no position if there are none
+        result = await session.execute(
+            select(BalanceLatest.balance, Position)
+            .select_from(BalanceLatest)
+            .outerjoin(Position, and_(Position.broker == BalanceLatest.broker, Position.strategy == BalanceLatest.strategy))
+            .where(BalanceLatest.broker == broker_name, BalanceLatest.strategy == strategy_name, BalanceLatest.type == 'cash')
+        )
+        rows = result.all()
+        if not rows:
+            logger.error(f"Strategy balance not initialized for {strategy_name} strategy on {broker_name}.",
+                         extra={'strategy_name': strategy_name})
+            raise ValueError(f"Strategy balance not initialized for {strategy_name} strategy on {broker_name}.")
+        positions = [position for _, position in rows if position is not None]
+        return cls(strategy_name, broker_name, rows[0][0], positions)
+
+    def quantity(self, symbol):
+        position = self.positions.get(symbol)
+        return position.quantity if position else 0
+
+    def holdings(self):
+        '''Quantities of the symbols the strategy holds'''
+        return {symbol: position.quantity for symbol, position in self.positions.items() if position.quantity > 0}
+
+    @property
+    def positions_value(self):
+        return sum(position.quantity * position.latest_price for position in self.positions.values())
+
+    @property
+    def total_balance(self):
+        return self.cash + self.positions_value
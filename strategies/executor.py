@@ -0,0 +1,103 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from utils.latency import order_decision
+from utils.logger import logger
+
+STRATEGY_TIMEOUT_SECONDS = 5 * 60
+# Consecutive failed rebalances after which a strategy is rebuilt
+RESTART_AFTER_FAILURES = 1
+
+
+def _broker_key(strategy):
+    broker = strategy.broker
+    return getattr(broker, 'broker_name', None) or id(broker)
+
+
+class StrategyExecutor:
+    '''Rebalances each strategy when its rebalance interval has passed.
+
+    Strategies on different brokers rebalance concurrently. Strategies on the
+    same broker account take turns on that account's lock, so two of them
+    never size orders against the same cash at once; market data hooks run
+    through run_hook under the same lock. Every rebalance has its
+    own timeout, and a failing strategy is rebuilt on its own through
+    restart(name) while the others keep running.
+    '''
+    def __init__(self, strategies, restart=None, timeouts=None, timeout_seconds=STRATEGY_TIMEOUT_SECONDS,
+                 restart_after_failures=RESTART_AFTER_FAILURES):
+        self.strategies = dict(strategies)
+        self.restart = restart
+        self.timeouts = timeouts or {}
+        self.timeout_seconds = timeout_seconds
+        self.restart_after_failures = restart_after_failures
+        self.last_rebalances = {name: datetime.min for name in self.strategies}
+        self.failures = {name: 0 for name in self.strategies}
+        self.broker_locks = {}
+
+    def due(self, now):
+        return [
+            name for name, strategy in self.strategies.items()
+            if now - self.last_rebalances[name] >= timedelta(minutes=strategy.rebalance_interval_minutes)
+        ]
+
+    async def run_due(self, now=None):
+        '''Rebalance every due strategy; returns their statuses by name'''
+        now = now or datetime.now()
+        return await self.run(self.due(now), now)
+
+    async def run(self, names, now=None):
+        '''Rebalance the named strategies; returns their statuses by name'''
+        now = now or datetime.now()
+        statuses = await asyncio.gather(*[self._run(name, now) for name in names])
+        return dict(zip(names, statuses))
+
+    def _lock(self, strategy):
+        key = _broker_key(strategy)
+        if key not in self.broker_locks:
+            self.broker_locks[key] = asyncio.Lock()
+        return self.broker_locks[key]
+
+    async def _run(self, name, now):
+        strategy = self.strategies[name]
+        timeout = self.timeouts.get(name) or self.timeout_seconds
+        async with self._lock(strategy):
+            started = time.monotonic()
+            try:
+                # Orders placed by this rebalance measure their decision time from here
+                with order_decision():
+                    await asyncio.wait_for(strategy.rebalance(), timeout=timeout)
+                status = 'ok'
+            except asyncio.TimeoutError:
+                status = 'timeout'
+                logger.error(f"Rebalancing strategy {name} timed out", extra={'strategy_name': name, 'timeout': timeout})
+            except Exception as e:
+                status = 'error'
+                logger.error(f"Error during rebalancing strategy {name}", extra={'strategy_name': name, 'error': str(e)}, exc_info=True)
+        # A failed strategy waits for its next interval too, instead of retrying every tick
+        self.last_rebalances[name] = now
+        logger.info(f'Strategy {name} rebalanced', extra={
+            'strategy_name': name, 'status': status, 'seconds': round(time.monotonic() - started, 3)})
+        if status == 'ok':
+            self.failures[name] = 0
+        else:
+            self.failures[name] += 1
+            if self.failures[name] >= self.restart_after_failures:
+                await self._restart(name)
+        return status
+
+    async def run_hook(self, strategy, hook, event):
+        '''Run one of strategy's event hooks, taking turns with rebalances on its broker account'''
+        async with self._lock(strategy):
+            with order_decision():
+                await getattr(strategy, hook)(event)
+
+    async def _restart(self, name):
+        if self.restart is None:
+            return
+        try:
+            self.strategies[name] = await self.restart(name)
+            self.failures[name] = 0
+            logger.info(f'Strategy {name} restarted', extra={'strategy_name': name})
+        except Exception as e:
+            logger.error(f'Failed to restart strategy {name}', extra={'strategy_name': name, 'error': str(e)}, exc_info=True)
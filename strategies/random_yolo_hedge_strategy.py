@@ -1,6 +1,6 @@
 import random
 from datetime import timedelta, datetime, UTC
-from database.models import Balance, Trade
+from database.models import BalanceLatest, Trade
 from utils.utils import is_market_open
 from utils.logger import logger
 from strategies.base_strategy import BaseStrategy
@@ -25,11 +25,11 @@ class RandomYoloHedge(BaseStrategy):
         logger.debug("Starting rebalance process")
 
         with self.broker.Session() as session:
-            balance = session.query(Balance).filter_by(
+            balance = session.query(BalanceLatest).filter_by(
                 strategy=self.strategy_name,
                 broker=self.broker.broker_name,
                 type='cash'
-            ).order_by(Balance.timestamp.desc()).first()
+            ).first()
             if balance is None:
                 logger.error(
                     f"Strategy balance not initialized for {self.strategy_name} strategy on {self.broker.broker_name}.")
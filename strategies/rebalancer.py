@@ -0,0 +1,48 @@
+'''Target-weight rebalancing over whole allocation universes at once.
+
+rebalance_orders works on NumPy arrays indexed by symbol, so a 500 name
+allocation costs a handful of vector operations rather than a Python loop
+per symbol.
+'''
+import numpy as np
+
+
+def rebalance_orders(symbols, weights, prices, quantities, investable, cash=None, buffer=0.0, lot_size=1,
+                     min_order_value=0.0):
+    '''Orders that move quantities to weights of the investable balance.
+
+    A symbol only trades once it drifts outside target * (1 +/- buffer), and
+    then trades all the way back to its target. Targets are whole lots.
+    With cash given, buys are scaled down to what cash plus the proceeds of
+    the sells can pay for. Symbols without a usable price are left alone.
+    Returns (symbol, quantity, side, price) tuples, sells first.
+    '''
+    weights = np.asarray(weights, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    quantities = np.asarray(quantities, dtype=float)
+    priced = np.isfinite(prices) & (prices > 0)
+    safe_prices = np.where(priced, prices, 1.0)
+
+    targets = np.floor(investable * weights / safe_prices / lot_size) * lot_size
+    # Unpriced symbols keep what they hold
+    targets = np.where(priced, targets, quantities)
+    outside_band = (quantities < targets * (1 - buffer)) | (quantities > targets * (1 + buffer))
+    deltas = np.where(outside_band, targets - quantities, 0.0)
+    deltas[np.abs(deltas) * safe_prices < min_order_value] = 0.0
+
+    buys = np.clip(deltas, 0, None)
+    sells = np.clip(-deltas, 0, None)
+    if cash is not None:
+        cost = buys @ safe_prices
+        available = cash + sells @ safe_prices
+        if cost > available:
+            buys = np.floor(buys * (max(available, 0.0) / cost) / lot_size) * lot_size
+
+    orders = [(symbols[i], _quantity(sells[i]), 'sell', float(prices[i])) for i in np.flatnonzero(sells)]
+    orders += [(symbols[i], _quantity(buys[i]), 'buy', float(prices[i])) for i in np.flatnonzero(buys)]
+    return orders
+
+
+def _quantity(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
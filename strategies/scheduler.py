@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import itertools
+import random
+import re
+from datetime import datetime, timedelta, timezone
+from utils.logger import logger
+from utils.trading_calendar import NYSE, CRYPTO, get_calendar
+
+MARKET_HOURS_ANY = 'any'
+MARKET_HOURS_OPEN = 'open'
+MARKET_HOURS_ALIGNED = 'aligned'
+MISSED_RUN_ONCE = 'run_once'
+MISSED_SKIP = 'skip'
+# A run later than this counts as missed
+MISSED_GRACE_SECONDS = 60
+
+_SESSION_OFFSET = re.compile(r'^(open|close)\s*(?:([+-])\s*(\d+)\s*([smh]))?$')
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600}
+_EPSILON = timedelta(microseconds=1)
+
+
+def parse_session_offset(spec):
+    '''"open", "open+5m" or "close-15m" as ('open' | 'close', timedelta)'''
+    match = _SESSION_OFFSET.match(spec.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid session time: {spec}")
+    anchor, sign, amount, unit = match.groups()
+    offset = timedelta(seconds=int(amount) * _UNIT_SECONDS[unit]) if amount else timedelta()
+    return anchor, -offset if sign == '-' else offset
+
+
+class Schedule:
+    '''When a strategy runs.
+
+    Interval schedules run every interval_seconds. With market_hours='open'
+    they only run while the calendar is open and run at the open after a
+    closed stretch; with 'aligned' they run on the interval grid counted from
+    each session's open (9:30, 9:35, ... for five minutes on the NYSE).
+    Schedules with `at` run at times relative to each session's open and
+    close instead, e.g. ['open+5m', 'close-15m'].
+    '''
+    def __init__(self, interval_seconds=None, at=None, calendar=NYSE, market_hours=MARKET_HOURS_ANY, jitter_seconds=0,
+                 missed=MISSED_RUN_ONCE, grace_seconds=MISSED_GRACE_SECONDS):
+        if market_hours not in (MARKET_HOURS_ANY, MARKET_HOURS_OPEN, MARKET_HOURS_ALIGNED):
+            raise ValueError(f"Unknown market_hours: {market_hours}")
+        if missed not in (MISSED_RUN_ONCE, MISSED_SKIP):
+            raise ValueError(f"Unknown missed run policy: {missed}")
+        if not at and not interval_seconds:
+            raise ValueError('A schedule needs interval_seconds or at')
+        self.interval = timedelta(seconds=interval_seconds) if interval_seconds else None
+        self.at = [parse_session_offset(spec) for spec in at or []]
+        self.calendar = calendar
+        self.market_hours = market_hours
+        self.jitter_seconds = jitter_seconds
+        self.missed = missed
+        self.grace = timedelta(seconds=grace_seconds)
+
+    @classmethod
+    def from_config(cls, strategy_config, strategy=None):
+        '''Build from a strategy's `schedule` section, defaulting to its rebalance interval'''
+        options = dict(strategy_config.get('schedule') or {})
+        if 'interval_seconds' not in options and not options.get('at'):
+            minutes = strategy_config.get('rebalance_interval_minutes') or getattr(strategy, 'rebalance_interval_minutes', None)
+            options['interval_seconds'] = float(minutes) * 60 if minutes else None
+        calendar = options.pop('calendar', None)
+        if calendar:
+            options['calendar'] = get_calendar(calendar)
+        elif strategy_config.get('broker') == 'kraken':
+            options['calendar'] = CRYPTO
+        return cls(**options)
+
+    def upcoming(self, ts):
+        '''The first slot at or after ts'''
+        if self.at:
+            return self._next_session_time(ts)
+        if self.market_hours == MARKET_HOURS_OPEN:
+            return ts if self.calendar.is_open(ts) else self.calendar.next_open(ts)
+        if self.market_hours == MARKET_HOURS_ALIGNED:
+            return self._align(ts)
+        return ts
+
+    def following(self, slot):
+        '''The slot after slot, which may already have passed'''
+        if self.at:
+            return self._next_session_time(slot + _EPSILON)
+        return self.upcoming(slot + self.interval)
+
+    def skip_ahead(self, slot, now):
+        '''The first slot after slot that has not passed yet'''
+        if self.at or self.market_hours == MARKET_HOURS_ALIGNED:
+            return self.upcoming(now)
+        # Keep the interval grid instead of restarting it at now
+        missed = (now - slot) // self.interval + 1
+        return self.upcoming(slot + missed * self.interval)
+
+    def _align(self, ts):
+        session = self.calendar.session(ts)
+        if session:
+            open_, close = session
+            steps = -((open_ - ts) // self.interval)
+            slot = open_ + steps * self.interval
+            if slot < close:
+                return slot
+            ts = close
+        return self.calendar.next_open(ts)
+
+    def _next_session_time(self, ts):
+        # The session containing ts, then the ones after it
+        session = self.calendar.session(ts)
+        if session is None:
+            open_ = self.calendar.next_open(ts)
+            session = open_, self.calendar.next_close(open_)
+        while True:
+            open_, close = session
+            slots = [(open_ if anchor == 'open' else close) + offset for anchor, offset in self.at]
+            later = [slot for slot in slots if slot >= ts]
+            if later:
+                return min(later)
+            open_ = self.calendar.next_open(close)
+            session = open_, self.calendar.next_close(open_)
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+class StrategyScheduler:
+    '''Runs the executor's strategies on their schedules.
+
+    Jobs sit in a heap keyed by their next due time and the loop sleeps until
+    exactly the first one is due. A strategy is back in the heap only once
+    its run has finished, so a slow run never overlaps itself; slots that
+    passed in the meantime are missed and handled by the schedule's policy:
+    'run_once' runs once right away, 'skip' waits for the next slot.
+    '''
+    def __init__(self, executor, schedules, clock=_utcnow):
+        self.executor = executor
+        self.schedules = dict(schedules)
+        self.clock = clock
+        self.heap = []
+        self.running = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+
+    def _push(self, name, slot):
+        schedule = self.schedules[name]
+        due = slot
+        if schedule.jitter_seconds:
+            due += timedelta(seconds=random.uniform(0, schedule.jitter_seconds))
+        heapq.heappush(self.heap, (due, next(self.counter), name, slot))
+        self.wakeup.set()
+
+    def start(self):
+        now = self.clock()
+        for name, schedule in self.schedules.items():
+            self._push(name, schedule.upcoming(now))
+
+    def next_due(self):
+        return self.heap[0][0] if self.heap else None
+
+    async def run(self, until=None):
+        '''Run jobs as they come due until the `until` datetime, or forever'''
+        self.start()
+        try:
+            while True:
+                self.wakeup.clear()
+                now = self.clock()
+                if until is not None and now >= until:
+                    break
+                while self.heap and self.heap[0][0] <= now:
+                    _, _, name, slot = heapq.heappop(self.heap)
+                    self._dispatch(name, slot, now)
+                wake_at = [ts for ts in (self.next_due(), until) if ts is not None]
+                timeout = (min(wake_at) - now).total_seconds() if wake_at else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self.running:
+                await asyncio.gather(*self.running.values(), return_exceptions=True)
+
+    def _dispatch(self, name, slot, now):
+        schedule = self.schedules[name]
+        if now - slot > schedule.grace and schedule.missed == MISSED_SKIP:
+            next_slot = schedule.skip_ahead(slot, now)
+            logger.info(f'Skipped missed run of strategy {name}', extra={
+                'strategy_name': name, 'slot': slot.isoformat(), 'next_slot': next_slot.isoformat()})
+            self._push(name, next_slot)
+            return
+        self.running[name] = asyncio.ensure_future(self._run(name, slot))
+
+    async def _run(self, name, slot):
+        schedule = self.schedules[name]
+        try:
+            await self.executor.run([name])
+        finally:
+            self.running.pop(name, None)
+            now = self.clock()
+            next_slot = schedule.following(slot)
+            if now - next_slot > schedule.grace:
+                next_slot = now if schedule.missed == MISSED_RUN_ONCE else schedule.skip_ahead(slot, now)
+            self._push(name, next_slot)
@@ -1,8 +1,16 @@
 import pytest
 import asyncio
+from database.engines import dispose_engines
 
 @pytest.fixture(scope="module")
 def event_loop():
     loop = asyncio.get_event_loop_policy().new_event_loop()
     yield loop
     loop.close()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def dispose_registered_engines():
+    # Pooled aiosqlite connections keep their threads, and the test run, alive
+    yield
+    asyncio.run(dispose_engines())
@@ -0,0 +1,100 @@
+import os
+from unittest.mock import patch
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+import pyarrow.parquet as pq
+from sqlalchemy import select, func, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.models import Trade, Balance, BalanceLatest, init_db
+from data.archive import ParquetArchive, archive_history, with_archived
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def trade_row(day, status='filled', broker='tradier', strategy='RSI'):
+    return {'symbol': 'AAPL', 'quantity': 1, 'price': 100.0, 'side': 'buy', 'status': status, 'broker': broker,
+            'strategy': strategy, 'profit_loss': 1.0, 'timestamp': NOW - timedelta(days=day)}
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    async with engine.begin() as conn:
+        await conn.execute(insert(Trade), [trade_row(day) for day in (10, 400, 420)] + [
+            trade_row(430, status='open'), trade_row(440, broker='tastytrade', strategy='MACD')])
+        await conn.execute(insert(Balance), [
+            {'broker': 'tradier', 'strategy': 'RSI', 'type': 'cash', 'balance': float(day), 'timestamp': NOW - timedelta(days=day)}
+            for day in (1, 400, 500)])
+    yield engine
+    await engine.dispose()
+
+
+async def count(engine, model):
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count(model.id)))).scalar()
+
+
+@pytest.mark.asyncio
+async def test_archive_history_moves_old_rows_to_parquet(engine, tmp_path):
+    # The newest balance is what balance_latest points to, even when it is old
+    async with engine.begin() as conn:
+        await conn.execute(insert(BalanceLatest), [{'broker': 'tradier', 'strategy': 'RSI', 'type': 'positions', 'balance': 0.0,
+                                                    'timestamp': NOW - timedelta(days=500), 'balance_id': 3}])
+
+    archived = await archive_history(engine, str(tmp_path), trade_retention_days=365, balance_retention_days=365, now=NOW)
+    assert archived == {'trades': 3, 'balances': 1}
+    # Recent and open trades stay, as do balances referenced by balance_latest
+    assert await count(engine, Trade) == 2
+    assert await count(engine, Balance) == 2
+
+    archive = ParquetArchive(str(tmp_path))
+    files = archive.load_manifest()['files']
+    assert sorted(files) == [
+        os.path.join('balances', 'year=2023', 'month=04', 'broker=tradier', 'part-2-2.parquet'),
+        os.path.join('trades', 'year=2023', 'month=03', 'broker=tastytrade', 'part-5-5.parquet'),
+        os.path.join('trades', 'year=2023', 'month=04', 'broker=tradier', 'part-2-3.parquet'),
+    ]
+    rows = archive.read(Trade, brokers=['tradier'])
+    assert [row['id'] for row in rows] == [3, 2]
+    assert rows[0]['timestamp'] == NOW - timedelta(days=420)
+    assert archive.read(Trade, strategies=['MACD'])[0]['broker'] == 'tastytrade'
+    assert archive.read(Trade, start=NOW - timedelta(days=410)) == [rows[1]]
+
+
+@pytest.mark.asyncio
+async def test_with_archived_unions_hot_and_archived_rows(engine, tmp_path):
+    await archive_history(engine, str(tmp_path), now=NOW)
+    archive = ParquetArchive(str(tmp_path))
+    async with engine.connect() as conn:
+        hot = (await conn.execute(select(Trade).order_by(Trade.id))).all()
+
+    trades = with_archived(Trade, hot, archive, brokers=['tradier'])
+    assert [trade.id for trade in trades] == [3, 2, 1, 4]
+    assert trades[0].profit_loss == 1.0
+
+
+def test_archived_copies_of_hot_rows_are_skipped(tmp_path):
+    archive = ParquetArchive(str(tmp_path))
+    row = dict(trade_row(400), id=7, broker_id=None, executed_price=None, success=None, execution_style=None)
+    archive.write(Trade, [row])
+    hot = [Trade(**row)]
+    assert with_archived(Trade, hot, archive) == hot
+
+
+def test_read_caches_files_until_they_are_rewritten(tmp_path):
+    archive = ParquetArchive(str(tmp_path))
+    row = dict(trade_row(400), id=7, broker_id=None, executed_price=None, success=None, execution_style=None)
+    archive.write(Trade, [row])
+
+    with patch('data.archive.pq.read_table', wraps=pq.read_table) as read_table:
+        assert archive.read(Trade)[0]['profit_loss'] == 1.0
+        assert archive.read(Trade, strategies=['RSI'])[0]['id'] == 7
+        assert read_table.call_count == 1
+
+        path, = archive.files(Trade)
+        archive.write(Trade, [dict(row, profit_loss=2.0)])
+        os.utime(os.path.join(str(tmp_path), path), ns=(0, 0))
+        assert archive.read(Trade)[0]['profit_loss'] == 2.0
+        assert read_table.call_count == 2
@@ -0,0 +1,129 @@
+import csv
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from backtest.history import MarketHistory
+from backtest.engine import Backtester
+from backtest.sqlite import create_inline_engine
+from database.models import Trade, init_db
+
+# 9:30 to 10:55 Eastern on three January trading days, in UTC
+TIMES = [datetime(2024, 1, day, 14, 30, tzinfo=timezone.utc) + timedelta(minutes=5 * i) for day in (2, 3, 4) for i in range(18)]
+PUT = 'SPY240202P00400000'
+
+
+def write_bars(path, symbol, closes, times=TIMES):
+    with open(path / 'bars' / f'{symbol}.csv', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['timestamp', 'close'])
+        for timestamp, close in zip(times, closes):
+            writer.writerow([timestamp.isoformat(), close])
+
+
+@pytest.fixture
+def history(tmp_path):
+    (tmp_path / 'bars').mkdir()
+    write_bars(tmp_path, 'SPY', [470 + i * 0.5 for i in range(len(TIMES))])
+    write_bars(tmp_path, 'TLT', [100 - i * 0.1 for i in range(len(TIMES))])
+    (tmp_path / 'options' / 'SPY').mkdir(parents=True)
+    with open(tmp_path / 'options' / 'SPY' / '2024-01-02.csv', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['contractSymbol', 'expiration', 'type', 'strike', 'bid', 'ask', 'lastPrice'])
+        writer.writerow([PUT, '2024-02-02', 'put', 400.0, 0.95, 1.05, 1.0])
+        writer.writerow(['SPY240202P00460000', '2024-02-02', 'put', 460.0, 4.9, 5.1, 5.0])
+        writer.writerow(['SPY240202C00480000', '2024-02-02', 'call', 480.0, 2.9, 3.1, 3.0])
+    return MarketHistory(str(tmp_path))
+
+
+def constant_percentage(interval=60):
+    return {
+        'type': 'constant_percentage',
+        'stock_allocations': {'SPY': 0.6, 'TLT': 0.4},
+        'cash_percentage': 0.1,
+        'rebalance_interval_minutes': interval,
+        'starting_capital': 100000,
+    }
+
+
+def test_price_as_of(history):
+    assert history.price('SPY', TIMES[0] - timedelta(minutes=1)) is None
+    assert history.price('SPY', TIMES[0]) == 470
+    assert history.price('SPY', TIMES[1] + timedelta(minutes=2)) == 470.5
+    assert history.price('SPY', datetime(2024, 2, 1, tzinfo=timezone.utc)) == 470 + (len(TIMES) - 1) * 0.5
+    assert history.price(PUT, TIMES[0]) == 1.0
+    assert history.timeline(start=TIMES[18]) == TIMES[18:]
+
+
+@pytest.mark.asyncio
+async def test_inline_engine_commits_and_rolls_back():
+    engine = create_inline_engine()
+    await init_db(engine)
+    Session = sessionmaker(bind=engine, class_=AsyncSession)
+    try:
+        async with Session() as session:
+            session.add(Trade(symbol='SPY', quantity=1, price=470.0, side='buy', status='open', broker='backtest'))
+            await session.commit()
+            session.add(Trade(symbol='TLT', quantity=1, price=100.0, side='buy', status='open', broker='backtest'))
+            await session.flush()
+            await session.rollback()
+
+            assert (await session.execute(select(func.count(Trade.id)))).scalar() == 1
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_backtest_rebalances_on_the_virtual_clock(history):
+    result = await Backtester({'constant': constant_percentage()}, history).run()
+
+    assert result.timestamps == TIMES
+    assert len(result.equity['constant']) == len(TIMES)
+    trades = result.trades['constant']
+    # Bought on the first bar
+    assert {trade.symbol for trade in trades} == {'SPY', 'TLT'}
+    assert trades[0].timestamp == TIMES[0].replace(tzinfo=None)
+    assert all(trade.timestamp.year == 2024 for trade in trades)
+    assert result.equity['constant'][0] == pytest.approx(100000)
+    # Marked to market every bar: SPY gains 0.5 and TLT loses 0.1
+    quantities = {trade.symbol: trade.quantity for trade in trades[:2]}
+    assert result.equity['constant'][1] - result.equity['constant'][0] == pytest.approx(quantities['SPY'] * 0.5 - quantities['TLT'] * 0.1)
+    stats = result.stats()['constant']
+    assert stats['trades'] == len(trades)
+    assert stats['errors'] == 0
+    assert stats['final_equity'] == result.equity['constant'][-1]
+    assert set(stats) >= {'total_return', 'sharpe_ratio', 'max_drawdown', 'var', 'equity_max_drawdown'}
+
+
+@pytest.mark.asyncio
+async def test_backtest_fills_with_slippage(history):
+    result = await Backtester({'constant': constant_percentage()}, history, end=TIMES[0], slippage_bps=10).run()
+
+    prices = {trade.symbol: trade.executed_price for trade in result.trades['constant']}
+    assert prices == {'SPY': pytest.approx(470 * 1.001), 'TLT': pytest.approx(100 * 1.001)}
+    assert result.equity['constant'][0] < 100000
+
+
+@pytest.mark.asyncio
+async def test_backtest_checks_market_hours_on_the_virtual_clock(tmp_path):
+    (tmp_path / 'bars').mkdir()
+    # Before the NYSE opens on each of the days
+    times = [timestamp - timedelta(hours=2) for timestamp in TIMES]
+    write_bars(tmp_path, 'SPY', [470] * len(times), times)
+    write_bars(tmp_path, 'TLT', [100] * len(times), times)
+    result = await Backtester({'constant': constant_percentage()}, MarketHistory(str(tmp_path))).run()
+
+    assert result.trades['constant'] == []
+    assert list(result.equity['constant']) == [100000] * len(times)
+
+
+@pytest.mark.asyncio
+async def test_backtest_writes_the_equity_curve(history, tmp_path):
+    result = await Backtester({'constant': constant_percentage()}, history, end=TIMES[2]).run()
+    result.to_csv(tmp_path / 'equity.csv')
+
+    with open(tmp_path / 'equity.csv') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ['timestamp', 'constant']
+    assert [row[0] for row in rows[1:]] == [timestamp.isoformat() for timestamp in TIMES[:3]]
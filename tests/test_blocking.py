@@ -0,0 +1,104 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from utils.blocking import BlockingExecutor, LoopLagMonitor
+
+
+@pytest.fixture
+def executor():
+    executor = BlockingExecutor(max_workers={'sdk': 2}, timeout_seconds=5)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_calls_are_capped_per_library(executor):
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow_call():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return 'done'
+
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    results = await asyncio.gather(*[executor.run('sdk', slow_call) for _ in range(4)], tick())
+    assert results[:4] == ['done'] * 4
+    assert peak[0] == 2
+    # The loop kept running while the calls blocked their threads
+    assert ticks == 5
+    assert executor.metrics()['sdk']['count'] == 4
+
+
+@pytest.mark.asyncio
+@patch('utils.blocking.logger')
+async def test_timed_out_calls_that_are_still_queued_never_run(mock_logger):
+    executor = BlockingExecutor(max_workers={'sdk': 1})
+    queued_ran = []
+    first = asyncio.ensure_future(executor.run('sdk', time.sleep, 0.2))
+    await asyncio.sleep(0)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run('sdk', queued_ran.append, True, timeout=0.05)
+    await first
+    executor.shutdown()
+
+    assert queued_ran == []
+    assert executor.timeouts['sdk'] == 1
+    assert mock_logger.error.call_args.kwargs['extra']['call'] == 'list.append'
+
+
+@patch('utils.blocking.logger')
+def test_synchronous_calls_time_out(mock_logger, executor):
+    with pytest.raises(concurrent.futures.TimeoutError):
+        executor.call('sdk', time.sleep, 0.2, timeout=0.05)
+    assert executor.call('sdk', sum, [1, 2]) == 3
+    with pytest.raises(ZeroDivisionError):
+        executor.call('sdk', divmod, 1, 0)
+    assert executor.metrics()['sdk']['errors'] == 1
+
+
+@pytest.mark.asyncio
+async def test_calls_without_a_timeout_wait_for_the_result():
+    executor = BlockingExecutor(timeout_seconds=0.05)
+
+    assert await executor.run('sdk', lambda: time.sleep(0.2) or 'placed', timeout=None) == 'placed'
+    assert executor.call('sdk', lambda: time.sleep(0.2) or 'placed', timeout=None) == 'placed'
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run('sdk', time.sleep, 0.2)
+    executor.shutdown()
+    assert executor.timeouts['sdk'] == 1
+
+
+def block_the_loop():
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+@patch('utils.blocking.logger')
+async def test_loop_lag_monitor_names_the_blocking_call(mock_logger):
+    monitor = LoopLagMonitor(interval_seconds=0.05, threshold_seconds=0.1)
+    monitor.start()
+    await asyncio.sleep(0.06)
+    block_the_loop()
+    await asyncio.sleep(0.1)
+    monitor.stop()
+
+    extra = mock_logger.warning.call_args.kwargs['extra']
+    assert extra['lag_seconds'] >= 0.2
+    assert 'block_the_loop' in extra['blocked_in']
+    assert monitor.metrics()['max_ms'] >= 200
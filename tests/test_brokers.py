@@ -2,12 +2,14 @@ import pytest
 import pytest_asyncio
 from unittest.mock import MagicMock, patch
 from datetime import datetime
-from database.models import Trade, Position, Base
+from database.models import Trade, Position, Balance, BalanceLatest, Base
+from database.write_queue import WriteBehindQueue
 from database.db_manager import DBManager
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, event
 from brokers.base_broker import BaseBroker
+from utils.latency import LatencyTracker
 #import logging
 #logging.getLogger("sqlalchemy.engine").setLevel(logging.DEBUG)
 class MockBroker(BaseBroker):
@@ -789,3 +791,107 @@ async def test_normal_sell_buy_alternate_name(session, broker):
     result = await session.execute(select(Position).filter_by(symbol="COIN"))
     position = result.scalars().first()
     assert position.quantity == -5
+
+
+class OrderingBroker(MockBroker):
+    async def _place_order(self, symbol, quantity, side, price=None, order_type='limit'):
+        return {'order_id': 42, 'status': 'open'}
+
+
+@pytest_asyncio.fixture
+async def ordering_broker(engine):
+    return OrderingBroker(api_key="dummy_api_key", secret_key="dummy_secret_key", broker_name="dummy_broker", engine=engine)
+
+
+async def seed_cash(session, amount, timestamp=None):
+    session.add(Balance(broker='dummy_broker', strategy='RSI', type='cash', balance=amount, timestamp=timestamp or datetime(2024, 1, 1)))
+    await session.commit()
+
+
+async def latest_cash(session):
+    result = await session.execute(
+        select(BalanceLatest.balance).filter_by(broker='dummy_broker', strategy='RSI', type='cash').execution_options(populate_existing=True)
+    )
+    return result.scalar()
+
+
+@pytest.mark.asyncio
+async def test_place_order_writes_trade_and_balance_together(session, ordering_broker, engine):
+    await seed_cash(session, 10000)
+    await ordering_broker.place_order('AAPL', 10, 'buy', 'RSI', price=100)
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine.sync_engine, 'before_cursor_execute', record)
+    try:
+        await ordering_broker.place_order('AAPL', 5, 'sell', 'RSI', price=110)
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', record)
+
+    # One keyed read of balance_latest, no scan of the balance history
+    reads = [s for s in statements if s.startswith('SELECT')]
+    assert len(reads) == 1 and 'FROM balance_latest' in reads[0]
+    assert await latest_cash(session) == 10000 - 1000 + 550
+    trades = (await session.execute(select(Trade).filter_by(broker='dummy_broker'))).scalars().all()
+    assert len(trades) == 2
+
+
+@pytest.mark.asyncio
+async def test_cash_ledger_picks_up_newer_external_balance(session, ordering_broker):
+    await seed_cash(session, 10000)
+    await ordering_broker.place_order('AAPL', 10, 'buy', 'RSI', price=100)
+    # e.g. an adjust_balance from the UI, right after the order
+    await seed_cash(session, 5000, timestamp=datetime.now())
+
+    await ordering_broker.place_order('AAPL', 1, 'buy', 'RSI', price=100)
+
+    assert await latest_cash(session) == 4900
+    assert ordering_broker.cash_ledger.entries['RSI']['balance'] == 4900
+
+
+@pytest.mark.asyncio
+async def test_place_order_records_latency_by_order_type(session, ordering_broker):
+    await seed_cash(session, 10000)
+    with patch('brokers.base_broker.latency_tracker', LatencyTracker()) as tracker:
+        await ordering_broker.place_order('AAPL', 1, 'buy', 'RSI', price=100)
+        await ordering_broker.place_order('AAPL', 1, 'buy', 'RSI', order_type='market')
+
+    assert {(row['asset_class'], row['order_type'], row['stage']) for row in tracker.summary()} == {
+        ('equity', 'limit', 'submit_to_ack'), ('equity', 'market', 'submit_to_ack')}
+
+
+@pytest.mark.asyncio
+async def test_place_order_write_behind(session, ordering_broker, engine):
+    await seed_cash(session, 10000)
+    ordering_broker.write_queue = WriteBehindQueue(engine, flush_interval_seconds=60)
+
+    await ordering_broker.place_order('AAPL', 10, 'buy', 'RSI', price=100)
+    await ordering_broker.place_order('MSFT', 10, 'buy', 'RSI', price=50)
+    assert await latest_cash(session) == 10000
+
+    await ordering_broker.write_queue.close()
+    assert await latest_cash(session) == 8500
+    trades = (await session.execute(select(Trade).filter_by(broker='dummy_broker'))).scalars().all()
+    assert sorted(trade.symbol for trade in trades) == ['AAPL', 'MSFT']
+
+
+@pytest.mark.asyncio
+async def test_write_behind_drops_a_failing_write_and_restores_the_ledger(session, ordering_broker, engine):
+    await seed_cash(session, 10000)
+    ordering_broker.write_queue = WriteBehindQueue(engine, flush_interval_seconds=0, max_attempts=2)
+
+    await ordering_broker.place_order('AAPL', 10, 'buy', 'RSI', price=100)
+    await ordering_broker.place_order('MSFT', 10, 'buy', 'RSI', price=50)
+    # Make the MSFT trade violate the schema
+    ordering_broker.write_queue.pending[-1]['objects'][0].symbol = None
+    assert ordering_broker.cash_ledger.entries['RSI']['balance'] == 8500
+
+    await ordering_broker.write_queue.close()
+
+    assert ordering_broker.write_queue.pending == []
+    trades = (await session.execute(select(Trade).filter_by(broker='dummy_broker'))).scalars().all()
+    assert [trade.symbol for trade in trades] == ['AAPL']
+    assert await latest_cash(session) == 9000
+    assert ordering_broker.cash_ledger.entries['RSI']['balance'] == 9000
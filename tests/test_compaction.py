@@ -0,0 +1,100 @@
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.models import Balance, OrderLatency, Position, init_db
+from data.compaction import compact_balances, prune_order_latencies
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    rows = []
+    # Every 30 minutes for 120 days, for two strategies
+    for step in range(120 * 48):
+        timestamp = NOW - timedelta(minutes=30 * step)
+        for strategy in ('RSI', 'MACD'):
+            rows.append({'broker': 'tradier', 'strategy': strategy, 'type': 'cash', 'balance': float(step), 'timestamp': timestamp})
+    async with engine.begin() as conn:
+        await conn.execute(insert(Balance), rows)
+    yield engine
+    await engine.dispose()
+
+
+async def count_rows(engine, start, end):
+    async with engine.connect() as conn:
+        return (await conn.execute(
+            select(func.count(Balance.id)).where(Balance.strategy == 'RSI', Balance.timestamp >= start, Balance.timestamp < end)
+        )).scalar()
+
+
+@pytest.mark.asyncio
+async def test_compact_balances_downsamples_by_age(engine):
+    deleted = await compact_balances(engine, full_resolution_days=7, hourly_resolution_days=90, batch_size=500, now=NOW)
+    assert deleted > 0
+
+    # Full resolution for the last week
+    full_start = datetime(2024, 5, 25)
+    assert await count_rows(engine, full_start, NOW + timedelta(minutes=1)) == (NOW - full_start) // timedelta(minutes=30) + 1
+    # Hourly for a day inside the hourly window
+    assert await count_rows(engine, datetime(2024, 4, 1), datetime(2024, 4, 2)) == 24
+    # Daily for a day older than the hourly window
+    assert await count_rows(engine, datetime(2024, 2, 10), datetime(2024, 2, 11)) == 1
+
+
+@pytest.mark.asyncio
+async def test_compact_balances_keeps_last_value_rows(engine):
+    async with engine.connect() as conn:
+        last_of_day = (await conn.execute(
+            select(Balance.balance).where(Balance.strategy == 'RSI', Balance.timestamp < datetime(2024, 2, 11))
+            .order_by(Balance.timestamp.desc()).limit(1)
+        )).scalar()
+
+    await compact_balances(engine, now=NOW)
+
+    async with engine.connect() as conn:
+        kept = (await conn.execute(
+            select(Balance.balance).where(Balance.strategy == 'RSI', Balance.timestamp >= datetime(2024, 2, 10), Balance.timestamp < datetime(2024, 2, 11))
+        )).scalars().all()
+        latest = (await conn.execute(
+            select(Balance.balance).filter_by(strategy='RSI', type='cash').order_by(Balance.timestamp.desc()).limit(1)
+        )).scalar()
+    assert kept == [last_of_day]
+    assert latest == 0.0
+
+
+@pytest.mark.asyncio
+async def test_compact_balances_keeps_rows_referenced_by_positions(engine):
+    async with engine.connect() as conn:
+        referenced_id = (await conn.execute(
+            select(Balance.id).where(Balance.strategy == 'RSI', Balance.timestamp == datetime(2024, 2, 10, 3, 0))
+        )).scalar()
+    async with engine.begin() as conn:
+        await conn.execute(insert(Position), [{
+            'broker': 'tradier', 'strategy': 'RSI', 'symbol': 'AAPL', 'quantity': 1, 'latest_price': 1, 'balance_id': referenced_id}])
+
+    await compact_balances(engine, now=NOW)
+
+    async with engine.connect() as conn:
+        assert (await conn.execute(select(Balance.id).filter_by(id=referenced_id))).scalar() == referenced_id
+
+
+@pytest.mark.asyncio
+async def test_prune_order_latencies_keeps_the_retention_window(engine):
+    async with engine.begin() as conn:
+        await conn.execute(insert(OrderLatency), [
+            {'broker': 'tradier', 'asset_class': 'equity', 'order_type': 'limit', 'stage': 'submit_to_ack', 'latency_ms': 10.0,
+             'timestamp': NOW - timedelta(days=days)}
+            for days in range(60)
+        ])
+
+    assert await prune_order_latencies(engine, retention_days=30, batch_size=7, now=NOW) == 29
+
+    async with engine.connect() as conn:
+        oldest = (await conn.execute(select(func.min(OrderLatency.timestamp)))).scalar()
+        assert (await conn.execute(select(func.count(OrderLatency.id)))).scalar() == 31
+    assert oldest == NOW - timedelta(days=30)
@@ -0,0 +1,198 @@
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from freezegun import freeze_time
+from sqlalchemy import select, insert, text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from database.models import Balance, BalanceLatest, Position, Trade, init_db
+from database.db_manager import DBManager
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    yield engine
+    await engine.dispose()
+
+
+async def latest(session, broker, strategy, balance_type='cash'):
+    result = await session.execute(select(BalanceLatest).filter_by(broker=broker, strategy=strategy, type=balance_type))
+    return result.scalar()
+
+
+@pytest.mark.asyncio
+async def test_balance_latest_tracks_newest_insert(engine):
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as session:
+        session.add(Balance(broker='tradier', strategy='RSI', type='cash', balance=100, timestamp=NOW))
+        await session.commit()
+        newest = Balance(broker='tradier', strategy='RSI', type='cash', balance=200, timestamp=NOW + timedelta(minutes=1))
+        session.add(newest)
+        await session.commit()
+        # A late write with an older timestamp must not win
+        session.add(Balance(broker='tradier', strategy='RSI', type='cash', balance=50, timestamp=NOW - timedelta(minutes=1)))
+        session.add(Balance(broker='tradier', strategy='RSI', type='positions', balance=10, timestamp=NOW))
+        await session.commit()
+
+        cash = await latest(session, 'tradier', 'RSI')
+        assert cash.balance == 200
+        assert cash.balance_id == newest.id
+        assert (await latest(session, 'tradier', 'RSI', 'positions')).balance == 10
+
+
+@pytest.mark.asyncio
+async def test_default_timestamps_follow_a_frozen_clock(engine):
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    with freeze_time(NOW, real_asyncio=True):
+        async with Session() as session:
+            starting = Balance(broker='tradier', strategy='RSI', type='cash', balance=100)
+            session.add(starting)
+            await session.commit()
+            # Orders write balances stamped with datetime.now(); those must replace the starting balance
+            session.add(Balance(broker='tradier', strategy='RSI', type='cash', balance=90, timestamp=datetime.now()))
+            await session.commit()
+
+            assert starting.timestamp == NOW
+            assert (await latest(session, 'tradier', 'RSI')).balance == 90
+
+
+@pytest.mark.asyncio
+async def test_balance_latest_follows_in_place_updates(engine):
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as session:
+        balance = Balance(broker='tradier', strategy='uncategorized', type='cash', balance=100, timestamp=NOW)
+        session.add(balance)
+        await session.commit()
+        balance.balance -= 30
+        await session.commit()
+
+        assert (await latest(session, 'tradier', 'uncategorized')).balance == 70
+
+
+@pytest.mark.asyncio
+async def test_init_db_backfills_balance_latest(engine):
+    # Core inserts bypass the ORM events, like rows written before the table existed
+    async with engine.begin() as conn:
+        await conn.execute(insert(Balance), [
+            {'broker': 'tradier', 'strategy': 'RSI', 'type': 'cash', 'balance': 1, 'timestamp': NOW},
+            {'broker': 'tradier', 'strategy': 'RSI', 'type': 'cash', 'balance': 2, 'timestamp': NOW + timedelta(hours=1)},
+            {'broker': 'tastytrade', 'strategy': 'MACD', 'type': 'cash', 'balance': 3, 'timestamp': NOW},
+        ])
+
+    await init_db(engine)
+    await init_db(engine)
+
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            select(BalanceLatest.broker, BalanceLatest.strategy, BalanceLatest.balance).order_by(BalanceLatest.broker)
+        )).all()
+    assert rows == [('tastytrade', 'MACD', 3), ('tradier', 'RSI', 2)]
+
+
+@pytest.mark.asyncio
+async def test_rename_strategy_moves_balance_latest(engine):
+    Session = sessionmaker(bind=engine, class_=AsyncSession)
+    async with Session() as session:
+        session.add(Balance(broker='tradier', strategy='RSI', type='cash', balance=100, timestamp=NOW))
+        await session.commit()
+
+    await DBManager(engine).rename_strategy('tradier', 'RSI', 'RSI_v2')
+
+    async with Session() as session:
+        assert await latest(session, 'tradier', 'RSI') is None
+        assert (await latest(session, 'tradier', 'RSI_v2')).balance == 100
+
+
+@pytest.mark.asyncio
+async def test_init_db_merges_duplicate_positions_and_adds_indexes():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    # Simulate a database created before the index set existed
+    async with engine.begin() as conn:
+        await conn.execute(text('DROP INDEX ux_positions_broker_strategy_symbol'))
+        await conn.execute(text('DROP INDEX ix_trades_open_status'))
+        await conn.execute(insert(Position), [
+            {'broker': 'tradier', 'strategy': 'RSI', 'symbol': 'AAPL', 'quantity': 2, 'latest_price': 100, 'cost_basis': 200, 'last_updated': NOW},
+            {'broker': 'tradier', 'strategy': 'RSI', 'symbol': 'AAPL', 'quantity': 3, 'latest_price': 110, 'cost_basis': 330, 'last_updated': NOW + timedelta(minutes=1)},
+            {'broker': 'tradier', 'strategy': 'MACD', 'symbol': 'AAPL', 'quantity': 1, 'latest_price': 100, 'cost_basis': 100, 'last_updated': NOW},
+        ])
+
+    await init_db(engine)
+
+    async with engine.connect() as conn:
+        positions = (await conn.execute(
+            select(Position.strategy, Position.quantity, Position.cost_basis, Position.latest_price).order_by(Position.strategy)
+        )).all()
+        indexes = (await conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))).scalars().all()
+    assert positions == [('MACD', 1, 100, 100), ('RSI', 5, 530, 110)]
+    assert 'ux_positions_broker_strategy_symbol' in indexes
+    assert 'ix_trades_open_status' in indexes
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_rename_strategy_into_existing_strategy_keeps_newest_balance(engine):
+    Session = sessionmaker(bind=engine, class_=AsyncSession)
+    async with Session() as session:
+        session.add_all([
+            Balance(broker='tradier', strategy='RSI', type='cash', balance=100, timestamp=NOW + timedelta(hours=1)),
+            Balance(broker='tradier', strategy='RSI_v2', type='cash', balance=50, timestamp=NOW),
+            Trade(broker='tradier', strategy='RSI', symbol='AAPL', quantity=1, price=1, side='buy', status='filled'),
+        ])
+        await session.commit()
+
+    await DBManager(engine).rename_strategy('tradier', 'RSI', 'RSI_v2')
+
+    async with Session() as session:
+        assert await latest(session, 'tradier', 'RSI') is None
+        assert (await latest(session, 'tradier', 'RSI_v2')).balance == 100
+        assert (await session.execute(select(Trade.strategy))).scalar() == 'RSI_v2'
+
+
+@pytest.mark.asyncio
+async def test_rename_strategy_merges_positions_in_the_same_symbol(engine):
+    Session = sessionmaker(bind=engine, class_=AsyncSession)
+    async with Session() as session:
+        session.add_all([
+            Position(broker='tradier', strategy='RSI', symbol='AAPL', quantity=2, latest_price=100, cost_basis=200),
+            Position(broker='tradier', strategy='RSI', symbol='MSFT', quantity=1, latest_price=300, cost_basis=None),
+            Position(broker='tradier', strategy='RSI_v2', symbol='AAPL', quantity=3, latest_price=100, cost_basis=None),
+            Position(broker='tastytrade', strategy='RSI_v2', symbol='MSFT', quantity=4, latest_price=300, cost_basis=1200),
+        ])
+        await session.commit()
+
+    await DBManager(engine).rename_strategy('tradier', 'RSI', 'RSI_v2')
+
+    async with Session() as session:
+        positions = (await session.execute(
+            select(Position.broker, Position.strategy, Position.symbol, Position.quantity, Position.cost_basis)
+            .order_by(Position.broker, Position.symbol)
+        )).all()
+    assert positions == [
+        ('tastytrade', 'RSI_v2', 'MSFT', 4, 1200),
+        ('tradier', 'RSI_v2', 'AAPL', 5, 200),
+        ('tradier', 'RSI_v2', 'MSFT', 1, None),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_update_trade_statuses(engine):
+    Session = sessionmaker(bind=engine, class_=AsyncSession)
+    async with Session() as session:
+        session.add_all([
+            Trade(id=trade_id, broker='tradier', symbol='AAPL', quantity=1, price=1, side='buy', status='open')
+            for trade_id in (1, 2, 3)
+        ])
+        await session.commit()
+
+    db_manager = DBManager(engine)
+    assert await db_manager.update_trade_statuses([1, 2], 'stale') == 2
+    await db_manager.set_trade_filled(3)
+
+    async with Session() as session:
+        statuses = (await session.execute(select(Trade.id, Trade.status).order_by(Trade.id))).all()
+    assert statuses == [(1, 'stale'), (2, 'stale'), (3, 'filled')]
@@ -0,0 +1,104 @@
+import pytest
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.models import OrderLatency, init_db
+from utils.latency import LatencyHistogram, LatencyTracker, asset_class, order_decision, decision_started, latency_bucket
+
+
+def test_asset_class():
+    assert asset_class('AAPL') == 'equity'
+    assert asset_class('AAPL230721C00250000') == 'option'
+    assert asset_class('./ESU4') == 'future'
+    assert asset_class('./CLU4 240725P19300') == 'future_option'
+    assert asset_class(None) == 'unknown'
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for latency_ms in [3] * 90 + [40] * 9 + [7000]:
+        histogram.add(latency_ms)
+
+    assert histogram.count == 100
+    assert histogram.percentile(50) == 5
+    assert histogram.percentile(95) == 50
+    assert histogram.percentile(99) == 50
+    assert histogram.percentile(100) == 7000
+    assert histogram.max_ms == 7000
+
+
+def test_histogram_overflow_bucket_uses_max():
+    histogram = LatencyHistogram(bounds=(1, 10))
+    histogram.add(500)
+    assert histogram.percentile(50) == 500
+
+
+def test_histogram_empty():
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_tracker_summary_is_keyed_by_broker_asset_class_order_type_and_stage():
+    tracker = LatencyTracker()
+    tracker.record('tradier', 'equity', 'limit', 'submit_to_ack', 0.2)
+    tracker.record('tradier', 'equity', 'limit', 'submit_to_ack', 0.4)
+    tracker.record('tradier', 'equity', 'market', 'submit_to_ack', 0.1)
+    tracker.record('tastytrade', 'option', None, 'ack_to_fill', 9)
+
+    summary = {(row['broker'], row['asset_class'], row['order_type'], row['stage']): row for row in tracker.summary()}
+    assert summary[('tradier', 'equity', 'limit', 'submit_to_ack')]['count'] == 2
+    assert summary[('tradier', 'equity', 'limit', 'submit_to_ack')]['p99_ms'] == 400
+    assert summary[('tradier', 'equity', 'market', 'submit_to_ack')]['count'] == 1
+    assert summary[('tastytrade', 'option', 'unknown', 'ack_to_fill')]['p50_ms'] == 9000
+
+
+def test_order_decision_context():
+    assert decision_started() is None
+    with order_decision():
+        assert decision_started() is not None
+    assert decision_started() is None
+
+
+def test_nested_order_decision_keeps_the_outer_start():
+    with order_decision():
+        started = decision_started()
+        with order_decision():
+            assert decision_started() == started
+        assert decision_started() == started
+    assert decision_started() is None
+
+
+@pytest.mark.asyncio
+async def test_latency_bucket_matches_the_histogram():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    latencies = [0.5, 1, 3, 40, 250, 7000, 4000000]
+    async with engine.begin() as conn:
+        await conn.execute(insert(OrderLatency), [
+            {'broker': 'tradier', 'asset_class': 'equity', 'order_type': 'limit', 'stage': 'submit_to_ack', 'latency_ms': latency_ms}
+            for latency_ms in latencies
+        ])
+        rows = (await conn.execute(
+            select(OrderLatency.latency_ms, latency_bucket(OrderLatency.latency_ms)).order_by(OrderLatency.id)
+        )).all()
+
+    for latency_ms, index in rows:
+        histogram = LatencyHistogram()
+        histogram.add(latency_ms)
+        assert histogram.counts[index] == 1
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_report_if_due_persists_samples():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    tracker = LatencyTracker(report_interval_seconds=0)
+    tracker.record('tradier', 'equity', 'limit', 'pre_checks', 0.01)
+    tracker.record('tradier', 'equity', 'market', 'submit_to_ack', 0.3)
+
+    await tracker.report_if_due(engine)
+
+    async with engine.connect() as conn:
+        rows = (await conn.execute(select(OrderLatency.order_type, OrderLatency.stage, OrderLatency.latency_ms))).all()
+    assert sorted(rows) == [('limit', 'pre_checks', 10.0), ('market', 'submit_to_ack', 300.0)]
+    assert tracker.pending == []
+    await engine.dispose()
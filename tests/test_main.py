@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
 import main  # Replace with the correct import if `main.py` is in a different module
@@ -14,3 +15,67 @@ async def test_start_api_server(mock_create_app, mock_create_engine, mock_parse_
     mock_parse_config.assert_called_once_with(config_path)
     mock_create_engine.assert_called_once()
     mock_create_app.assert_called_once()
+
+
+def never_ending_heartbeat(cancelled):
+    async def run_heartbeat():
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+    return run_heartbeat
+
+
+async def shut_down(*args):
+    # Let the heartbeat start before the process is cancelled
+    await asyncio.sleep(0)
+    raise asyncio.CancelledError
+
+
+@pytest.mark.asyncio
+@patch("main.parse_config", return_value={'order_manager': {'sharding': {'enabled': True}}})
+@patch("main.monitor_event_loop")
+@patch("main.create_database_engine")
+@patch("main.initialize_database", new_callable=AsyncMock)
+@patch("main.initialize_brokers")
+@patch("main.run_order_manager", side_effect=shut_down)
+@patch("main.ShardAssigner")
+async def test_order_manager_drains_writes_and_releases_its_lease_on_shutdown(mock_shard_assigner, mock_run_order_manager, mock_initialize_brokers, *mocks):
+    cancelled = []
+    write_queue = MagicMock(close=AsyncMock())
+    mock_initialize_brokers.return_value = {'tradier': MagicMock(write_queue=write_queue), 'tastytrade': MagicMock(write_queue=write_queue)}
+    assigner = mock_shard_assigner.return_value
+    assigner.lease_manager.purge_expired = AsyncMock()
+    assigner.run_heartbeat = never_ending_heartbeat(cancelled)
+    assigner.release = AsyncMock()
+
+    with pytest.raises(asyncio.CancelledError):
+        await main.start_order_manager("dummy_config.yaml")
+
+    assert cancelled == [True]
+    assigner.release.assert_awaited_once()
+    # Queued order writes are drained once for the shared queue
+    write_queue.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("main.parse_config", return_value={'sync_worker': {'coordination': {'enabled': True}}})
+@patch("main.monitor_event_loop")
+@patch("main.create_database_engine")
+@patch("main.initialize_database", new_callable=AsyncMock)
+@patch("main.maintain_database_partitions", new_callable=AsyncMock)
+@patch("main.initialize_brokers", return_value={'tradier': MagicMock()})
+@patch("main.SyncCoordinator")
+async def test_sync_worker_releases_its_locks_on_shutdown(mock_coordinator, *mocks):
+    cancelled = []
+    coordinator = mock_coordinator.return_value
+    coordinator.run_heartbeat = never_ending_heartbeat(cancelled)
+    coordinator.assign = shut_down
+    coordinator.release = AsyncMock()
+
+    with pytest.raises(asyncio.CancelledError):
+        await main.start_sync_worker("dummy_config.yaml")
+
+    assert cancelled == [True]
+    coordinator.release.assert_awaited_once()
@@ -0,0 +1,166 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, AsyncMock
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.models import Trade, init_db
+from data.market_data import MarketDataBus, handled_hooks
+from strategies.base_strategy import BaseStrategy
+from strategies.executor import StrategyExecutor
+
+
+def make_broker(name='tradier'):
+    broker = MagicMock(broker_name=name, spec=['broker_name', 'get_current_price'])
+    broker.get_current_price = AsyncMock(side_effect=lambda symbol: {'AAPL': 190.0, 'MSFT': 420.0}[symbol])
+    return broker
+
+
+class EventStrategy(BaseStrategy):
+    def __init__(self, broker, strategy_name, symbols):
+        super().__init__(broker, strategy_name, starting_capital=1000)
+        self.symbols = symbols
+        self.events = []
+
+    def subscriptions(self):
+        return self.symbols
+
+    async def rebalance(self):
+        pass
+
+    async def on_quote(self, quote):
+        self.events.append(('quote', quote['symbol'], quote['price']))
+
+    async def on_bar(self, bar):
+        self.events.append(('bar', bar['symbol'], bar['open'], bar['high'], bar['low'], bar['close'], bar['count']))
+
+    async def on_fill(self, fill):
+        self.events.append(('fill', fill['trade_id'], fill['price']))
+
+
+class QuietStrategy(BaseStrategy):
+    async def rebalance(self):
+        pass
+
+
+def test_only_overridden_hooks_are_handled():
+    broker = make_broker()
+    assert handled_hooks(EventStrategy(broker, 'events', [])) == {'on_quote', 'on_bar', 'on_fill'}
+    assert handled_hooks(QuietStrategy(broker, 'quiet', 1000)) == set()
+    assert MarketDataBus().subscribe(QuietStrategy(broker, 'quiet', 1000)) is False
+
+
+@pytest.mark.asyncio
+async def test_polled_quotes_are_fetched_once_per_symbol():
+    broker = make_broker()
+    first = EventStrategy(broker, 'first', ['AAPL'])
+    second = EventStrategy(broker, 'second', ['AAPL', 'MSFT'])
+    bus = MarketDataBus(poll_interval_seconds=60)
+    bus.subscribe(first)
+    bus.subscribe(second)
+    bus.start()
+    await asyncio.sleep(0.05)
+    await bus.stop()
+
+    assert sorted(call.args[0] for call in broker.get_current_price.await_args_list) == ['AAPL', 'MSFT']
+    assert first.events == [('quote', 'AAPL', 190.0)]
+    assert sorted(second.events) == [('quote', 'AAPL', 190.0), ('quote', 'MSFT', 420.0)]
+
+
+@pytest.mark.asyncio
+async def test_quotes_are_aggregated_into_bars():
+    broker = make_broker()
+
+    async def stream_quotes(symbols):
+        # Quotes come from the test only
+        return
+        yield
+    broker.stream_quotes = stream_quotes
+    strategy = EventStrategy(broker, 'bars', ['AAPL'])
+    bus = MarketDataBus(bar_seconds=60)
+    bus.subscribe(strategy)
+    bus.start()
+    start = datetime(2024, 6, 3, 14, 0, tzinfo=timezone.utc)
+    for second, price in ((0, 10.0), (20, 12.0), (40, 9.0), (59, 11.0), (60, 11.5)):
+        bus.publish_quote('tradier', {'symbol': 'AAPL', 'price': price, 'timestamp': start + timedelta(seconds=second)})
+    await asyncio.sleep(0.01)
+    await bus.stop()
+    assert [event for event in strategy.events if event[0] == 'bar'] == [('bar', 'AAPL', 10.0, 12.0, 9.0, 11.0, 4)]
+    assert len([event for event in strategy.events if event[0] == 'quote']) == 5
+
+
+@pytest.mark.asyncio
+async def test_hooks_take_turns_with_rebalances_on_the_broker_account():
+    strategy = EventStrategy(make_broker(), 'quotes', ['AAPL'])
+    executor = StrategyExecutor({'quotes': strategy})
+    bus = MarketDataBus(executor=executor, poll_interval_seconds=60)
+    bus.subscribe(strategy)
+
+    # As if a rebalance on the same account were running
+    async with executor._lock(strategy):
+        bus.start()
+        await asyncio.sleep(0.02)
+        assert strategy.events == []
+    await asyncio.sleep(0.02)
+    await bus.stop()
+    assert strategy.events == [('quote', 'AAPL', 190.0)]
+
+
+@pytest_asyncio.fixture
+async def engine(tmp_path):
+    # A file, since every connection to an in-memory database shares one transaction
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'trades.db'}")
+    await init_db(engine)
+    yield engine
+    await engine.dispose()
+
+
+def trade_row(strategy, status='open'):
+    return {'symbol': 'AAPL', 'quantity': 1, 'price': 100.0, 'side': 'buy', 'status': status, 'broker': 'tradier',
+            'strategy': strategy, 'timestamp': datetime(2024, 6, 3, 14, 0)}
+
+
+@pytest.mark.asyncio
+async def test_fills_are_delivered_to_their_strategy(engine):
+    async with engine.begin() as conn:
+        await conn.execute(insert(Trade), [trade_row('fills')])
+    strategy = EventStrategy(make_broker(), 'fills', [])
+    other = EventStrategy(make_broker(), 'other', [])
+    bus = MarketDataBus(engine, fill_poll_interval_seconds=0.01)
+    bus.subscribe(strategy)
+    bus.subscribe(other)
+    bus.start()
+    await asyncio.sleep(0.05)
+    async with engine.begin() as conn:
+        # The open trade fills and a new one is placed already filled
+        await conn.execute(update(Trade).where(Trade.id == 1).values(status='filled', executed_price=101.0))
+        await conn.execute(insert(Trade), [trade_row('fills', status='filled'), trade_row('other', status='open')])
+    await asyncio.sleep(0.1)
+    await bus.stop()
+    assert strategy.events == [('fill', 1, 101.0), ('fill', 2, 100.0)]
+    assert other.events == []
+
+
+@pytest.mark.asyncio
+async def test_fill_polling_survives_a_failing_first_query(engine):
+    strategy = EventStrategy(make_broker(), 'fills', [])
+    bus = MarketDataBus(engine, fill_poll_interval_seconds=0.01)
+    open_trades, calls = bus._open_trades, []
+
+    async def flaky_open_trades():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('database is locked')
+        return await open_trades()
+
+    bus._open_trades = flaky_open_trades
+    bus.subscribe(strategy)
+    bus.start()
+    await asyncio.sleep(0.05)
+    async with engine.begin() as conn:
+        await conn.execute(insert(Trade), [trade_row('fills', status='filled')])
+    await asyncio.sleep(0.1)
+    await bus.stop()
+    assert len(calls) == 2
+    assert strategy.events == [('fill', 1, 100.0)]
@@ -38,17 +38,54 @@ async def test_reconcile_orders(order_manager, mock_db_manager):
     """Test the reconcile_orders method."""
     # Mock trades
     trades = [
-        Trade(id=1, broker="dummy_broker", broker_id="123", status="open"),
-        Trade(id=2, broker="dummy_broker", broker_id="456", status="open"),
+        Trade(id=1, broker="dummy_broker", broker_id="123", status="open", timestamp=datetime.utcnow()),
+        Trade(id=2, broker="dummy_broker", broker_id="456", status="open", timestamp=datetime.utcnow()),
     ]
     order_manager.reconcile_order = AsyncMock()
 
     await order_manager.reconcile_orders(trades)
 
     # Verify that reconcile_order is called for each trade
-    order_manager.reconcile_order.assert_any_call(trades[0])
-    order_manager.reconcile_order.assert_any_call(trades[1])
+    order_manager.reconcile_order.assert_any_call(trades[0], [])
+    order_manager.reconcile_order.assert_any_call(trades[1], [])
     assert order_manager.reconcile_order.call_count == len(trades)
+    mock_db_manager.update_trade_statuses.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_reconcile_orders_marks_stale_orders_together(order_manager, mock_db_manager, mock_broker):
+    trades = [
+        Trade(id=1, broker="dummy_broker", broker_id="123", status="open", timestamp=datetime.utcnow() - timedelta(days=3)),
+        Trade(id=2, broker="dummy_broker", broker_id=None, status="open", timestamp=datetime.utcnow()),
+        Trade(id=3, broker="dummy_broker", broker_id="789", status="open", timestamp=datetime.utcnow()),
+    ]
+
+    await order_manager.reconcile_orders(trades)
+
+    mock_db_manager.update_trade_statuses.assert_called_once_with({1, 2}, "stale")
+    mock_db_manager.update_trade_status.assert_not_called()
+    # Only the live order is looked up at the broker
+    mock_broker.is_order_filled.assert_called_once_with("789")
+
+
+@pytest.mark.asyncio
+async def test_reconcile_orders_marks_cancelled_pegged_orders_before_replacing_them(order_manager, mock_db_manager, mock_broker):
+    old_timestamp = datetime.utcnow() - timedelta(seconds=PEGGED_ORDER_CANCEL_AFTER + 1)
+    trades = [
+        Trade(id=order_id, broker="dummy_broker", broker_id=str(order_id), symbol="AAPL", quantity=10, side="buy",
+              strategy="test_strategy", timestamp=old_timestamp, status="open", execution_style="pegged")
+        for order_id in (1, 2)
+    ]
+    mock_broker.get_mid_price.return_value = 100.004
+    calls = []
+    mock_db_manager.update_trade_statuses.side_effect = lambda ids, status: calls.append(('mark', list(ids), status))
+    mock_broker.place_order.side_effect = lambda **kwargs: calls.append(('place', kwargs['price']))
+
+    await order_manager.reconcile_orders(trades)
+
+    assert calls == [('mark', [1, 2], 'cancelled'), ('place', 100.0), ('place', 100.0)]
+    assert mock_broker.cancel_order.call_count == 2
+    mock_db_manager.update_trade_status.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -227,3 +264,23 @@ async def test_reconcile_order_with_execution_style(order_manager, mock_db_manag
     mock_db_manager.set_trade_filled.assert_not_called()
     mock_broker.update_positions.assert_not_called()
     mock_broker.cancel_order.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_only_reconciles_owned_trades(mock_db_manager, mock_broker):
+    trades = [
+        Trade(id=1, broker="dummy_broker", broker_id="123", status="open"),
+        Trade(id=2, broker="dummy_broker", broker_id="456", status="open"),
+    ]
+    mock_db_manager.get_open_trades.return_value = trades
+    shard_assigner = MagicMock()
+    shard_assigner.refresh = AsyncMock()
+    shard_assigner.owned.return_value = trades[1:]
+    order_manager = OrderManager(MagicMock(), {"dummy_broker": mock_broker}, shard_assigner)
+    order_manager.db_manager = mock_db_manager
+    order_manager.reconcile_orders = AsyncMock()
+
+    await order_manager.run()
+
+    shard_assigner.refresh.assert_awaited_once()
+    order_manager.reconcile_orders.assert_called_once_with(trades[1:])
@@ -0,0 +1,98 @@
+import os
+import pytest
+import pytest_asyncio
+from datetime import datetime
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from database.models import Base, Balance, Trade, Position, init_db
+from database.partitioning import maintain_partitions, partitions, is_partitioned, _add_months, _upper_bound
+
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+NOW = datetime(2024, 6, 15, 12, 0)
+
+requires_postgres = pytest.mark.skipif(not POSTGRES_URL, reason='TEST_POSTGRES_URL is not set')
+
+
+def test_add_months_wraps_years():
+    assert _add_months(datetime(2024, 11, 1), 3) == datetime(2025, 2, 1)
+    assert _add_months(datetime(2024, 1, 1), -1) == datetime(2023, 12, 1)
+
+
+def test_upper_bound_of_partition_clause():
+    assert _upper_bound("FOR VALUES FROM (MINVALUE) TO ('2024-07-01 00:00:00')") == datetime(2024, 7, 1)
+    assert _upper_bound("FOR VALUES FROM ('2024-07-01 00:00:00') TO (MAXVALUE)") is None
+
+
+@pytest.mark.asyncio
+async def test_maintain_partitions_skips_sqlite():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    assert await maintain_partitions(engine, now=NOW) == {}
+    await engine.dispose()
+
+
+async def drop_tables(engine):
+    async with engine.begin() as conn:
+        # Detached partitions are left behind as plain tables
+        names = (await conn.execute(text(
+            "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() "
+            "AND (tablename LIKE 'balances%' OR tablename LIKE 'trades%')"
+        ))).scalars().all()
+        for name in names:
+            await conn.execute(text(f'DROP TABLE IF EXISTS "{name}" CASCADE'))
+        await conn.run_sync(Base.metadata.drop_all)
+
+
+@pytest_asyncio.fixture
+async def pg_engine():
+    engine = create_async_engine(POSTGRES_URL)
+    await drop_tables(engine)
+    await init_db(engine)
+    yield engine
+    await drop_tables(engine)
+    await engine.dispose()
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_existing_tables_are_converted_in_place(pg_engine):
+    Session = sessionmaker(bind=pg_engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as session:
+        old = Balance(broker='tradier', strategy='RSI', type='cash', balance=100.0, timestamp=datetime(2023, 1, 5))
+        session.add(old)
+        session.add(Trade(symbol='AAPL', quantity=1, price=1.0, side='buy', status='filled', broker='tradier', strategy='RSI', timestamp=datetime(2023, 1, 5)))
+        await session.commit()
+
+    changes = await maintain_partitions(pg_engine, months_ahead=2, now=NOW)
+    assert changes['balances']['created'] == ['balances_p2024_07', 'balances_p2024_08']
+
+    async with pg_engine.connect() as conn:
+        assert await is_partitioned(conn, 'balances')
+        assert [name for name, _ in await partitions(conn, 'trades')] == ['trades_before_2024_07', 'trades_p2024_07', 'trades_p2024_08']
+
+    async with Session() as session:
+        # Old rows stay readable, new rows land in the monthly partitions with fresh ids
+        new = Balance(broker='tradier', strategy='RSI', type='cash', balance=200.0, timestamp=datetime(2024, 7, 2))
+        session.add(new)
+        session.add(Position(broker='tradier', strategy='RSI', symbol='AAPL', quantity=1, latest_price=1.0))
+        await session.commit()
+        assert new.id > old.id
+        assert (await session.execute(select(func.count(Balance.id)))).scalar() == 2
+        in_partition = await session.execute(text('SELECT count(*) FROM balances_p2024_07'))
+        assert in_partition.scalar() == 1
+
+    # Running again only creates the months that are missing
+    changes = await maintain_partitions(pg_engine, months_ahead=2, now=datetime(2024, 7, 10))
+    assert changes['balances']['created'] == ['balances_p2024_09']
+
+
+@requires_postgres
+@pytest.mark.asyncio
+async def test_old_partitions_are_detached(pg_engine):
+    await maintain_partitions(pg_engine, months_ahead=1, now=NOW)
+    changes = await maintain_partitions(pg_engine, months_ahead=1, retention_months=0, now=datetime(2024, 8, 3))
+    assert changes['trades']['detached'] == ['trades_before_2024_07', 'trades_p2024_07']
+
+    async with pg_engine.connect() as conn:
+        assert [name for name, _ in await partitions(conn, 'trades')] == ['trades_p2024_08', 'trades_p2024_09']
@@ -0,0 +1,46 @@
+import time
+import numpy as np
+from strategies.rebalancer import rebalance_orders
+
+
+def test_orders_move_positions_to_their_weights():
+    orders = rebalance_orders(['AAPL', 'MSFT', 'TSLA'], [0.5, 0.5, 0.0], [100.0, 200.0, 50.0], [2, 5, 3], investable=1000)
+    # AAPL targets 5 shares, MSFT is on target at 2.5 rounded down to 2, TSLA is closed out
+    assert orders == [('MSFT', 3, 'sell', 200.0), ('TSLA', 3, 'sell', 50.0), ('AAPL', 3, 'buy', 100.0)]
+
+
+def test_positions_inside_the_buffer_band_do_not_trade():
+    orders = rebalance_orders(['AAPL', 'MSFT'], [0.5, 0.5], [100.0, 100.0], [46, 60], investable=10000, buffer=0.1)
+    assert orders == [('MSFT', 10, 'sell', 100.0)]
+
+
+def test_targets_are_whole_lots():
+    orders = rebalance_orders(['AAPL'], [1.0], [10.0], [0], investable=1290, lot_size=50)
+    assert orders == [('AAPL', 100, 'buy', 10.0)]
+
+
+def test_buys_are_scaled_to_the_cash_available():
+    orders = rebalance_orders(['AAPL', 'MSFT', 'TSLA'], [0.5, 0.5, 0.0], [10.0, 10.0, 10.0], [0, 0, 10], investable=1000,
+                              cash=300)
+    # 300 cash plus 100 from selling TSLA pays for 40 of the 100 shares wanted
+    assert orders == [('TSLA', 10, 'sell', 10.0), ('AAPL', 20, 'buy', 10.0), ('MSFT', 20, 'buy', 10.0)]
+
+
+def test_unpriced_symbols_and_small_orders_are_skipped():
+    orders = rebalance_orders(['AAPL', 'MSFT', 'TSLA'], [0.4, 0.3, 0.3], [np.nan, 0.0, 100.0], [1, 2, 2], investable=1000,
+                              min_order_value=150)
+    assert orders == []
+
+
+def test_large_universe_rebalances_quickly():
+    rng = np.random.default_rng(0)
+    symbols = [f'SYM{i}' for i in range(500)]
+    weights = rng.dirichlet(np.ones(500))
+    prices = rng.uniform(5, 500, 500)
+    quantities = rng.integers(0, 100, 500)
+    started = time.perf_counter()
+    orders = rebalance_orders(symbols, weights, prices, quantities, investable=1_000_000, cash=50_000, buffer=0.05)
+    assert time.perf_counter() - started < 0.1
+    assert {symbol for symbol, _, _, _ in orders} <= set(symbols)
+    assert sum(quantity * price for _, quantity, side, price in orders if side == 'buy') <= 50_000 + sum(
+        quantity * price for _, quantity, side, price in orders if side == 'sell')
@@ -0,0 +1,67 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.models import Trade, WorkerLease, init_db
+from order_manager.sharding import ShardAssigner, rendezvous_owner
+
+
+def make_trades(count, broker='tradier'):
+    return [Trade(id=i, broker=broker, symbol='AAPL', status='open') for i in range(count)]
+
+
+def test_rendezvous_owner_only_moves_keys_of_removed_worker():
+    workers = ['a', 'b', 'c']
+    before = {key: rendezvous_owner(key, workers) for key in range(200)}
+    after = {key: rendezvous_owner(key, ['a', 'c']) for key in range(200)}
+    for key, owner in before.items():
+        if owner != 'b':
+            assert after[key] == owner
+    assert rendezvous_owner('key', []) is None
+
+
+def test_unknown_shard_by():
+    with pytest.raises(ValueError):
+        ShardAssigner(engine=None, shard_by='account')
+
+
+@pytest.mark.asyncio
+async def test_replicas_split_trades_and_rebalance_when_one_dies():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    first = ShardAssigner(engine, worker_id='first')
+    second = ShardAssigner(engine, worker_id='second')
+    await first.refresh()
+    await second.refresh()
+    await first.refresh()
+
+    trades = make_trades(100)
+    first_owned = {trade.id for trade in first.owned(trades)}
+    second_owned = {trade.id for trade in second.owned(trades)}
+    assert first_owned and second_owned
+    assert first_owned.isdisjoint(second_owned)
+    assert first_owned | second_owned == set(range(100))
+
+    # The second replica stops heartbeating and its lease runs out
+    async with engine.begin() as conn:
+        await conn.execute(
+            update(WorkerLease).where(WorkerLease.worker_id == 'second').values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+    assert await first.refresh() == ['first']
+    assert len(first.owned(trades)) == 100
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_shard_by_broker_keeps_a_broker_on_one_replica():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    assigners = [ShardAssigner(engine, worker_id=name, shard_by='broker') for name in ('a', 'b', 'c')]
+    for assigner in assigners + assigners:
+        await assigner.refresh()
+
+    trades = make_trades(20, broker='tradier')
+    owners = [assigner.worker_id for assigner in assigners if assigner.owned(trades)]
+    assert len(owners) == 1
+    assert len(next(a for a in assigners if a.worker_id == owners[0]).owned(trades)) == 20
+    await engine.dispose()
@@ -4,7 +4,7 @@ from unittest.mock import MagicMock, patch, AsyncMock
 from datetime import datetime
 from strategies.base_strategy import BaseStrategy
 from sqlalchemy import select
-from database.models import Balance, Position
+from database.models import BalanceLatest, Position
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -59,11 +59,11 @@ async def test_initialize_starting_balance_existing(strategy):
     await strategy.initialize_starting_balance()
 
     # Build the expected query
-    expected_query = select(Balance).filter_by(
+    expected_query = select(BalanceLatest).filter_by(
         strategy=strategy.strategy_name,
         broker=strategy.broker.broker_name,
         type='cash'
-    ).order_by(Balance.timestamp.desc())
+    )
 
     # Verify that execute() was called with the correct query using SQL string comparison
     mock_session.execute.assert_called_once()
@@ -93,11 +93,11 @@ async def test_initialize_starting_balance_new(strategy):
     await strategy.initialize_starting_balance()
 
     # Build the expected query
-    expected_query = select(Balance).filter_by(
+    expected_query = select(BalanceLatest).filter_by(
         strategy=strategy.strategy_name,
         broker=strategy.broker.broker_name,
         type='cash'
-    ).order_by(Balance.timestamp.desc())
+    )
 
     # Verify that execute() was called with the correct query using SQL string comparison
     mock_session.execute.assert_called_once()
@@ -114,13 +114,12 @@ async def test_initialize_starting_balance_new(strategy):
 
 
 @pytest.mark.asyncio
-@patch('strategies.base_strategy.datetime')
 @patch('strategies.base_strategy.asyncio.iscoroutinefunction')
 @patch('strategies.base_strategy.BaseStrategy.should_own')
-async def test_sync_positions_with_broker(mock_should_own, mock_iscoroutinefunction, mock_datetime, strategy):
+async def test_sync_positions_with_broker(mock_should_own, mock_iscoroutinefunction, strategy):
     # Mock method return values
     mock_should_own.return_value = 5
-    mock_datetime.utcnow.return_value = datetime(2023, 1, 1)
+    strategy.broker.now.return_value = datetime(2023, 1, 1)
     strategy.broker.get_positions.return_value = {'AAPL': {'quantity': 10}}
     strategy.broker.get_current_price.return_value = 150
     # Mock strategy.get_db_positions to return an empty list
@@ -0,0 +1,91 @@
+import pytest
+import pytest_asyncio
+from datetime import datetime
+from unittest.mock import MagicMock, AsyncMock, patch
+from sqlalchemy import event, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from database.models import BalanceLatest, Position, init_db
+from strategies.context import StrategyContext
+from strategies.constant_percentage_strategy import ConstantPercentageStrategy
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    async with engine.begin() as conn:
+        await conn.execute(insert(BalanceLatest), [
+            {'broker': 'tradier', 'strategy': 'constant', 'type': 'cash', 'balance': 1000.0, 'timestamp': datetime(2024, 6, 2), 'balance_id': 2},
+            {'broker': 'tradier', 'strategy': 'constant', 'type': 'positions', 'balance': 350.0, 'timestamp': datetime(2024, 6, 2), 'balance_id': 3},
+            {'broker': 'tradier', 'strategy': 'empty', 'type': 'cash', 'balance': 10.0, 'timestamp': datetime(2024, 6, 2), 'balance_id': 4},
+        ])
+        await conn.execute(insert(Position), [
+            {'broker': 'tradier', 'strategy': 'constant', 'symbol': 'AAPL', 'quantity': 2, 'latest_price': 100.0},
+            {'broker': 'tradier', 'strategy': 'constant', 'symbol': 'TSLA', 'quantity': 3, 'latest_price': 50.0},
+            {'broker': 'tradier', 'strategy': 'other', 'symbol': 'MSFT', 'quantity': 1, 'latest_price': 400.0},
+        ])
+    yield engine
+    await engine.dispose()
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(engine.sync_engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    return statements
+
+
+@pytest.mark.asyncio
+async def test_context_loads_cash_and_positions_in_one_query(engine):
+    statements = count_statements(engine)
+    async with AsyncSession(engine) as session:
+        context = await StrategyContext.load(session, 'constant', 'tradier')
+    assert len(statements) == 1
+    assert context.cash == 1000.0
+    assert sorted(context.positions) == ['AAPL', 'TSLA']
+    assert context.quantity('AAPL') == 2
+    assert context.quantity('MSFT') == 0
+    assert context.total_balance == 1000.0 + 200.0 + 150.0
+
+
+@pytest.mark.asyncio
+async def test_context_without_positions_or_balance(engine):
+    async with AsyncSession(engine) as session:
+        context = await StrategyContext.load(session, 'empty', 'tradier')
+        assert (context.cash, context.positions) == (10.0, {})
+        with pytest.raises(ValueError):
+            await StrategyContext.load(session, 'missing', 'tradier')
+
+
+@pytest.mark.asyncio
+@patch('strategies.base_strategy.is_market_open', return_value=True)
+async def test_rebalance_reads_the_database_once(mock_is_market_open, engine):
+    broker = MagicMock(broker_name='tradier')
+    broker.Session = sessionmaker(bind=engine, class_=AsyncSession)
+    broker.get_positions.return_value = {}
+    broker.get_current_price = AsyncMock(return_value=100.0)
+    broker.place_order = AsyncMock()
+    strategy = ConstantPercentageStrategy(broker, 'constant', {'AAPL': 1.0}, cash_percentage=0.5, rebalance_interval_minutes=5,
+                                          starting_capital=1000)
+    statements = count_statements(engine)
+    with patch.object(strategy, 'sync_positions_with_broker', AsyncMock()):
+        await strategy.rebalance()
+
+    assert len(statements) == 1
+    # Half of the 1000 cash in AAPL at 100 is 5 shares, 2 are held; TSLA is not allocated
+    broker.place_order.assert_any_await('AAPL', 3.0, 'buy', 'constant', 100.0, 'limit', execution_style='')
+    # Closed out without a limit price
+    broker.place_order.assert_any_await('TSLA', 3, 'sell', 'constant', None, 'limit', execution_style='')
+
+
+@pytest.mark.asyncio
+async def test_rebalance_to_weights_needs_weights(engine):
+    broker = MagicMock(broker_name='tradier')
+    broker.Session = sessionmaker(bind=engine, class_=AsyncSession)
+    broker.place_order = AsyncMock()
+    strategy = ConstantPercentageStrategy(broker, 'constant', {'AAPL': 1.0}, cash_percentage=0.5, rebalance_interval_minutes=5,
+                                          starting_capital=1000)
+
+    with patch.object(strategy, 'target_weights', return_value=None), pytest.raises(ValueError, match='no target weights'):
+        await strategy.rebalance_to_weights(500.0)
+    broker.place_order.assert_not_awaited()
@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, AsyncMock, patch
+from strategies.executor import StrategyExecutor
+from utils.latency import decision_started
+
+NOW = datetime(2024, 7, 22, 14, 0)
+
+
+class FakeStrategy:
+    def __init__(self, broker_name, duration=0.0, error=None, rebalance_interval_minutes=5):
+        self.broker = MagicMock(broker_name=broker_name)
+        self.duration = duration
+        self.error = error
+        self.rebalance_interval_minutes = rebalance_interval_minutes
+        self.rebalances = 0
+        self.running = 0
+
+    async def rebalance(self):
+        self.running += 1
+        try:
+            await asyncio.sleep(self.duration)
+            if self.error:
+                raise self.error
+            self.rebalances += 1
+        finally:
+            self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_strategies_rebalance_once_per_interval():
+    fast, slow = FakeStrategy('tradier', rebalance_interval_minutes=1), FakeStrategy('kraken', rebalance_interval_minutes=10)
+    executor = StrategyExecutor({'fast': fast, 'slow': slow})
+
+    assert await executor.run_due(NOW) == {'fast': 'ok', 'slow': 'ok'}
+    assert await executor.run_due(NOW + timedelta(seconds=30)) == {}
+    assert await executor.run_due(NOW + timedelta(minutes=1)) == {'fast': 'ok'}
+    assert (fast.rebalances, slow.rebalances) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_brokers_run_concurrently_and_accounts_take_turns():
+    strategies = {
+        'rsi': FakeStrategy('tradier', duration=0.05),
+        'macd': FakeStrategy('tradier', duration=0.05),
+        'hodl': FakeStrategy('kraken', duration=0.05),
+    }
+    overlap = []
+
+    async def watch():
+        for _ in range(10):
+            overlap.append(strategies['rsi'].running + strategies['macd'].running)
+            await asyncio.sleep(0.01)
+
+    started = asyncio.get_running_loop().time()
+    executor = StrategyExecutor(strategies)
+    await asyncio.gather(executor.run_due(NOW), watch())
+    elapsed = asyncio.get_running_loop().time() - started
+
+    # The two tradier strategies ran one after the other, kraken alongside them
+    assert max(overlap) == 1
+    assert 0.1 <= elapsed < 0.15
+
+
+@pytest.mark.asyncio
+@patch('strategies.executor.logger')
+async def test_failures_are_isolated_and_restart_only_that_strategy(mock_logger):
+    broken, hung, healthy = FakeStrategy('tradier', error=ValueError('bad quote')), FakeStrategy('tastytrade', duration=1), FakeStrategy('kraken')
+    replacement = FakeStrategy('tradier')
+    restart = AsyncMock(side_effect=lambda name: replacement if name == 'broken' else hung)
+    executor = StrategyExecutor({'broken': broken, 'hung': hung, 'healthy': healthy}, restart=restart, timeouts={'hung': 0.05})
+
+    assert await executor.run_due(NOW) == {'broken': 'error', 'hung': 'timeout', 'healthy': 'ok'}
+    assert sorted(call.args[0] for call in restart.await_args_list) == ['broken', 'hung']
+    assert executor.strategies['broken'] is replacement
+    assert executor.strategies['healthy'] is healthy
+
+
+@pytest.mark.asyncio
+@patch('strategies.executor.logger')
+async def test_failed_restart_keeps_the_old_strategy(mock_logger):
+    broken = FakeStrategy('tradier', error=ValueError('bad quote'))
+    executor = StrategyExecutor({'broken': broken}, restart=AsyncMock(side_effect=RuntimeError('broker down')), restart_after_failures=2)
+
+    await executor.run_due(NOW)
+    assert executor.restart.await_count == 0
+    await executor.run_due(NOW + timedelta(minutes=5))
+    assert executor.restart.await_count == 1
+    assert executor.strategies['broken'] is broken
+    assert executor.failures['broken'] == 2
+
+
+@pytest.mark.asyncio
+async def test_orders_measure_their_decision_from_the_start_of_the_rebalance():
+    strategy = FakeStrategy('tradier')
+    seen = []
+
+    async def rebalance():
+        seen.append(decision_started())
+        # Reading positions and sizing orders happen after the decision started
+        await asyncio.sleep(0.01)
+        seen.append(decision_started())
+
+    strategy.rebalance = rebalance
+    await StrategyExecutor({'rsi': strategy}).run_due(NOW)
+
+    assert seen[0] is not None and seen[0] == seen[1]
+    assert decision_started() is None
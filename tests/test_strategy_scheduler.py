@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from strategies.scheduler import Schedule, StrategyScheduler, parse_session_offset
+from utils.trading_calendar import CRYPTO
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class FakeExecutor:
+    def __init__(self, duration=0.0):
+        self.duration = duration
+        self.runs = []
+
+    async def run(self, names, now=None):
+        self.runs.extend(names)
+        await asyncio.sleep(self.duration)
+        return {name: 'ok' for name in names}
+
+
+def test_parse_session_offset():
+    assert parse_session_offset('open') == ('open', timedelta())
+    assert parse_session_offset('open+5m') == ('open', timedelta(minutes=5))
+    assert parse_session_offset('close - 90s') == ('close', timedelta(seconds=-90))
+    with pytest.raises(ValueError):
+        parse_session_offset('noon')
+
+
+def test_aligned_schedule_follows_the_session_grid():
+    schedule = Schedule(interval_seconds=300, market_hours='aligned')
+    # 9:37 and 16:05 Eastern on Monday June 3rd 2024
+    assert schedule.upcoming(utc(2024, 6, 3, 13, 37)) == utc(2024, 6, 3, 13, 40)
+    assert schedule.upcoming(utc(2024, 6, 3, 20, 5)) == utc(2024, 6, 4, 13, 30)
+    assert schedule.following(utc(2024, 6, 3, 19, 55)) == utc(2024, 6, 4, 13, 30)
+
+
+def test_session_relative_schedule():
+    schedule = Schedule(at=['close-15m', 'open+5m'])
+    assert schedule.upcoming(utc(2024, 6, 3, 12, 0)) == utc(2024, 6, 3, 13, 35)
+    assert schedule.following(utc(2024, 6, 3, 13, 35)) == utc(2024, 6, 3, 19, 45)
+    # Friday after the close waits for Monday's open
+    assert schedule.following(utc(2024, 6, 7, 19, 45)) == utc(2024, 6, 10, 13, 35)
+
+
+def test_open_schedule_waits_for_the_next_session():
+    schedule = Schedule(interval_seconds=300, market_hours='open')
+    assert schedule.following(utc(2024, 6, 3, 19, 58)) == utc(2024, 6, 4, 13, 30)
+    assert schedule.following(utc(2024, 6, 3, 14, 0)) == utc(2024, 6, 3, 14, 5)
+
+
+def test_skip_ahead_keeps_the_interval_grid():
+    schedule = Schedule(interval_seconds=300, missed='skip')
+    assert schedule.skip_ahead(utc(2024, 6, 3, 12, 0), utc(2024, 6, 3, 12, 12)) == utc(2024, 6, 3, 12, 15)
+
+
+def test_schedule_from_config():
+    schedule = Schedule.from_config({'broker': 'kraken', 'rebalance_interval_minutes': 0.5})
+    assert schedule.interval == timedelta(seconds=30)
+    assert schedule.calendar is CRYPTO
+    schedule = Schedule.from_config({'broker': 'tradier', 'schedule': {'at': ['open+5m'], 'calendar': 'CME_GLOBEX', 'missed': 'skip'}})
+    assert schedule.calendar.name == 'CME_GLOBEX'
+    assert schedule.missed == 'skip'
+    with pytest.raises(ValueError):
+        Schedule.from_config({'schedule': {'interval_seconds': 60, 'market_hours': 'sometimes'}})
+
+
+@pytest.mark.asyncio
+async def test_scheduler_runs_each_strategy_on_its_own_interval():
+    executor = FakeExecutor()
+    scheduler = StrategyScheduler(executor, {
+        'fast': Schedule(interval_seconds=0.1),
+        'slow': Schedule(interval_seconds=0.4),
+    })
+    await scheduler.run(until=datetime.now(timezone.utc) + timedelta(seconds=0.65))
+    assert executor.runs.count('slow') == 2
+    assert 5 <= executor.runs.count('fast') <= 7
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('missed,runs', [('run_once', 3), ('skip', 2)])
+async def test_scheduler_missed_run_policy(missed, runs):
+    # Each run takes longer than the interval, so the slots in between are missed
+    executor = FakeExecutor(duration=0.5)
+    scheduler = StrategyScheduler(executor, {'slow': Schedule(interval_seconds=0.2, missed=missed, grace_seconds=0.01)})
+    await scheduler.run(until=datetime.now(timezone.utc) + timedelta(seconds=1.1))
+    assert executor.runs == ['slow'] * runs
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import create_async_engine
+from database.models import LeaderLease, init_db
+from database.locks import TableLocks, AdvisoryLocks, create_locks
+from data.sync_coordination import SyncCoordinator
+
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+BROKERS = ['tradier', 'tastytrade', 'alpaca', 'kraken']
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    yield engine
+    await engine.dispose()
+
+
+async def expire(engine, holder):
+    async with engine.begin() as conn:
+        await conn.execute(
+            update(LeaderLease).where(LeaderLease.holder == holder).values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+
+
+def test_unknown_mode_and_backend(engine):
+    with pytest.raises(ValueError):
+        SyncCoordinator(engine, mode='active-active')
+    with pytest.raises(ValueError):
+        create_locks(engine, 'a', backend='zookeeper')
+    assert isinstance(create_locks(engine, 'a'), TableLocks)
+
+
+@pytest.mark.asyncio
+async def test_table_locks_have_one_holder(engine):
+    first, second = TableLocks(engine, 'first'), TableLocks(engine, 'second')
+    assert await first.acquire('sync_worker')
+    assert not await second.acquire('sync_worker')
+    assert await first.renew() == []
+
+    # The first holder stops renewing and its lease runs out
+    await expire(engine, 'first')
+    assert await second.acquire('sync_worker')
+    assert await first.renew() == ['sync_worker']
+    assert first.held == set()
+
+    await second.release_all()
+    assert await first.acquire('sync_worker')
+
+
+@pytest.mark.asyncio
+async def test_standby_replica_takes_over(engine):
+    leader = SyncCoordinator(engine, worker_id='leader')
+    standby = SyncCoordinator(engine, worker_id='standby')
+    assert await leader.assign(BROKERS) == BROKERS
+    assert await standby.assign(BROKERS) == []
+
+    await expire(engine, 'leader')
+    assert await standby.assign(BROKERS) == BROKERS
+    assert await leader.assign(BROKERS) == []
+
+
+@pytest.mark.asyncio
+async def test_partitioned_replicas_never_share_a_broker(engine):
+    first = SyncCoordinator(engine, mode='partition', worker_id='first')
+    second = SyncCoordinator(engine, mode='partition', worker_id='second')
+    assert await first.assign(BROKERS) == BROKERS
+
+    # The new replica waits until the first one hands its brokers over
+    assert await second.assign(BROKERS) == []
+    kept = await first.assign(BROKERS)
+    taken = await second.assign(BROKERS)
+    assert kept and taken
+    assert sorted(kept + taken) == sorted(BROKERS)
+
+    # When a replica leaves, the other one picks up its brokers
+    await second.release()
+    assert await first.assign(BROKERS) == BROKERS
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason='TEST_POSTGRES_URL is not set')
+@pytest.mark.asyncio
+async def test_advisory_locks_are_freed_with_their_connection():
+    engine = create_async_engine(POSTGRES_URL)
+    first, second = AdvisoryLocks(engine, 'first'), AdvisoryLocks(engine, 'second')
+    assert isinstance(create_locks(engine, 'first'), AdvisoryLocks)
+    assert await first.acquire('sync_worker')
+    assert await first.acquire('sync_worker')
+    assert not await second.acquire('sync_worker')
+
+    await first.conn.invalidate()
+    first.conn = None
+    assert await second.acquire('sync_worker')
+    await second.release_all()
+    await engine.dispose()
+
+
+class SingleStatementConnection:
+    '''Fails overlapping statements like an asyncpg connection does'''
+    def __init__(self):
+        self.busy = False
+        self.closed = False
+
+    async def _run(self):
+        if self.busy:
+            raise RuntimeError('another operation is in progress')
+        self.busy = True
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.busy = False
+
+    async def execute(self, statement, params):
+        await self._run()
+        return type('Result', (), {'scalar': lambda self: True})()
+
+    async def commit(self):
+        await self._run()
+
+    async def close(self):
+        self.closed = True
+
+
+class SingleStatementEngine:
+    def __init__(self):
+        self.conn = SingleStatementConnection()
+
+    async def connect(self):
+        return self.conn
+
+
+@pytest.mark.asyncio
+async def test_advisory_locks_serialize_statements_on_their_connection():
+    engine = SingleStatementEngine()
+    locks = AdvisoryLocks(engine, 'first')
+    assert await locks.acquire('sync_worker')
+
+    # The heartbeat renewing while assign() takes another lock
+    results = await asyncio.gather(locks.renew(), locks.acquire('sync_worker:tradier'), locks.renew())
+
+    assert results == [[], True, []]
+    assert locks.held == {'sync_worker', 'sync_worker:tradier'}
+    await locks.release_all()
+    assert engine.conn.closed and locks.held == set()
@@ -1,21 +1,25 @@
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 
 import pytest
+import pytest_asyncio
 import asyncio
 from unittest.mock import AsyncMock, patch, MagicMock, ANY
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
 
-from data.sync_worker import PositionService, BalanceService, BrokerService, _get_async_engine, _run_sync_worker_iteration, _fetch_and_update_positions, _reconcile_brokers_and_update_balances
-from database.models import Position, Balance
+from data.sync_worker import PositionService, BalanceService, BrokerService, _get_async_engine, _run_sync_worker_iteration, _fetch_and_update_positions, _reconcile_broker_and_update_balances, _run_sync_worker_iteration_logic, MarketSnapshot
+from database.models import Position, Balance, BalanceLatest, init_db
 
 import data.sync_worker
 
 # Mock data for testing
-MOCK_POSITIONS = [
-    Position(symbol='AAPL', broker='tradier', latest_price=0, last_updated=datetime.now(), underlying_volatility=None),
-    Position(symbol='GOOG', broker='tastytrade', latest_price=0, last_updated=datetime.now(), underlying_volatility=None),
-]
+def make_mock_positions():
+    return [
+        Position(symbol='AAPL', broker='tradier', latest_price=0, last_updated=datetime.now(), underlying_volatility=None),
+        Position(symbol='GOOG', broker='tastytrade', latest_price=0, last_updated=datetime.now(), underlying_volatility=None),
+    ]
 
 MOCK_BALANCE = Balance(broker='tradier', strategy='RSI', type='cash', balance=10000.0, timestamp=datetime.now())
 
@@ -36,7 +40,7 @@ async def test_update_position_prices_and_volatility():
 
     # Mock session and positions
     mock_session = AsyncMock(spec=AsyncSession)  # Ensure we are using AsyncSession
-    mock_positions = MOCK_POSITIONS
+    mock_positions = make_mock_positions()
 
     # Test the method
     timestamp = datetime.now(timezone.utc)
@@ -66,7 +70,7 @@ async def test_update_position_prices_and_volatility_with_reconcile():
 
     # Mock session and positions
     mock_session = AsyncMock(spec=AsyncSession)  # Ensure we are using AsyncSession
-    mock_positions = MOCK_POSITIONS
+    mock_positions = make_mock_positions()
 
     # Test the method
     timestamp = datetime.now(timezone.utc)
@@ -254,23 +258,73 @@ async def test_fetch_and_update_positions(mock_logger):
 
 @pytest.mark.asyncio
 @patch('data.sync_worker.logger')
-async def test_reconcile_brokers_and_update_balances(mock_logger):
+async def test_reconcile_broker_and_update_balances(mock_logger):
     mock_session = AsyncMock()
     mock_position_service = AsyncMock()
     mock_balance_service = AsyncMock()
-    mock_brokers = ['broker1', 'broker2']
     mock_now = datetime.now()  # Capture datetime once
     data.sync_worker.RECONCILE_POSITIONS = True
 
-    await _reconcile_brokers_and_update_balances(mock_session, mock_position_service, mock_balance_service, mock_brokers, mock_now)
+    await _reconcile_broker_and_update_balances(mock_session, mock_position_service, mock_balance_service, 'broker1', mock_now)
 
-    # Ensure reconcile positions and update balances are called for both brokers
-    mock_position_service.reconcile_positions.assert_any_await(mock_session, 'broker1')
-    mock_position_service.reconcile_positions.assert_any_await(mock_session, 'broker2')
-    mock_balance_service.update_all_strategy_balances.assert_any_await(mock_session, 'broker1', mock_now)
-    mock_balance_service.update_all_strategy_balances.assert_any_await(mock_session, 'broker2', mock_now)
+    # Ensure reconcile positions and update balances are called for the broker
+    mock_position_service.reconcile_positions.assert_awaited_once_with(mock_session, 'broker1')
+    mock_balance_service.update_all_strategy_balances.assert_awaited_once_with(mock_session, 'broker1', mock_now, None)
     data.sync_worker.RECONCILE_POSITIONS = False
 
+def session_factory():
+    sessions = []
+
+    def make_session():
+        session = AsyncMock()
+        session.__aenter__ = AsyncMock(return_value=session)
+        session.__aexit__ = AsyncMock(return_value=None)
+        session.execute = AsyncMock(return_value=MagicMock())
+        sessions.append(session)
+        return session
+    return MagicMock(side_effect=make_session), sessions
+
+@pytest.mark.asyncio
+@patch('data.sync_worker.logger')
+async def test_brokers_sync_concurrently_with_their_own_sessions(mock_logger):
+    Session, sessions = session_factory()
+    mock_position_service = AsyncMock()
+    mock_balance_service = AsyncMock()
+
+    async def slow_balances(session, broker, now, snapshot):
+        await asyncio.sleep(0.1)
+    mock_balance_service.update_all_strategy_balances = AsyncMock(side_effect=slow_balances)
+
+    started = asyncio.get_running_loop().time()
+    await _run_sync_worker_iteration_logic(Session, mock_position_service, mock_balance_service, ['broker1', 'broker2', 'broker3'])
+    assert asyncio.get_running_loop().time() - started < 0.25
+
+    assert len(sessions) == 3
+    for session in sessions:
+        session.commit.assert_awaited()
+    timings = mock_logger.info.call_args_list[-1].kwargs['extra']['timings']
+    assert [(timing['broker'], timing['status']) for timing in timings] == [('broker1', 'ok'), ('broker2', 'ok'), ('broker3', 'ok')]
+
+@pytest.mark.asyncio
+@patch('data.sync_worker.logger')
+async def test_slow_broker_times_out_alone(mock_logger):
+    Session, sessions = session_factory()
+    mock_position_service = AsyncMock()
+    mock_balance_service = AsyncMock()
+
+    async def balances(session, broker, now, snapshot):
+        if broker == 'slow':
+            await asyncio.sleep(1)
+    mock_balance_service.update_all_strategy_balances = AsyncMock(side_effect=balances)
+
+    await _run_sync_worker_iteration_logic(Session, mock_position_service, mock_balance_service, ['slow', 'fast'], broker_timeout_duration=0.05)
+
+    timings = mock_logger.info.call_args_list[-1].kwargs['extra']['timings']
+    assert [(timing['broker'], timing['status']) for timing in timings] == [('slow', 'timeout'), ('fast', 'ok')]
+    # The fast broker still priced its positions and committed
+    mock_position_service.update_position_prices_and_volatility.assert_awaited_once()
+    sessions[1].commit.assert_awaited()
+
 # TODO: Fix this test or refactor
 @pytest.mark.skip
 @pytest.mark.asyncio
@@ -546,3 +600,198 @@ async def test_run_sync_worker_iteration_timeout(mock_logger):
     mock_position_service.reconcile_positions.assert_called_once_with(mock_session, 'mock_broker')
     mock_balance_service.update_all_strategy_balances.assert_not_called()  # Should not reach this due to timeout
     data.sync_worker.RECONCILE_POSITIONS = False
+
+
+@pytest_asyncio.fixture
+async def sqlite_engine():
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    await init_db(engine)
+    statements = []
+
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    yield engine, statements
+    await engine.dispose()
+
+
+def writes_to(statements, table):
+    return [s for s in statements if s.startswith(f'INSERT INTO {table}') or s.startswith(f'UPDATE {table}')]
+
+
+@pytest.mark.asyncio
+async def test_update_all_strategy_balances_bulk_inserts(sqlite_engine):
+    sqlite_engine, statements = sqlite_engine
+    Session = sessionmaker(bind=sqlite_engine, class_=AsyncSession, expire_on_commit=False)
+    earlier = datetime(2024, 1, 1)
+    async with Session() as session:
+        session.add_all([
+            Balance(broker='tradier', strategy='RSI', type='cash', balance=1000, timestamp=earlier),
+            Balance(broker='tradier', strategy='MACD', type='cash', balance=2000, timestamp=earlier),
+            Position(broker='tradier', strategy='RSI', symbol='AAPL', quantity=10, latest_price=90),
+        ])
+        await session.commit()
+
+    broker_service = MagicMock()
+    broker_service.get_latest_price = AsyncMock(return_value=100)
+    broker_service.get_account_info = AsyncMock(return_value={'value': 5000})
+    statements.clear()
+
+    now = datetime(2024, 1, 2)
+    async with Session() as session:
+        await BalanceService(broker_service).update_all_strategy_balances(session, 'tradier', now)
+
+    assert len(writes_to(statements, 'balances')) == 1
+    assert len(writes_to(statements, 'balance_latest')) == 1
+    async with Session() as session:
+        latest = {
+            (row.strategy, row.type): row.balance
+            for row in (await session.execute(select(BalanceLatest).filter_by(broker='tradier'))).scalars()
+        }
+        inserted = (await session.execute(select(Balance).filter_by(timestamp=now))).scalars().all()
+    assert len(inserted) == 7
+    assert latest[('RSI', 'total')] == 2000
+    assert latest[('MACD', 'total')] == 2000
+    assert latest[('uncategorized', 'cash')] == 1000
+
+
+@pytest.mark.asyncio
+async def test_reconcile_positions_single_upsert(sqlite_engine):
+    sqlite_engine, statements = sqlite_engine
+    Session = sessionmaker(bind=sqlite_engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as session:
+        session.add_all([
+            Position(broker='tradier', strategy='RSI', symbol='AAPL', quantity=5, latest_price=90),
+            Position(broker='tradier', strategy='RSI', symbol='TSLA', quantity=1, latest_price=200),
+        ])
+        await session.commit()
+
+    broker_instance = MagicMock()
+    broker_instance.get_positions.return_value = {
+        'AAPL': {'symbol': 'AAPL', 'quantity': 10},
+        'MSFT': {'symbol': 'MSFT', 'quantity': 3},
+    }
+    broker_service = MagicMock()
+    broker_service.get_broker_instance = AsyncMock(return_value=broker_instance)
+    broker_service.get_latest_price = AsyncMock(return_value=300)
+    statements.clear()
+
+    with patch('data.sync_worker.UPDATE_UNCATEGORIZED_POSITIONS', True):
+        async with Session() as session:
+            await PositionService(broker_service).reconcile_positions(session, 'tradier')
+
+    assert len(writes_to(statements, 'positions')) == 1
+    async with Session() as session:
+        positions = (await session.execute(
+            select(Position.strategy, Position.symbol, Position.quantity, Position.latest_price).order_by(Position.symbol)
+        )).all()
+    assert positions == [('RSI', 'AAPL', 10, 90), ('uncategorized', 'MSFT', 3, 300)]
+
+
+@pytest.mark.asyncio
+async def test_market_snapshot_quotes_each_symbol_once():
+    broker_service = MagicMock()
+
+    async def latest_price(broker, symbol):
+        await asyncio.sleep(0.01)
+        return 100
+    broker_service.get_latest_price = AsyncMock(side_effect=latest_price)
+    snapshot = MarketSnapshot(broker_service)
+
+    await snapshot.load([
+        Position(broker='tradier', symbol='AAPL'),
+        Position(broker='tradier', symbol='AAPL240719C00150000'),
+        Position(broker='tastytrade', symbol='AAPL'),
+    ])
+    # Lookups racing the same quote share it
+    prices = await asyncio.gather(*[snapshot.get_latest_price('tradier', 'AAPL') for _ in range(3)])
+
+    assert prices == [100, 100, 100]
+    assert sorted(call.args for call in broker_service.get_latest_price.call_args_list) == [
+        ('tastytrade', 'AAPL'), ('tradier', 'AAPL'), ('tradier', 'AAPL240719C00150000')]
+
+
+@pytest.mark.asyncio
+@patch('data.sync_worker.PositionService._calculate_historical_volatility', AsyncMock(return_value=0.2))
+async def test_sync_worker_iteration_shares_one_snapshot(sqlite_engine):
+    sqlite_engine, _ = sqlite_engine
+    Session = sessionmaker(bind=sqlite_engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as session:
+        session.add_all([
+            Balance(broker='tradier', strategy='RSI', type='cash', balance=1000, timestamp=datetime(2024, 1, 1)),
+            Position(broker='tradier', strategy='RSI', symbol='AAPL', quantity=10, latest_price=90),
+            Position(broker='tradier', strategy='MACD', symbol='AAPL', quantity=5, latest_price=90),
+            Position(broker='tradier', strategy='MACD', symbol='AAPL240719C00150000', quantity=1, latest_price=2),
+        ])
+        await session.commit()
+
+    broker_service = MagicMock()
+    broker_service.get_latest_price = AsyncMock(return_value=100)
+    broker_service.get_account_info = AsyncMock(return_value={'value': 5000})
+
+    await _run_sync_worker_iteration_logic(Session, PositionService(broker_service), BalanceService(broker_service), ['tradier'])
+
+    # Balances, position prices and underlying prices all read the same quotes
+    assert sorted(call.args for call in broker_service.get_latest_price.call_args_list) == [
+        ('tradier', 'AAPL'), ('tradier', 'AAPL240719C00150000')]
+    async with Session() as session:
+        positions = (await session.execute(select(Position.symbol, Position.latest_price, Position.underlying_volatility))).all()
+    assert all(price == 100 and volatility == 0.2 for _, price, volatility in positions)
+
+
+@pytest.mark.asyncio
+async def test_only_dirty_strategy_balances_are_written(sqlite_engine):
+    sqlite_engine, statements = sqlite_engine
+    Session = sessionmaker(bind=sqlite_engine, class_=AsyncSession, expire_on_commit=False)
+    start = datetime(2024, 1, 2, 10, 0)
+    async with Session() as session:
+        session.add_all([
+            Balance(broker='tradier', strategy='RSI', type='cash', balance=1000, timestamp=datetime(2024, 1, 1)),
+            Balance(broker='tradier', strategy='MACD', type='cash', balance=2000, timestamp=datetime(2024, 1, 1)),
+            Position(broker='tradier', strategy='RSI', symbol='AAPL', quantity=10, latest_price=100),
+        ])
+        await session.commit()
+
+    broker_service = MagicMock()
+    broker_service.get_latest_price = AsyncMock(return_value=100)
+    broker_service.get_account_info = AsyncMock(return_value={'value': 5000})
+    balance_service = BalanceService(broker_service)
+
+    async def sync(minutes):
+        now = start + timedelta(minutes=minutes)
+        async with Session() as session:
+            await balance_service.update_all_strategy_balances(session, 'tradier', now)
+        async with Session() as session:
+            rows = (await session.execute(select(Balance.strategy).filter_by(timestamp=now))).scalars().all()
+        return sorted(set(rows))
+
+    assert await sync(0) == ['MACD', 'RSI', 'uncategorized']
+    # Nothing changed
+    assert await sync(5) == []
+    # A fill on MACD wrote cash after its last total
+    async with Session() as session:
+        session.add(Balance(broker='tradier', strategy='MACD', type='cash', balance=1900, timestamp=start + timedelta(minutes=7)))
+        await session.commit()
+    assert await sync(10) == ['MACD', 'uncategorized']
+    # AAPL moved by more than the threshold
+    broker_service.get_latest_price.return_value = 101
+    assert await sync(15) == ['RSI', 'uncategorized']
+    # Everything is rewritten once the heartbeat interval passed
+    assert await sync(50) == ['MACD', 'RSI', 'uncategorized']
+
+
+@pytest.mark.asyncio
+async def test_unchanged_position_prices_are_not_written():
+    broker_service = MagicMock()
+    broker_service.get_latest_price = AsyncMock(return_value=100.05)
+    position_service = PositionService(broker_service)
+    now = datetime(2024, 1, 2, 10, 0)
+    recent = Position(broker='tradier', symbol='AAPL', latest_price=100, last_updated=now - timedelta(minutes=5))
+    stale = Position(broker='tradier', symbol='MSFT', latest_price=100, last_updated=now - timedelta(hours=1))
+
+    with patch.object(PositionService, '_calculate_historical_volatility', AsyncMock(return_value=0.2)):
+        await position_service.update_position_prices_and_volatility(AsyncMock(), [recent, stale], now)
+
+    assert (recent.latest_price, recent.last_updated) == (100, now - timedelta(minutes=5))
+    assert (stale.latest_price, stale.last_updated) == (100.05, now)
@@ -0,0 +1,63 @@
+from datetime import datetime, date, timezone
+from utils.trading_calendar import NYSE, CME_GLOBEX, CRYPTO, TradingCalendar, nyse_sessions, us_holidays, seconds_until_open
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_us_holidays():
+    assert sorted(us_holidays(2024)) == [
+        date(2024, 1, 1), date(2024, 1, 15), date(2024, 2, 19), date(2024, 3, 29), date(2024, 5, 27),
+        date(2024, 6, 19), date(2024, 7, 4), date(2024, 9, 2), date(2024, 11, 28), date(2024, 12, 25),
+    ]
+    # New Year's Day on a Saturday is not observed, other weekend holidays move to the nearest weekday
+    holidays = us_holidays(2022)
+    assert date(2021, 12, 31) not in us_holidays(2021) and date(2022, 1, 1) not in holidays
+    assert date(2022, 6, 20) in holidays and date(2022, 12, 26) in holidays
+
+
+def test_nyse_sessions():
+    # Regular hours follow daylight saving time
+    assert NYSE.session(utc(2024, 1, 2, 15)) == (utc(2024, 1, 2, 14, 30), utc(2024, 1, 2, 21))
+    assert NYSE.is_open(utc(2024, 7, 22, 14))
+    assert not NYSE.is_open(utc(2024, 7, 22, 20, 30))
+    # Holidays, half days and weekends
+    assert not NYSE.is_open(utc(2024, 7, 4, 15))
+    assert not NYSE.is_open(utc(2024, 3, 29, 15))
+    assert NYSE.next_close(utc(2024, 7, 3, 14)) == utc(2024, 7, 3, 17)
+    assert NYSE.next_open(utc(2024, 7, 19, 21)) == utc(2024, 7, 22, 13, 30)
+    # Across the year boundary
+    assert NYSE.next_open(utc(2024, 12, 31, 22)) == utc(2025, 1, 2, 14, 30)
+
+
+def test_naive_timestamps_are_utc():
+    assert NYSE.is_open(datetime(2024, 7, 22, 14))
+    assert NYSE.seconds_until_open(datetime(2024, 7, 22, 13)) == 30 * 60
+
+
+def test_cme_globex_sessions():
+    # Opens Sunday evening, pauses daily from 5 PM to 6 PM Eastern
+    assert CME_GLOBEX.is_open(utc(2024, 7, 21, 22, 30))
+    assert not CME_GLOBEX.is_open(utc(2024, 7, 23, 21, 30))
+    assert CME_GLOBEX.next_open(utc(2024, 7, 19, 21, 30)) == utc(2024, 7, 21, 22)
+    # Early close on July 4th, closed on Christmas
+    assert CME_GLOBEX.next_close(utc(2024, 7, 4, 12)) == utc(2024, 7, 4, 17)
+    assert not CME_GLOBEX.is_open(utc(2024, 12, 25, 15))
+    assert CME_GLOBEX.next_open(utc(2024, 12, 25, 15)) == utc(2024, 12, 25, 23)
+
+
+def test_crypto_is_always_open():
+    assert CRYPTO.is_open(utc(2024, 12, 31, 23, 59, 59))
+    assert CRYPTO.is_open(utc(2025, 1, 1))
+    assert seconds_until_open([NYSE, CRYPTO], utc(2024, 7, 20)) == 0
+
+
+def test_calendar_extends_to_earlier_years():
+    calendar = TradingCalendar('NYSE', nyse_sessions)
+    assert calendar.is_open(utc(2024, 7, 22, 14))
+    assert calendar.is_open(utc(2012, 10, 26, 14))
+    # Hurricane Sandy
+    assert not calendar.is_open(utc(2012, 10, 29, 14))
+    assert calendar.opens == sorted(calendar.opens)
+    assert calendar.first_year == 2011 and calendar.last_year == 2025
@@ -1,7 +1,13 @@
 import pytest
 from flask import Flask
 from ui.app import create_app
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from database.models import Base, AccountInfo, Balance, BalanceLatest, Position, Trade, OrderLatency
+from data.archive import ParquetArchive
+from datetime import datetime, timedelta
+from database.routing import ReplicaLagMonitor
 from flask_jwt_extended import create_access_token
 
 @pytest.fixture
@@ -65,3 +71,156 @@ def skip_test_get_brokers_strategies(client, access_token):
     assert response.status_code == 200
     data = response.get_json()
     assert isinstance(data, list)  # Expecting a list of brokers and strategies
+
+@pytest.fixture
+def seeded_app():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all([
+            Balance(broker='tradier', strategy='RSI', type='cash', balance=1000),
+            Position(broker='tradier', strategy='RSI', symbol='AAPL', quantity=2, latest_price=100, cost_basis=200),
+            Position(broker='tradier', strategy='RSI', symbol='MSFT', quantity=1, latest_price=300, cost_basis=None),
+            Position(broker='tradier', strategy='uncategorized', symbol='AAPL', quantity=3, latest_price=100, cost_basis=None),
+            Position(broker='tastytrade', strategy='RSI', symbol='AAPL', quantity=7, latest_price=100, cost_basis=700),
+        ])
+        session.commit()
+    app = create_app(engine)
+    with app.app_context():
+        yield app, engine
+
+def test_delete_strategy_moves_positions_to_uncategorized(seeded_app, access_token):
+    app, engine = seeded_app
+    response = app.test_client().post('/delete_strategy', json={
+        'broker': 'tradier',
+        'strategy_name': 'RSI'
+    }, headers={
+        'Authorization': f'Bearer {access_token}'
+    })
+    assert response.status_code == 200
+
+    with Session(engine) as session:
+        positions = session.execute(
+            select(Position.broker, Position.strategy, Position.symbol, Position.quantity, Position.cost_basis)
+            .order_by(Position.broker, Position.symbol)
+        ).all()
+        assert session.query(Balance).filter_by(broker='tradier', strategy='RSI').count() == 0
+        assert session.query(BalanceLatest).filter_by(broker='tradier', strategy='RSI').count() == 0
+    assert positions == [
+        ('tastytrade', 'RSI', 'AAPL', 7, 700),
+        ('tradier', 'uncategorized', 'AAPL', 5, 200),
+        ('tradier', 'uncategorized', 'MSFT', 1, None),
+    ]
+
+def memory_engine():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    return engine
+
+@pytest.fixture
+def replicated_app():
+    primary, replica = memory_engine(), memory_engine()
+    with Session(primary) as session:
+        session.add(AccountInfo(broker='tradier', value=200.0))
+        session.commit()
+    with Session(replica) as session:
+        session.add(AccountInfo(broker='tradier', value=100.0))
+        session.commit()
+    app = create_app(primary, replica)
+    with app.app_context():
+        yield app, primary, replica
+
+def test_reads_are_served_by_the_replica(replicated_app, access_token):
+    app, primary, replica = replicated_app
+    response = app.test_client().get('/account_values', headers={'Authorization': f'Bearer {access_token}'})
+    assert response.get_json()['account_values'] == {'tradier': 100.0}
+
+def test_writes_go_to_the_primary(replicated_app, access_token):
+    app, primary, replica = replicated_app
+    response = app.test_client().post('/adjust_balance', json={
+        'broker': 'tradier',
+        'strategy_name': 'RSI',
+        'new_total_balance': 500
+    }, headers={
+        'Authorization': f'Bearer {access_token}'
+    })
+    assert response.status_code == 200
+
+    with Session(primary) as session:
+        assert session.get(BalanceLatest, ('tradier', 'RSI', 'cash')).balance == 500
+    with Session(replica) as session:
+        assert session.query(Balance).count() == 0
+
+def test_stale_replica_falls_back_to_primary(replicated_app, access_token):
+    app, primary, replica = replicated_app
+    monitor = ReplicaLagMonitor(replica, max_lag_seconds=5)
+    monitor.measure = lambda: 30.0
+    app.session.remove()
+    app.session.session_factory.kw['lag_monitor'] = monitor
+
+    response = app.test_client().get('/account_values', headers={'Authorization': f'Bearer {access_token}'})
+    assert response.get_json()['account_values'] == {'tradier': 200.0}
+    assert monitor.lag_seconds == 30.0
+
+def test_trade_stats_include_archived_trades(tmp_path):
+    engine = memory_engine()
+    trade = {'symbol': 'AAPL', 'quantity': 1, 'price': 100.0, 'side': 'buy', 'status': 'filled', 'broker': 'tradier', 'strategy': 'RSI'}
+    with Session(engine) as session:
+        session.add(Trade(id=2, profit_loss=-1.0, timestamp=datetime(2024, 6, 1), **trade))
+        session.commit()
+    ParquetArchive(str(tmp_path)).write(Trade, [
+        dict(trade, id=1, profit_loss=3.0, timestamp=datetime(2022, 1, 3), broker_id=None, executed_price=None, success=None, execution_style=None)])
+
+    app = create_app(engine, archive_path=str(tmp_path))
+    with app.app_context():
+        access_token = create_access_token(identity='test_user')
+        response = app.test_client().get('/trade_stats', headers={'Authorization': f'Bearer {access_token}'})
+    data = response.get_json()
+    assert data['number_of_trades'] == 2
+    assert data['average_profit_loss'] == 1.0
+    assert data['trades_per_day'] == {'2022-01-03': 1, '2024-06-01': 1}
+
+
+def test_trade_stats_only_read_archived_files_in_the_requested_range(tmp_path):
+    engine = memory_engine()
+    trade = {'symbol': 'AAPL', 'quantity': 1, 'price': 100.0, 'side': 'buy', 'status': 'filled', 'broker': 'tradier', 'strategy': 'RSI',
+             'broker_id': None, 'executed_price': None, 'success': None, 'execution_style': None}
+    with Session(engine) as session:
+        session.add(Trade(id=3, profit_loss=-1.0, timestamp=datetime(2024, 6, 1), **trade))
+        session.commit()
+    archive = ParquetArchive(str(tmp_path))
+    archive.write(Trade, [dict(trade, id=1, profit_loss=3.0, timestamp=datetime(2022, 1, 3))])
+    archive.write(Trade, [dict(trade, id=2, profit_loss=5.0, timestamp=datetime(2023, 5, 2))])
+
+    app = create_app(engine, archive_path=str(tmp_path))
+    with app.app_context():
+        access_token = create_access_token(identity='test_user')
+        response = app.test_client().get('/trade_stats?start=2023-01-01&end=2024-01-01', headers={'Authorization': f'Bearer {access_token}'})
+        # Only the 2023 file was opened
+        assert [path for path, _ in app.archive._tables] == [path for path in archive.files(Trade) if 'year=2023' in path]
+    data = response.get_json()
+    assert data['number_of_trades'] == 1
+    assert data['trades_per_day'] == {'2023-05-02': 1}
+
+
+def test_order_latency_aggregates_recent_samples():
+    engine = memory_engine()
+    now = datetime.now()
+    with Session(engine) as session:
+        session.add_all(
+            [OrderLatency(broker='tradier', asset_class='equity', order_type='limit', stage='submit_to_ack', latency_ms=latency_ms, timestamp=now)
+             for latency_ms in [3] * 90 + [40] * 9 + [7000]] +
+            [OrderLatency(broker='tradier', asset_class='equity', order_type='limit', stage='submit_to_ack', latency_ms=1, timestamp=now - timedelta(days=30))]
+        )
+        session.commit()
+    app = create_app(engine)
+    with app.app_context():
+        # The window is capped, so the month-old sample is left out
+        response = app.test_client().get('/order_latency?hours=100000', headers={
+            'Authorization': f'Bearer {create_access_token(identity="test_user")}'})
+
+    assert response.status_code == 200
+    assert response.get_json()['order_latency'] == [{
+        'broker': 'tradier', 'asset_class': 'equity', 'order_type': 'limit', 'stage': 'submit_to_ack',
+        'count': 100, 'mean_ms': 76.3, 'max_ms': 7000.0, 'p50_ms': 5, 'p95_ms': 50, 'p99_ms': 50,
+    }]
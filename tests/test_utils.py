@@ -1,9 +1,10 @@
 import pytest
 from unittest.mock import patch
-from utils.utils import futures_contract_size, is_futures_market_open, is_futures_symbol
+from utils.utils import futures_contract_size, is_futures_market_open, is_futures_symbol, contract_multiplier
 from freezegun import freeze_time
 from unittest.mock import MagicMock, AsyncMock
 import utils.config as config_module
+import database.engines as engines_module
 
 # Test Futures Contract Size
 def test_is_futures_symbol():
@@ -53,6 +54,11 @@ def test_unknown_symbol(mock_logger):
     mock_logger.error.assert_called_once_with("Unknown future symbol: ./XYZU4")
 
 
+def test_contract_multiplier():
+    assert contract_multiplier('AAPL') == 1
+    assert contract_multiplier('AAPL240719C00200000') == 100
+    assert contract_multiplier('./ESU4') == 50
+
 # Test Futures Market Open
 @freeze_time("2024-07-22 13:00:00")  # A Monday at 1:00 PM Eastern Time
 def test_futures_market_open():
@@ -193,13 +199,29 @@ async def skip_test_initialize_brokers_and_strategies_with_rename_failure(mock_i
     assert strategies is not None
 
 @pytest.mark.asyncio
-@patch("utils.config.create_async_engine", return_value=MagicMock())
-async def test_create_database_engine(mock_create_engine, mock_config):
+@patch("database.engines._engines", {})
+@patch("database.engines.configure_sqlite")
+@patch("database.engines.create_async_engine", return_value=MagicMock())
+async def test_create_database_engine(mock_create_engine, mock_configure_sqlite, mock_config):
     engine = config_module.create_database_engine(mock_config)
 
     # Assertions
-    mock_create_engine.assert_called_once_with(mock_config["database"]["url"])
+    mock_create_engine.assert_called_once_with(mock_config["database"]["url"], **engines_module._engine_kwargs(mock_config["database"]["url"], None, True))
+    mock_configure_sqlite.assert_called_once_with(engine, engines_module.DEFAULT_SQLITE_CONFIG, False)
     assert engine is not None
+    # One engine per url per process
+    assert config_module.create_database_engine(mock_config) is engine
+    mock_create_engine.assert_called_once()
+
+@patch("database.engines._engines", {})
+@patch("database.engines.configure_sqlite")
+@patch("database.engines.create_engine", return_value=MagicMock())
+def test_create_api_read_engine(mock_create_engine, mock_configure_sqlite, mock_config):
+    assert config_module.create_api_read_engine(mock_config) is None
+
+    read_config = {"database": {"url": "sqlite:///primary.db", "read_url": "sqlite:///replica.db"}}
+    assert config_module.create_api_read_engine(read_config) is not None
+    assert mock_create_engine.call_args.args == ("sqlite:///replica.db",)
 
 @pytest.mark.asyncio
 @patch("utils.config.init_db", new_callable=AsyncMock)
@@ -1,18 +1,23 @@
 from flask import Flask, jsonify, request
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import func, text
-from database.models import Trade, AccountInfo, Balance, Position
+from sqlalchemy import func, text, select, update, delete, case
+from database.models import Trade, AccountInfo, Balance, BalanceLatest, Position, OrderLatency
 from flask_cors import CORS
-import numpy as np
-from scipy.stats import norm
 import os
 from datetime import timedelta, datetime, UTC
 from utils.utils import is_option, black_scholes_delta_theta, extract_option_details, OPTION_MULTIPLIER, is_futures_symbol, futures_contract_size
 from utils.logger import logger
+from utils.latency import LatencyHistogram, latency_bucket
+from utils.stats import value_at_risk, max_drawdown, sharpe_ratio
+from database.engines import pool_metrics
+from database.routing import RoutingSession, ReplicaLagMonitor
+from data.archive import ParquetArchive, with_archived
+from functools import wraps
 
 
 app = Flask("TradingAPI")
+app.archive = None
 DASHBOARD_URL = os.environ.get("DASHBOARD_URL", "http://localhost:3000")
 
 # Configure CORS
@@ -26,6 +31,45 @@ jwt = JWTManager(app)
 
 USERNAME = os.environ.get('APP_USERNAME', 'emperor')
 PASSWORD = os.environ.get('APP_PASSWORD', 'fugazi')
+# Widest window /order_latency aggregates over
+MAX_LATENCY_WINDOW_HOURS = 24 * 7
+
+
+def use_primary(view):
+    '''Run every query of the request on the primary, even with a read replica configured'''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        app.session().use_primary()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def filtered_trades():
+    '''Trades matching the brokers[], strategies[] and optional start and end (ISO 8601) query arguments.
+
+    The same filters select the database rows and, when an archive is
+    configured, the archived trades in [start, end).
+    '''
+    brokers = request.args.getlist('brokers[]')
+    strategies = request.args.getlist('strategies[]')
+    start, end = request.args.get('start'), request.args.get('end')
+    start = datetime.fromisoformat(start) if start else None
+    end = datetime.fromisoformat(end) if end else None
+
+    query = app.session.query(Trade)
+    if brokers:
+        query = query.filter(Trade.broker.in_(brokers))
+    if strategies:
+        query = query.filter(Trade.strategy.in_(strategies))
+    if start is not None:
+        query = query.filter(Trade.timestamp >= start)
+    if end is not None:
+        query = query.filter(Trade.timestamp < end)
+    trades = query.all()
+
+    if app.archive is None:
+        return trades
+    return with_archived(Trade, trades, app.archive, start=start, end=end, brokers=brokers, strategies=strategies)
 
 
 @app.route('/', methods=['GET'])
@@ -64,61 +108,22 @@ def account_values():
 @jwt_required()
 def get_brokers_strategies():
     try:
-        # Subquery to get the latest cash balance record for each broker and strategy
-        cash_subquery = app.session.query(
-            Balance.broker,
-            Balance.strategy,
-            func.max(Balance.timestamp).label('latest_cash_timestamp')
-        ).filter_by(type='cash').group_by(Balance.broker, Balance.strategy).subquery()
-
-        # Fetch the latest cash balances
-        latest_cash_balances = app.session.query(
-            Balance.broker,
-            Balance.strategy,
-            Balance.balance
-        ).join(
-            cash_subquery,
-            (Balance.broker == cash_subquery.c.broker) &
-            (Balance.strategy == cash_subquery.c.strategy) &
-            (Balance.timestamp == cash_subquery.c.latest_cash_timestamp)
-        ).filter(Balance.type == 'cash').all()
+        # Latest cash and positions balances, one row per broker/strategy/type
+        latest_balances = app.session.query(
+            BalanceLatest.broker,
+            BalanceLatest.strategy,
+            BalanceLatest.type,
+            BalanceLatest.balance
+        ).filter(BalanceLatest.type.in_(['cash', 'positions'])).all()
 
         # Create a dictionary to store the results
         broker_strategy_balances = {}
-        for broker, strategy, cash_balance in latest_cash_balances:
-            broker_strategy_balances[(broker, strategy)] = {
-                'cash_balance': cash_balance,
+        for broker, strategy, balance_type, balance in latest_balances:
+            balances = broker_strategy_balances.setdefault((broker, strategy), {
+                'cash_balance': 0,
                 'positions_balance': 0
-            }
-
-        # Fetch the latest positions balance record for each broker and strategy
-        positions_subquery = app.session.query(
-            Balance.broker,
-            Balance.strategy,
-            func.max(Balance.timestamp).label('latest_positions_timestamp')
-        ).filter_by(type='positions').group_by(Balance.broker, Balance.strategy).subquery()
-
-        latest_positions_balances = app.session.query(
-            Balance.broker,
-            Balance.strategy,
-            Balance.balance
-        ).join(
-            positions_subquery,
-            (Balance.broker == positions_subquery.c.broker) &
-            (Balance.strategy == positions_subquery.c.strategy) &
-            (Balance.timestamp == positions_subquery.c.latest_positions_timestamp)
-        ).filter(Balance.type == 'positions').all()
-
-        # Update the dictionary with the positions balances
-        for broker, strategy, positions_balance in latest_positions_balances:
-            if (broker, strategy) in broker_strategy_balances:
-                broker_strategy_balances[(
-                    broker, strategy)]['positions_balance'] = positions_balance
-            else:
-                broker_strategy_balances[(broker, strategy)] = {
-                    'cash_balance': 0,
-                    'positions_balance': positions_balance
-                }
+            })
+            balances[f'{balance_type}_balance'] = balance
 
         # Calculate total balance for each broker and strategy
         for (broker, strategy), balances in broker_strategy_balances.items():
@@ -152,28 +157,53 @@ def get_brokers_strategies():
 
 @app.route('/delete_strategy', methods=['POST'])
 @jwt_required()
+@use_primary
 def delete_strategy():
     data = request.get_json()
     broker = data.get('broker')
     strategy_name = data.get('strategy_name')
 
     try:
-        # Check for open positions for the specified strategy and broker
-        open_positions = app.session.query(Position).filter_by(
-            strategy=strategy_name, broker=broker
-        ).all()
-
-        if open_positions:
-            # if there are open positions, switch them to be uncategorized
-            for position in open_positions:
-                position.strategy = 'uncategorized'
-                app.session.add(position)
-            app.session.commit()
+        # Switch open positions to uncategorized with set-based statements:
+        # fold them into existing uncategorized positions of the same symbol,
+        # then re-key the rest
+        positions = Position.__table__
+        deleted = positions.alias('deleted')
+        uncategorized = positions.alias('uncategorized')
+        deleted_for_symbol = (deleted.c.strategy == strategy_name) & (deleted.c.broker == broker) & \
+            (deleted.c.symbol == positions.c.symbol)
+        deleted_quantity = select(deleted.c.quantity).where(deleted_for_symbol).scalar_subquery()
+        deleted_cost_basis = select(deleted.c.cost_basis).where(deleted_for_symbol).scalar_subquery()
+        app.session.execute(
+            update(positions)
+            .where(positions.c.strategy == 'uncategorized', positions.c.broker == broker,
+                   positions.c.symbol.in_(select(deleted.c.symbol).where(deleted.c.strategy == strategy_name, deleted.c.broker == broker)))
+            .values(
+                quantity=positions.c.quantity + deleted_quantity,
+                cost_basis=case(
+                    (deleted_cost_basis.is_(None), positions.c.cost_basis),
+                    else_=func.coalesce(positions.c.cost_basis, 0) + deleted_cost_basis
+                )
+            )
+        )
+        app.session.execute(
+            delete(positions)
+            .where(positions.c.strategy == strategy_name, positions.c.broker == broker,
+                   positions.c.symbol.in_(select(uncategorized.c.symbol).where(uncategorized.c.strategy == 'uncategorized', uncategorized.c.broker == broker)))
+        )
+        app.session.execute(
+            update(positions)
+            .where(positions.c.strategy == strategy_name, positions.c.broker == broker)
+            .values(strategy='uncategorized', balance_id=None)
+        )
 
         # Delete all balance records associated with the specified strategy and broker
         delete_count = app.session.query(Balance).filter_by(
             strategy=strategy_name, broker=broker
         ).delete(synchronize_session=False)
+        app.session.query(BalanceLatest).filter_by(
+            strategy=strategy_name, broker=broker
+        ).delete(synchronize_session=False)
         # Commit the transaction
         app.session.commit()
         logger.info(f"Deleted {delete_count} balance records for strategy {strategy_name}")
@@ -190,6 +220,7 @@ def delete_strategy():
 
 @app.route('/adjust_balance', methods=['POST'])
 @jwt_required()
+@use_primary
 def adjust_balance():
     data = request.get_json()
     broker = data.get('broker')
@@ -202,9 +233,7 @@ def adjust_balance():
 
     try:
         # Fetch the latest positions balance for the strategy
-        positions_balance_record = app.session.query(Balance).filter_by(
-            strategy=strategy_name, broker=broker, type='positions'
-        ).order_by(Balance.timestamp.desc()).first()
+        positions_balance_record = app.session.get(BalanceLatest, (broker, strategy_name, 'positions'))
 
         if not positions_balance_record:
             positions_balance = 0
@@ -234,9 +263,7 @@ def adjust_balance():
         )
 
         # Calculate the current total balance and the adjustment
-        cash_balance_record = app.session.query(Balance).filter_by(
-            strategy=strategy_name, broker=broker, type='cash'
-        ).order_by(Balance.timestamp.desc()).first()
+        cash_balance_record = app.session.get(BalanceLatest, (broker, strategy_name, 'cash'))
 
         if cash_balance_record:
             current_total_balance = cash_balance_record.balance + positions_balance
@@ -256,9 +283,9 @@ def adjust_balance():
             timestamp=now
         )
         # Subtract from the uncatagorized cash balance for this broker
-        uncatagorized_cash_balance_record = app.session.query(Balance).filter_by(
-            strategy='uncategorized', broker=broker, type='cash'
-        ).order_by(Balance.timestamp.desc()).first()
+        uncatagorized_latest = app.session.get(BalanceLatest, (broker, 'uncategorized', 'cash'))
+        uncatagorized_cash_balance_record = app.session.get(
+            Balance, uncatagorized_latest.balance_id) if uncatagorized_latest else None
         if uncatagorized_cash_balance_record:
             uncatagorized_cash_balance_record.balance -= adjustment
         else:
@@ -337,7 +364,7 @@ def historic_balance_per_strategy(methods=['GET']):
                     ON b.broker = lcs.broker
                     AND b.strategy = lcs.strategy
                     AND b.timestamp = lcs.latest_cash_timestamp
-                WHERE b.type = 'cash'
+                WHERE b.type = 'cash' AND b.timestamp >= (SELECT ts FROM one_week_ago)
             ),
             latest_positions_balances AS (
                 SELECT
@@ -350,7 +377,7 @@ def historic_balance_per_strategy(methods=['GET']):
                     ON b.broker = lps.broker
                     AND b.strategy = lps.strategy
                     AND b.timestamp = lps.latest_positions_timestamp
-                WHERE b.type = 'positions'
+                WHERE b.type = 'positions' AND b.timestamp >= (SELECT ts FROM one_week_ago)
             )
             SELECT
                 lcb.broker,
@@ -401,7 +428,7 @@ def historic_balance_per_strategy(methods=['GET']):
                     ON b.broker = lcs.broker
                     AND b.strategy = lcs.strategy
                     AND b.timestamp = lcs.latest_cash_timestamp
-                WHERE b.type = 'cash'
+                WHERE b.type = 'cash' AND b.timestamp >= (SELECT ts FROM one_week_ago)
             ),
             latest_positions_balances AS (
                 SELECT
@@ -414,7 +441,7 @@ def historic_balance_per_strategy(methods=['GET']):
                     ON b.broker = lps.broker
                     AND b.strategy = lps.strategy
                     AND b.timestamp = lps.latest_positions_timestamp
-                WHERE b.type = 'positions'
+                WHERE b.type = 'positions' AND b.timestamp >= (SELECT ts FROM one_week_ago)
             )
             SELECT
                 lcb.broker,
@@ -614,17 +641,7 @@ def get_trades():
 @jwt_required()
 def get_trade_stats():
     try:
-        brokers = request.args.getlist('brokers[]')
-        strategies = request.args.getlist('strategies[]')
-
-        query = app.session.query(Trade)
-
-        if brokers:
-            query = query.filter(Trade.broker.in_(brokers))
-        if strategies:
-            query = query.filter(Trade.strategy.in_(strategies))
-
-        trades = query.all()
+        trades = filtered_trades()
 
         if not trades:
             return jsonify({
@@ -665,27 +682,9 @@ def get_trade_stats():
 @jwt_required()
 def get_var():
     try:
-        brokers = request.args.getlist('brokers[]')
-        strategies = request.args.getlist('strategies[]')
+        trades = filtered_trades()
 
-        query = app.session.query(Trade)
-
-        if brokers:
-            query = query.filter(Trade.broker.in_(brokers))
-        if strategies:
-            query = query.filter(Trade.strategy.in_(strategies))
-
-        trades = query.all()
-
-        if not trades:
-            return jsonify({'var': 0})
-
-        returns = [trade.profit_loss for trade in trades]
-        mean_return = np.mean(returns)
-        std_dev_return = np.std(returns)
-        var_95 = norm.ppf(0.05, mean_return, std_dev_return)
-
-        return jsonify({'var': var_95})
+        return jsonify({'var': value_at_risk([trade.profit_loss for trade in trades])})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
     finally:
@@ -696,27 +695,9 @@ def get_var():
 @jwt_required()
 def get_max_drawdown():
     try:
-        brokers = request.args.getlist('brokers[]')
-        strategies = request.args.getlist('strategies[]')
-
-        query = app.session.query(Trade)
-
-        if brokers:
-            query = query.filter(Trade.broker.in_(brokers))
-        if strategies:
-            query = query.filter(Trade.strategy.in_(strategies))
-
-        trades = query.all()
-
-        if not trades:
-            return jsonify({'max_drawdown': 0})
+        trades = filtered_trades()
 
-        cum_returns = np.cumsum([trade.profit_loss for trade in trades])
-        running_max = np.maximum.accumulate(cum_returns)
-        drawdowns = (running_max - cum_returns) / running_max
-        max_drawdown = np.max(drawdowns)
-
-        return jsonify({'max_drawdown': max_drawdown})
+        return jsonify({'max_drawdown': max_drawdown([trade.profit_loss for trade in trades])})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
     finally:
@@ -727,34 +708,67 @@ def get_max_drawdown():
 @jwt_required()
 def get_sharpe_ratio():
     try:
-        brokers = request.args.getlist('brokers[]')
-        strategies = request.args.getlist('strategies[]')
+        trades = filtered_trades()
 
-        query = app.session.query(Trade)
+        return jsonify({'sharpe_ratio': sharpe_ratio([trade.profit_loss for trade in trades])})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        app.session.remove()
 
-        if brokers:
-            query = query.filter(Trade.broker.in_(brokers))
-        if strategies:
-            query = query.filter(Trade.strategy.in_(strategies))
 
-        trades = query.all()
+@app.route('/order_latency', methods=['GET'])
+@jwt_required()
+def get_order_latency():
+    try:
+        hours = min(request.args.get('hours', 24, type=int), MAX_LATENCY_WINDOW_HOURS)
+        since = datetime.now() - timedelta(hours=hours)
+        # Aggregated per histogram bucket in the database, so the response
+        # costs the same however many samples the window holds
+        bucket = latency_bucket(OrderLatency.latency_ms)
+        rows = app.session.query(
+            OrderLatency.broker,
+            OrderLatency.asset_class,
+            OrderLatency.order_type,
+            OrderLatency.stage,
+            bucket,
+            func.count(OrderLatency.id),
+            func.sum(OrderLatency.latency_ms),
+            func.max(OrderLatency.latency_ms)
+        ).filter(OrderLatency.timestamp >= since).group_by(
+            OrderLatency.broker, OrderLatency.asset_class, OrderLatency.order_type, OrderLatency.stage, bucket
+        ).all()
 
-        if not trades:
-            return jsonify({'sharpe_ratio': 0})
+        histograms = {}
+        for broker, asset_class, order_type, stage, index, count, total_ms, max_ms in rows:
+            histograms.setdefault((broker, asset_class, order_type, stage), LatencyHistogram()).add_bucket(int(index), count, total_ms, max_ms)
 
-        returns = [trade.profit_loss for trade in trades]
-        mean_return = np.mean(returns)
-        std_dev_return = np.std(returns)
-        sharpe_ratio = mean_return / std_dev_return if std_dev_return != 0 else 0
+        latency_data = [
+            {'broker': broker, 'asset_class': asset_class, 'order_type': order_type, 'stage': stage, **histogram.summary()}
+            for (broker, asset_class, order_type, stage), histogram in sorted(histograms.items())
+        ]
 
-        return jsonify({'sharpe_ratio': sharpe_ratio})
+        return jsonify({'order_latency': latency_data})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
     finally:
         app.session.remove()
 
 
-def create_app(engine):
-    Session = sessionmaker(bind=engine)
+@app.route('/pool_metrics', methods=['GET'])
+@jwt_required()
+def get_pool_metrics():
+    try:
+        return jsonify({'pool_metrics': pool_metrics()})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+def create_app(engine, read_engine=None, max_replica_lag_seconds=None, archive_path=None):
+    lag_monitor = None
+    if read_engine is not None and max_replica_lag_seconds is not None:
+        lag_monitor = ReplicaLagMonitor(read_engine, max_replica_lag_seconds)
+    Session = sessionmaker(class_=RoutingSession, primary=engine, replica=read_engine, lag_monitor=lag_monitor)
     app.session = scoped_session(Session)
+    app.archive = ParquetArchive(archive_path) if archive_path else None
     return app
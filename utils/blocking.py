@@ -0,0 +1,199 @@
+import asyncio
+import concurrent.futures
+import functools
+import sys
+import threading
+import time
+import traceback
+from utils.latency import LatencyHistogram
+from utils.logger import logger
+
+# Threads per library; a slow SDK can only tie up its own threads
+LIBRARY_MAX_WORKERS = {
+    'yfinance': 4,
+    'tastytrade': 4,
+}
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_TIMEOUT_SECONDS = 30
+LAG_CHECK_INTERVAL_SECONDS = 0.5
+LAG_THRESHOLD_SECONDS = 0.25
+# Innermost frames of the loop thread kept when it is caught blocking
+STACK_DEPTH = 8
+# Default of the timeout arguments, so None can mean "no timeout"
+_DEFAULT_TIMEOUT = object()
+
+
+def _call_name(func):
+    if isinstance(func, functools.partial):
+        func = func.func
+    return getattr(func, '__qualname__', None) or repr(func)
+
+
+class BlockingExecutor:
+    '''Runs blocking third-party SDK calls on bounded per-library thread pools.
+
+    Every call has a timeout. A call still queued when it times out or is
+    cancelled never starts; one already running cannot be interrupted and
+    finishes in its thread, but the caller stops waiting for it. Calls whose
+    result must not be lost, such as placing an order, pass timeout=None.
+    '''
+    def __init__(self, max_workers=None, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        self.max_workers = dict(LIBRARY_MAX_WORKERS, **(max_workers or {}))
+        self.timeout_seconds = timeout_seconds
+        self.pools = {}
+        self.histograms = {}
+        self.timeouts = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def configure(self, max_workers=None, timeout_seconds=None):
+        '''Change the caps and timeout; pools already created keep their size'''
+        self.max_workers.update(max_workers or {})
+        if timeout_seconds:
+            self.timeout_seconds = timeout_seconds
+
+    def pool(self, library):
+        with self.lock:
+            if library not in self.pools:
+                self.pools[library] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers.get(library, DEFAULT_MAX_WORKERS),
+                    thread_name_prefix=f'blocking-{library}'
+                )
+                self.histograms[library] = LatencyHistogram()
+                self.timeouts[library] = 0
+                self.errors[library] = 0
+            return self.pools[library]
+
+    async def run(self, library, func, *args, timeout=_DEFAULT_TIMEOUT, **kwargs):
+        '''Await func(*args, **kwargs) on library's pool without blocking the event loop'''
+        pool = self.pool(library)
+        timeout = self.timeout_seconds if timeout is _DEFAULT_TIMEOUT else timeout
+        started = time.monotonic()
+        future = asyncio.get_running_loop().run_in_executor(pool, functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._timed_out(library, func, timeout)
+            raise
+        except Exception:
+            self.errors[library] += 1
+            raise
+        finally:
+            self.histograms[library].add((time.monotonic() - started) * 1000)
+
+    def call(self, library, func, *args, timeout=_DEFAULT_TIMEOUT, **kwargs):
+        '''Synchronous run, for code that cannot await.
+
+        The caller still blocks, but the call counts against the library's cap
+        and times out.
+        '''
+        pool = self.pool(library)
+        timeout = self.timeout_seconds if timeout is _DEFAULT_TIMEOUT else timeout
+        started = time.monotonic()
+        future = pool.submit(func, *args, **kwargs)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self._timed_out(library, func, timeout)
+            raise
+        except Exception:
+            self.errors[library] += 1
+            raise
+        finally:
+            self.histograms[library].add((time.monotonic() - started) * 1000)
+
+    def _timed_out(self, library, func, timeout):
+        self.timeouts[library] += 1
+        logger.error('Blocking call timed out', extra={
+            'library': library, 'call': _call_name(func), 'timeout_seconds': timeout})
+
+    def metrics(self):
+        return {
+            library: dict(self.histograms[library].summary(), timeouts=self.timeouts[library], errors=self.errors[library],
+                          max_workers=self.max_workers.get(library, DEFAULT_MAX_WORKERS))
+            for library in self.pools
+        }
+
+    def shutdown(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.shutdown(wait=False, cancel_futures=True)
+            self.pools = {}
+
+
+class LoopLagMonitor:
+    '''Reports when something blocks the event loop, and what it was.
+
+    A task wakes up every interval_seconds and measures how late it is. A
+    watchdog thread watches the task's heartbeat; when the loop stalls for
+    longer than threshold_seconds it captures the loop thread's stack, so
+    the report names the call that was blocking rather than only the delay.
+    '''
+    def __init__(self, interval_seconds=LAG_CHECK_INTERVAL_SECONDS, threshold_seconds=LAG_THRESHOLD_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_seconds
+        self.histogram = LatencyHistogram()
+        self.heartbeat = None
+        self.loop_thread_id = None
+        self.blocked_stack = None
+        self.task = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        '''Start monitoring the running loop; a no-op if already running'''
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return self.task
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+        watchdog = threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval_seconds
+                await asyncio.sleep(self.interval_seconds)
+                self.heartbeat = time.monotonic()
+                self._check(self.heartbeat - expected)
+        finally:
+            self.stopped.set()
+
+    def _check(self, lag_seconds):
+        lag_seconds = max(lag_seconds, 0)
+        self.histogram.add(lag_seconds * 1000)
+        stack, self.blocked_stack = self.blocked_stack, None
+        if lag_seconds < self.threshold_seconds:
+            return
+        logger.warning('Event loop was blocked', extra={
+            'lag_seconds': round(lag_seconds, 3),
+            'blocked_in': stack[-1].strip().splitlines()[0] if stack else None,
+            'stack': ''.join(stack) if stack else None,
+        })
+
+    def _watch(self):
+        while not self.stopped.wait(self.threshold_seconds / 2):
+            stalled = time.monotonic() - self.heartbeat - self.interval_seconds
+            if stalled < self.threshold_seconds or self.blocked_stack is not None:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                self.blocked_stack = traceback.format_stack(frame)[-STACK_DEPTH:]
+
+    def metrics(self):
+        return self.histogram.summary()
+
+
+blocking_executor = BlockingExecutor()
+loop_lag_monitor = LoopLagMonitor()
+
+
+async def run_blocking(library, func, *args, **kwargs):
+    return await blocking_executor.run(library, func, *args, **kwargs)
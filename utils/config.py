@@ -8,8 +8,8 @@ from brokers.alpaca_broker import AlpacaBroker
 from brokers.kraken_broker import KrakenBroker
 from database.models import init_db
 from database.db_manager import DBManager
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import create_engine
+from database.write_queue import WriteBehindQueue
+from database.engines import get_async_engine, get_engine
 from strategies.constant_percentage_strategy import ConstantPercentageStrategy
 from strategies.random_yolo_hedge_strategy import RandomYoloHedge
 from strategies.black_swan_strategy import BlackSwanStrategy
@@ -117,13 +117,19 @@ def parse_config(config_path):
     return config
 
 def initialize_brokers(config):
-    # Create a single database engine for all brokers
-    if 'database' in config and 'url' in config['database']:
-        engine = create_async_engine(config['database']['url'])
-    elif os.environ.get("DATABASE_URL", None):
-        engine = create_async_engine(os.environ.get("DATABASE_URL"))
-    else:
-        engine = create_async_engine('sqlite+aiosqlite:///default_trading_system.db')
+    # All brokers share the process-wide engine
+    engine = create_database_engine(config)
+
+    # Optionally batch order writes of all brokers through one write-behind queue
+    write_behind = config.get('database', {}).get('write_behind', {})
+    write_queue = None
+    if write_behind.get('enabled'):
+        write_queue = WriteBehindQueue(
+            engine,
+            batch_size=write_behind.get('batch_size', 100),
+            flush_interval_seconds=write_behind.get('flush_interval_seconds', 0.5),
+            max_attempts=write_behind.get('max_attempts', 5)
+        )
 
     brokers = {}
     for broker_name, broker_config in config['brokers'].items():
@@ -131,12 +137,19 @@ def initialize_brokers(config):
             # Initialize the broker with the shared engine
             logger.debug(f"Initializing broker '{broker_name}' with config: {broker_config}")
             brokers[broker_name] = BROKER_MAP[broker_name](broker_config, engine)
+            brokers[broker_name].write_queue = write_queue
         except Exception as e:
             logger.error(f"Error initializing broker '{broker_name}': {e}")
             continue
 
     return brokers
 
+async def close_write_queues(brokers):
+    '''Drain the brokers' write-behind queue, so queued order writes survive a restart or shutdown'''
+    write_queues = {id(broker.write_queue): broker.write_queue for broker in brokers.values() if broker.write_queue is not None}
+    for write_queue in write_queues.values():
+        await write_queue.close()
+
 async def initialize_strategy(strategy_name, strategy_type, broker, config):
     constructor = STRATEGY_MAP.get(strategy_type)
     if constructor is None:
@@ -169,22 +182,42 @@ async def initialize_strategies(brokers, config):
             logger.error(f"Error initializing strategy '{strategy_name}': {e}")
     return strategies
 
+def _pool_config(config):
+    if isinstance(config, dict):
+        return config.get('database', {}).get('pool')
+    return None
+
+def _sqlite_config(config):
+    if isinstance(config, dict):
+        return config.get('database', {}).get('sqlite')
+    return None
+
 def create_api_database_engine(config, local_testing=False):
     if local_testing:
-        return create_engine('sqlite:///trading.db')
+        return get_engine('sqlite:///trading.db')
     if 'database' in config and 'url' in config['database']:
-        return create_engine(config['database']['url'])
-    return create_engine(os.environ.get("DATABASE_URL", 'sqlite:///default_trading_system.db'))
+        return get_engine(config['database']['url'], _pool_config(config), _sqlite_config(config))
+    return get_engine(os.environ.get("DATABASE_URL", 'sqlite:///default_trading_system.db'), _pool_config(config), _sqlite_config(config))
+
+
+def create_api_read_engine(config, local_testing=False):
+    '''Engine of the read replica serving dashboard queries, None without one'''
+    if local_testing or not isinstance(config, dict):
+        return None
+    read_url = config.get('database', {}).get('read_url') or os.environ.get("READ_DATABASE_URL")
+    if not read_url:
+        return None
+    return get_engine(read_url, _pool_config(config), _sqlite_config(config))
 
 
 def create_database_engine(config, local_testing=False):
     if local_testing:
-        return create_async_engine('sqlite+aiosqlite:///trading.db')
+        return get_async_engine('sqlite+aiosqlite:///trading.db')
     if type(config) == str:
-        return create_async_engine(config)
+        return get_async_engine(config)
     if 'database' in config and 'url' in config['database']:
-        return create_async_engine(config['database']['url'])
-    return create_async_engine(os.environ.get("DATABASE_URL", 'sqlite+aiosqlite:///default_trading_system.db'))
+        return get_async_engine(config['database']['url'], _pool_config(config), _sqlite_config(config))
+    return get_async_engine(os.environ.get("DATABASE_URL", 'sqlite+aiosqlite:///default_trading_system.db'), _pool_config(config), _sqlite_config(config))
 
 async def initialize_database(engine):
     try:
@@ -210,7 +243,7 @@ async def initialize_brokers_and_strategies(config):
     if config.get('rename_strategies'):
         for strategy in config['rename_strategies']:
             try:
-                DBManager(engine).rename_strategy(strategy['broker'], strategy['old_strategy_name'], strategy['new_strategy_name'])
+                await DBManager(engine).rename_strategy(strategy['broker'], strategy['old_strategy_name'], strategy['new_strategy_name'])
             except Exception as e:
                 logger.error('Failed to rename strategy', extra={'error': str(e), 'renameStrategyConfig': strategy}, exc_info=True)
                 raise
@@ -0,0 +1,195 @@
+import bisect
+import contextvars
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import insert, case, literal_column
+from database.models import OrderLatency
+from utils.logger import logger
+from utils.utils import is_option, is_futures_symbol
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKET_BOUNDS_MS = (
+    1, 2, 5, 10, 25, 50, 100, 250, 500,
+    1000, 2500, 5000, 10000, 30000, 60000,
+    5 * 60000, 15 * 60000, 60 * 60000,
+)
+REPORT_INTERVAL_SECONDS = 60 * 5
+# Cap on samples buffered between two reports so a stalled DB cannot grow memory
+MAX_PENDING_SAMPLES = 10000
+
+# Order lifecycle stages, in the order they happen
+STAGES = (
+    'decision_to_submit',       # rebalance started -> order sent to the broker
+    'pre_checks',               # has_bought_today and friends
+    'submit_to_ack',            # broker API round trip
+    'ack_to_fill',              # order accepted -> fill seen by the OrderManager
+    'fill_to_position_update',  # fill seen -> positions updated in the DB
+)
+
+_decision_started = contextvars.ContextVar('order_decision_started', default=None)
+
+
+def asset_class(symbol):
+    '''Asset class label used to bucket latencies'''
+    if not symbol:
+        return 'unknown'
+    if is_futures_symbol(symbol):
+        # A future option has its expiry and strike after the future, e.g. './CLU4 240725P19300'
+        return 'future_option' if ' ' in symbol else 'future'
+    if is_option(symbol):
+        return 'option'
+    return 'equity'
+
+
+@contextmanager
+def order_decision():
+    '''Mark the moment a strategy started deciding to place orders.
+
+    The broker reads it back when the order is submitted, so the decision
+    time does not have to be threaded through every place_order signature.
+    An already open decision is kept, so the outermost one (the start of a
+    rebalance, before any positions are read or orders sized) is measured.
+    '''
+    if _decision_started.get() is not None:
+        yield
+        return
+    token = _decision_started.set(time.monotonic())
+    try:
+        yield
+    finally:
+        _decision_started.reset(token)
+
+
+def decision_started():
+    return _decision_started.get()
+
+
+def latency_bucket(column, bounds=BUCKET_BOUNDS_MS):
+    '''SQL expression giving the LatencyHistogram bucket index of a latency column'''
+    # Literal bounds keep the expression identical wherever it is repeated (GROUP BY)
+    return case(
+        *[(column <= literal_column(str(bound)), literal_column(str(i))) for i, bound in enumerate(bounds)],
+        else_=literal_column(str(len(bounds)))
+    )
+
+
+class LatencyHistogram:
+    def __init__(self, bounds=BUCKET_BOUNDS_MS):
+        self.bounds = bounds
+        # One extra bucket for everything above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, latency_ms):
+        self.counts[bisect.bisect_left(self.bounds, latency_ms)] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def add_bucket(self, index, count, total_ms, max_ms):
+        '''Merge a bucket's aggregates, as returned by latency_bucket queries'''
+        self.counts[index] += count
+        self.count += count
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, max_ms)
+
+    def percentile(self, q):
+        '''Upper bound of the bucket holding the q-th percentile (0 < q <= 100)'''
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                if i == len(self.bounds):
+                    return self.max_ms
+                return min(self.bounds[i], self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 2) if self.count else None,
+            'max_ms': round(self.max_ms, 2),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+        }
+
+
+class LatencyTracker:
+    '''Per-broker, per-asset-class and per-order-type latency histograms for each order stage.
+
+    Histograms live in memory for the periodic log summary; raw samples are
+    also flushed to the order_latencies table so the API server, which runs
+    in a different process, can serve percentiles across all processes.
+    '''
+    def __init__(self, report_interval_seconds=REPORT_INTERVAL_SECONDS):
+        self.report_interval_seconds = report_interval_seconds
+        self.histograms = {}
+        self.pending = []
+        self.last_report = time.monotonic()
+
+    def record(self, broker, asset_class, order_type, stage, seconds):
+        latency_ms = max(seconds, 0) * 1000
+        order_type = order_type or 'unknown'
+        key = (broker, asset_class, order_type, stage)
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram()
+        self.histograms[key].add(latency_ms)
+        if len(self.pending) < MAX_PENDING_SAMPLES:
+            self.pending.append({
+                'broker': broker,
+                'asset_class': asset_class,
+                'order_type': order_type,
+                'stage': stage,
+                'latency_ms': latency_ms,
+                'timestamp': datetime.now(),
+            })
+        logger.debug('Recorded order latency', extra={
+            'broker': broker, 'asset_class': asset_class, 'order_type': order_type, 'stage': stage, 'latency_ms': latency_ms})
+
+    @contextmanager
+    def time(self, broker, asset_class, order_type, stage):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(broker, asset_class, order_type, stage, time.monotonic() - started)
+
+    def summary(self):
+        return [
+            {'broker': broker, 'asset_class': asset_class, 'order_type': order_type, 'stage': stage, **histogram.summary()}
+            for (broker, asset_class, order_type, stage), histogram in sorted(self.histograms.items())
+        ]
+
+    def log_summary(self):
+        for row in self.summary():
+            logger.info('Order latency summary', extra=row)
+
+    async def flush(self, engine):
+        if not self.pending:
+            return 0
+        samples, self.pending = self.pending, []
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(insert(OrderLatency), samples)
+        except Exception as e:
+            logger.error('Failed to persist order latencies', extra={'error': str(e), 'samples': len(samples)})
+            return 0
+        return len(samples)
+
+    async def report_if_due(self, engine):
+        '''Log the histogram summary and persist samples every report interval'''
+        if time.monotonic() - self.last_report < self.report_interval_seconds:
+            return
+        self.last_report = time.monotonic()
+        self.log_summary()
+        await self.flush(engine)
+
+
+latency_tracker = LatencyTracker()
@@ -0,0 +1,37 @@
+'''Performance statistics over trade profit/loss, shared by the API and the backtester'''
+import numpy as np
+from scipy.stats import norm
+
+
+def value_at_risk(profit_losses, confidence=0.95):
+    if not profit_losses:
+        return 0
+    return norm.ppf(1 - confidence, np.mean(profit_losses), np.std(profit_losses))
+
+
+def max_drawdown(profit_losses):
+    if not profit_losses:
+        return 0
+    cum_returns = np.cumsum(profit_losses)
+    running_max = np.maximum.accumulate(cum_returns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = (running_max - cum_returns) / running_max
+    return np.max(drawdowns)
+
+
+def sharpe_ratio(profit_losses):
+    if not profit_losses:
+        return 0
+    std_dev_return = np.std(profit_losses)
+    return np.mean(profit_losses) / std_dev_return if std_dev_return != 0 else 0
+
+
+def equity_max_drawdown(equity):
+    '''Largest peak-to-trough fall of an equity curve, as a fraction of the peak'''
+    equity = np.asarray(equity, dtype=float)
+    if len(equity) == 0:
+        return 0.0
+    running_max = np.maximum.accumulate(equity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = np.where(running_max > 0, (running_max - equity) / running_max, 0.0)
+    return float(np.max(drawdowns))
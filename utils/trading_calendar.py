@@ -0,0 +1,223 @@
+'''Exchange trading calendars.
+
+Sessions are precomputed a year at a time as sorted (open, close) pairs in
+UTC, so is_open, next_open and next_close are a bisect over the table.
+Years are added the first time a timestamp in or next to them is looked up.
+'''
+import bisect
+from datetime import datetime, date, time, timedelta, timezone
+import pytz
+
+EASTERN = pytz.timezone('US/Eastern')
+
+# NYSE closures outside the regular holiday rules
+NYSE_SPECIAL_CLOSURES = {
+    date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14),
+    date(2004, 6, 11), date(2007, 1, 2), date(2012, 10, 29), date(2012, 10, 30),
+    date(2018, 12, 5), date(2025, 1, 9),
+}
+
+
+def _easter(year):
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return date(year, month, day)
+
+
+def _nth_weekday(year, month, weekday, n):
+    '''The n-th weekday (0 = Monday) of the month, n = -1 for the last one'''
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def _new_years_day(year):
+    # Not observed on the Friday before when it falls on a Saturday
+    day = date(year, 1, 1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day if day.weekday() < 5 else None
+
+
+def us_holidays(year):
+    '''Regular NYSE holidays of year, as observed'''
+    holidays = {
+        _nth_weekday(year, 2, 0, 3),
+        _easter(year) - timedelta(days=2),
+        _nth_weekday(year, 5, 0, -1),
+        _observed(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),
+        _nth_weekday(year, 11, 3, 4),
+        _observed(date(year, 12, 25)),
+    }
+    if _new_years_day(year):
+        holidays.add(_new_years_day(year))
+    if year >= 1998:
+        holidays.add(_nth_weekday(year, 1, 0, 3))
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19)))
+    return holidays
+
+
+def us_early_closes(year):
+    '''Days the NYSE closes at 1 PM: July 3rd, the day after Thanksgiving and Christmas Eve'''
+    closes = {_nth_weekday(year, 11, 3, 4) + timedelta(days=1)}
+    for day in (date(year, 7, 3), date(year, 12, 24)):
+        # On a Friday they are the observed holiday instead
+        if day.weekday() < 4:
+            closes.add(day)
+    return closes
+
+
+def _eastern(day, at):
+    return EASTERN.localize(datetime.combine(day, at)).astimezone(timezone.utc)
+
+
+def nyse_sessions(year):
+    holidays = us_holidays(year) | {day for day in NYSE_SPECIAL_CLOSURES if day.year == year}
+    early_closes = us_early_closes(year)
+    sessions = []
+    day = date(year, 1, 1)
+    while day.year == year:
+        if day.weekday() < 5 and day not in holidays:
+            close = time(13, 0) if day in early_closes else time(16, 0)
+            sessions.append((_eastern(day, time(9, 30)), _eastern(day, close)))
+        day += timedelta(days=1)
+    return sessions
+
+
+def cme_globex_sessions(year):
+    '''CME Globex equity index futures, one session per trade date.
+
+    A session opens at 6 PM Eastern the evening before its trade date and
+    closes at 5 PM. New Year's Day, Good Friday and Christmas have no session,
+    other US holidays close at 1 PM and NYSE half days at 1:15 PM.
+    '''
+    holidays = us_holidays(year)
+    early_closes = us_early_closes(year)
+    closed = {_new_years_day(year), _easter(year) - timedelta(days=2), _observed(date(year, 12, 25))}
+    sessions = []
+    day = date(year, 1, 1)
+    while day.year == year:
+        if day.weekday() < 5 and day not in closed:
+            if day in holidays:
+                close = time(13, 0)
+            elif day in early_closes:
+                close = time(13, 15)
+            else:
+                close = time(17, 0)
+            sessions.append((_eastern(day - timedelta(days=1), time(18, 0)), _eastern(day, close)))
+        day += timedelta(days=1)
+    return sessions
+
+
+def crypto_sessions(year):
+    # Always open; one session per calendar year keeps the tables uniform
+    return [(datetime(year, 1, 1, tzinfo=timezone.utc), datetime(year + 1, 1, 1, tzinfo=timezone.utc))]
+
+
+class TradingCalendar:
+    '''Trading sessions of one exchange.
+
+    Timestamps may be aware or naive UTC; returned datetimes are aware UTC.
+    '''
+    def __init__(self, name, sessions_for_year):
+        self.name = name
+        self.sessions_for_year = sessions_for_year
+        self.first_year = None
+        self.last_year = None
+        self.opens = []
+        self.closes = []
+
+    def _cover(self, year):
+        if self.first_year is None:
+            self.first_year, self.last_year = year, year - 1
+        if year - 1 < self.first_year:
+            sessions = [s for y in range(year - 1, self.first_year) for s in self.sessions_for_year(y)]
+            self.opens[:0] = [open_ for open_, _ in sessions]
+            self.closes[:0] = [close for _, close in sessions]
+            self.first_year = year - 1
+        if year + 1 > self.last_year:
+            sessions = [s for y in range(self.last_year + 1, year + 2) for s in self.sessions_for_year(y)]
+            self.opens.extend(open_ for open_, _ in sessions)
+            self.closes.extend(close for _, close in sessions)
+            self.last_year = year + 1
+
+    def _prepare(self, ts):
+        if ts is None:
+            ts = datetime.now(timezone.utc)
+        elif ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        else:
+            ts = ts.astimezone(timezone.utc)
+        self._cover(ts.year)
+        return ts
+
+    def session(self, ts=None):
+        '''The (open, close) session containing ts, or None'''
+        ts = self._prepare(ts)
+        index = bisect.bisect_right(self.opens, ts) - 1
+        if index >= 0 and ts < self.closes[index]:
+            return self.opens[index], self.closes[index]
+        return None
+
+    def is_open(self, ts=None):
+        return self.session(ts) is not None
+
+    def next_open(self, ts=None):
+        '''Open of the first session starting at or after ts'''
+        ts = self._prepare(ts)
+        index = bisect.bisect_left(self.opens, ts)
+        if index == len(self.opens):
+            self._cover(self.last_year + 1)
+        return self.opens[index]
+
+    def next_close(self, ts=None):
+        '''Close of the session containing ts, or of the next one'''
+        ts = self._prepare(ts)
+        index = bisect.bisect_right(self.closes, ts)
+        if index == len(self.closes):
+            self._cover(self.last_year + 1)
+        return self.closes[index]
+
+    def seconds_until_open(self, ts=None):
+        ts = self._prepare(ts)
+        if self.is_open(ts):
+            return 0.0
+        return (self.next_open(ts) - ts).total_seconds()
+
+
+NYSE = TradingCalendar('NYSE', nyse_sessions)
+CME_GLOBEX = TradingCalendar('CME_GLOBEX', cme_globex_sessions)
+CRYPTO = TradingCalendar('CRYPTO', crypto_sessions)
+CALENDARS = {calendar.name: calendar for calendar in (NYSE, CME_GLOBEX, CRYPTO)}
+
+
+def get_calendar(name):
+    if name not in CALENDARS:
+        raise ValueError(f"Unknown trading calendar: {name}")
+    return CALENDARS[name]
+
+
+def seconds_until_open(calendars, ts=None):
+    '''Seconds until any of calendars is open, 0 if one already is'''
+    return min(calendar.seconds_until_open(ts) for calendar in calendars)
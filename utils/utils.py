@@ -1,10 +1,10 @@
-from datetime import datetime, time, date
+from datetime import datetime, date
 import re
-import pytz
 from decimal import Decimal
 import math
 from scipy.stats import norm
 from utils.logger import logger
+from utils.trading_calendar import NYSE, CME_GLOBEX
 
 OPTION_MULTIPLIER = 100
 
@@ -94,6 +94,14 @@ def is_option(symbol):
     pattern = re.compile(r'^[A-Z]{1,5}\d{6}[CP]\d{8}$')
     return bool(pattern.match(symbol))
 
+def contract_multiplier(symbol):
+    '''Shares or units of the underlying per contract of symbol'''
+    if is_option(symbol):
+        return OPTION_MULTIPLIER
+    if is_futures_symbol(symbol):
+        return futures_contract_size(symbol)
+    return 1
+
 def extract_option_details(option_symbol):
     # Example pattern: AAPL230721C00250000 (AAPL, 2023-07-21, Call, 250.00)
     match = re.match(r'^([A-Z]+)(\d{2})(\d{2})(\d{2})([CP])(\d{8})$', option_symbol)
@@ -117,54 +125,13 @@ def extract_underlying_symbol(option_symbol):
         return None  # Return None if no match is found
 
 # TODO: enhance/fix
-def is_futures_market_open():
-    # Futures market open and close times (6:00 PM to 5:00 PM Eastern Time, Sunday to Friday)
-    market_open_time = time(18, 0)  # 6:00 PM
-    market_close_time = time(17, 0)  # 5:00 PM
-
-    # Get current time in Eastern Time
-    eastern = pytz.timezone('US/Eastern')
-    current_time = datetime.now(eastern)
-
-    # Check if today is Saturday
-    if current_time.weekday() == 5:  # 5 = Saturday
-        return False
-
-    # Check if today is Sunday
-    if current_time.weekday() == 6:  # 6 = Sunday
-        if current_time.time() < market_open_time:
-            return False
-        return True
-
-    # For other days, check if the time is within the market open and close times
-    if current_time.weekday() in [0, 1, 2, 3, 4]:  # Monday to Friday
-        if current_time.time() < market_close_time:
-            return True
-        if current_time.time() >= market_open_time:
-            return True
-        return False
-
-    return False
-
-def is_market_open():
-    # Define market open and close times (e.g., 9:30 AM to 4:00 PM Eastern Time)
-    market_open = time(9, 30)
-    market_close = time(16, 0)
-
-    # Get current time in Eastern Time
-    eastern = pytz.timezone('US/Eastern')
-    current_time = datetime.now(eastern).time()
-
-    # Check if today is a weekend
-    current_date = datetime.now(eastern).date()
-    if current_date.weekday() >= 5:  # 5 = Saturday, 6 = Sunday
-        return False
-
-    # Check if current time is within market hours
-    if market_open <= current_time <= market_close:
-        return True
-
-    return False
+def is_futures_market_open(ts=None):
+    # CME Globex: 6:00 PM to 5:00 PM Eastern Time, Sunday to Friday, with holiday closures
+    return CME_GLOBEX.is_open(ts)
+
+def is_market_open(ts=None):
+    # NYSE: 9:30 AM to 4:00 PM Eastern Time on trading days, 1:00 PM on half days
+    return NYSE.is_open(ts)
 
 def black_scholes_delta_theta(position):
     """